@@ -0,0 +1,5 @@
+"""
+Бенчмарки matcher.py: генератор синтетических пулов и прогон match_lunch по размерам пула.
+Запуск: python -m bench.runner (см. --help).
+"""
+from .generator import generate_places, generate_users, write_places_csv
@@ -0,0 +1,303 @@
+"""
+Микро-бенчмарки хранилища и обработчиков бота на пулах разного размера.
+
+    python -m bench.bot_bench --sizes 100,1000,10000 -o bot_bench.json
+
+Для каждого размера пула создаётся временная рабочая папка с data/ (users_data.csv,
+users_to_match.json, notified_groups.json, output.json, places.csv) и logs/, и в ней
+замеряются save_user_data, get_user_data, update_user_to_match, is_user_notified,
+mark_user_notified, notify_all_new_groups и полная цепочка записи на обед
+(callback menu:book_lunch через Dispatcher, настоящий matcher.py, поддельный Bot API).
+Запускать из корня репозитория: бот читает config.py при импорте.
+"""
+import argparse
+import asyncio
+import contextlib
+import copy
+import csv
+import io
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from .generator import generate_places, generate_users, write_places_csv
+from .runner import load_baseline
+
+DEFAULT_SIZES = [100, 1000, 10000]
+OPERATIONS = ["save_user_data", "get_user_data", "update_user_to_match", "is_user_notified",
+              "mark_user_notified", "notify_all_new_groups", "book_lunch_chain"]
+# Профили в реальном пуле повторяются (выбор из меню); столько различных профилей в пуле бенчмарка
+DISTINCT_PROFILES = 24
+BENCH_NOW = datetime(2026, 1, 5, 10, 0)
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def user_id_of(i: int) -> int:
+    return 100000 + i
+
+
+def profile_from_params(params: Dict) -> Dict:
+    """Профиль users_data.csv (формат save_user_data) из параметров матчинга."""
+    return {
+        'office': params['office'],
+        'time_slots': [list(slot) for slot in params['time_slots']],
+        'lunch_duration': str(params['max_lunch_duration']),
+        'favorite_places': list(params['favourite_places']),
+        'disliked_places': list(params['non_desirable_places']),
+        'company_size': list(params['team_size_lst']),
+    }
+
+
+@contextlib.contextmanager
+def bot_workspace(n_users: int, seed: int = 1, reserve: int = 0, office_names: Optional[List[str]] = None):
+    """
+    Временная рабочая папка с пулом из n_users пользователей. cwd переключается в неё,
+    т.к. бот работает с относительными путями data/ и logs/. Профили всех есть в
+    users_data.csv, а последние reserve ещё не записаны на обед (их записывает замер полной
+    цепочки). office_names — названия офисов в каталоге мест. matcher.py и его модули
+    подкладываются ссылками, чтобы запуск matcher.py ботом работал как в репозитории.
+    """
+    import matcher
+    from bot.utils import USERS_CSV_HEADER
+
+    previous_cwd = os.getcwd()
+    workspace = tempfile.mkdtemp(prefix="bot_bench_")
+    try:
+        os.makedirs(os.path.join(workspace, "data"))
+        os.makedirs(os.path.join(workspace, "logs"))
+        for name in ("matcher.py", "timeutils.py", "logutils.py"):
+            os.symlink(os.path.join(REPO_ROOT, name), os.path.join(workspace, name))
+        os.chdir(workspace)
+
+        offices = len(office_names) if office_names else 3
+        places = generate_places(offices, seed=seed, office_names=office_names)
+        write_places_csv(places, os.path.join("data", "places.csv"))
+        users = generate_users(n_users, offices, places, seed=seed, distinct_profiles=DISTINCT_PROFILES)
+        with open(os.path.join("data", "users_data.csv"), "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(USERS_CSV_HEADER)
+            for i, user in enumerate(users):
+                profile = profile_from_params(user["parameters"])
+                writer.writerow([
+                    user_id_of(i), user["login"], profile['office'],
+                    ';'.join(f"{start}-{end}" for start, end in profile['time_slots']),
+                    profile['lunch_duration'], ';'.join(profile['favorite_places']),
+                    ';'.join(profile['disliked_places']), ';'.join(profile['company_size']),
+                    BENCH_NOW.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                ])
+        booked = users[:n_users - reserve]
+        with open(os.path.join("data", "users_to_match.json"), "w", encoding="utf-8") as f:
+            json.dump(booked, f, ensure_ascii=False, indent=2)
+        groups = matcher.match_lunch(copy.deepcopy(booked), os.path.join("data", "places.csv"),
+                                     now=BENCH_NOW) if booked else []
+        with open(os.path.join("data", "output.json"), "w", encoding="utf-8") as f:
+            json.dump(groups, f, ensure_ascii=False, indent=2)
+        yield users, groups
+    finally:
+        os.chdir(previous_cwd)
+        shutil.rmtree(workspace, ignore_errors=True)
+
+
+@contextlib.contextmanager
+def pin_matcher(now: datetime):
+    """
+    matcher.py, запускаемый ботом, считает от фиксированного момента now (иначе результат
+    и объём рассылки зависят от времени суток запуска). Возвращает счётчик запусков matcher.py.
+    """
+    from bot import utils
+
+    runs = {"count": 0}
+    matcher_command = utils._matcher_command
+
+    def pinned(*args, **kwargs):
+        runs["count"] += 1
+        return matcher_command(*args, **kwargs) + ["--now", now.isoformat()]
+
+    utils._matcher_command = pinned
+    try:
+        yield runs
+    finally:
+        utils._matcher_command = matcher_command
+
+
+def _summary(op: str, n_users: int, timings: List[float]) -> Dict:
+    ordered = sorted(timings)
+    return {
+        "op": op,
+        "n": n_users,
+        "calls": len(timings),
+        "median_ms": round(statistics.median(ordered) * 1000, 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+async def _measure(call: Callable, repeat: int, budget: float) -> List[float]:
+    """Вызывает call до repeat раз (хотя бы один), пока суммарное время не превысит budget секунд."""
+    timings = []
+    while len(timings) < repeat and (not timings or sum(timings) < budget):
+        started = time.perf_counter()
+        result = call()
+        if asyncio.iscoroutine(result):
+            await result
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+async def bench_size(n_users: int, operations: List[str], repeat: int, budget: float, seed: int) -> List[Dict]:
+    from aiogram import Dispatcher
+    from aiogram.fsm.storage.memory import MemoryStorage
+
+    from bot import register_all_handlers
+    from bot import results, utils
+    from bot.handlers import notify_all_new_groups
+    from .fake_api import callback_update, make_bot
+
+    rng = random.Random(seed)
+    rows = []
+    reserve = min(repeat, n_users // 10) if "book_lunch_chain" in operations else 0
+    with bot_workspace(n_users, seed, reserve) as (users, groups):
+        group_keys = {}
+        for group in groups:
+            key = results.group_key(group)
+            for login in group["participants"]:
+                group_keys[login] = key
+        utils.write_notified_groups(group_keys)
+
+        def pick():
+            i = rng.randrange(n_users - reserve)
+            return i, users[i]
+
+        def save_user_data():
+            i, user = pick()
+            utils.save_user_data(user_id_of(i), user["login"], profile_from_params(user["parameters"]))
+
+        def get_user_data():
+            utils.get_user_data(user_id_of(pick()[0]))
+
+        def update_user_to_match():
+            _, user = pick()
+            utils.update_user_to_match(user["login"], user["parameters"])
+
+        def is_user_notified():
+            _, user = pick()
+            utils.is_user_notified(user["login"], group_keys.get(user["login"], ""))
+
+        def mark_user_notified():
+            _, user = pick()
+            utils.mark_user_notified(user["login"], group_keys.get(user["login"], ""))
+
+        bot = make_bot()
+        dispatcher = Dispatcher(storage=MemoryStorage())
+        register_all_handlers(dispatcher)
+        update_ids = iter(range(1, 1 << 30))
+        newcomers = iter(range(n_users - reserve, n_users))
+
+        async def notify():
+            # Рассылка с нуля (худший случай): пустой notified_groups.json — оповещается весь пул
+            utils.write_notified_groups({})
+            await notify_all_new_groups(bot, os.path.join("data", "output.json"))
+
+        async def book_lunch_chain():
+            # Записывается новый пользователь: шард его офиса устаревает и matcher.py пересчитывает его
+            i = next(newcomers)
+            user = users[i]
+            await dispatcher.feed_update(bot, callback_update(next(update_ids), user_id_of(i), user["login"],
+                                                              "menu:book_lunch"))
+
+        calls = {
+            "save_user_data": save_user_data,
+            "get_user_data": get_user_data,
+            "update_user_to_match": update_user_to_match,
+            "is_user_notified": is_user_notified,
+            "mark_user_notified": mark_user_notified,
+            "notify_all_new_groups": notify,
+            "book_lunch_chain": book_lunch_chain,
+        }
+        try:
+            with pin_matcher(BENCH_NOW):
+                for op in operations:
+                    op_repeat = reserve if op == "book_lunch_chain" else repeat
+                    # Обработчики печатают отладку в stdout — в отчёт она не попадает
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        timings = await _measure(calls[op], op_repeat, budget)
+                    row = _summary(op, n_users, timings)
+                    if op in ("notify_all_new_groups", "book_lunch_chain"):
+                        row["api_calls"] = len(bot.session.calls)
+                        bot.session.calls.clear()
+                    rows.append(row)
+                    print(format_row(row), flush=True)
+        finally:
+            await bot.session.close()
+    return rows
+
+
+def format_row(row: Dict) -> str:
+    return (f"{row['op']:<24}{row['n']:>7}{row['calls']:>7}{row['median_ms']:>12.3f}"
+            f"{row['p95_ms']:>12.3f}{row['max_ms']:>12.3f}")
+
+
+def compare(report: Dict, baseline: Dict, threshold: float) -> List[str]:
+    base = {(r["op"], r["n"]): r for r in baseline.get("results", [])}
+    regressions = []
+    for row in report["results"]:
+        old = base.get((row["op"], row["n"]))
+        if old and row["median_ms"] > old["median_ms"] * (1 + threshold) and row["median_ms"] - old["median_ms"] > 1:
+            regressions.append(f"{row['op']} N={row['n']}: {old['median_ms']} -> {row['median_ms']} мс")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Микро-бенчмарки хранилища и обработчиков бота.")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)))
+    parser.add_argument("--ops", default=",".join(OPERATIONS), help="Операции через запятую")
+    parser.add_argument("--repeat", type=int, default=20, help="Максимум вызовов на операцию")
+    parser.add_argument("--budget", type=float, default=10.0, help="Бюджет времени на операцию, секунды (один вызов выполняется всегда)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("-o", "--output", default=None, help="Куда сохранить отчёт")
+    parser.add_argument("--baseline", default=None, help="JSON базового отчёта для сравнения")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--threshold", type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    import logging
+    logging.disable(logging.CRITICAL)
+    sys.path.insert(0, REPO_ROOT)
+    operations = [op for op in args.ops.split(",") if op]
+    unknown = set(operations) - set(OPERATIONS)
+    if unknown:
+        parser.error(f"неизвестные операции: {', '.join(sorted(unknown))}")
+
+    report = {"created": datetime.now().isoformat(timespec="seconds"), "results": []}
+    print(f"{'op':<24}{'N':>7}{'calls':>7}{'median_ms':>12}{'p95_ms':>12}{'max_ms':>12}")
+    for n_users in sorted(int(n) for n in args.sizes.split(",")):
+        report["results"].extend(asyncio.run(bench_size(n_users, operations, args.repeat, args.budget, args.seed)))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if not args.baseline:
+        return 0
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        return 0
+    baseline = load_baseline(args.baseline)
+    if baseline is None:
+        print(f"Базовый отчёт {args.baseline} не найден, сравнение пропущено")
+        return 0
+    regressions = compare(report, baseline, args.threshold)
+    for line in regressions:
+        print(f"РЕГРЕССИЯ {line}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
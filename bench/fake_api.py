@@ -0,0 +1,85 @@
+"""
+Поддельный Telegram Bot API для бенчмарков и нагрузочных прогонов: бот работает
+с настоящими Dispatcher и обработчиками, но запросы к API не уходят в сеть.
+"""
+import asyncio
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.types import CallbackQuery, Chat, Message, Update, User
+
+FAKE_TOKEN = "123456:FAKE-TOKEN-FOR-BENCHMARKS"
+
+
+class FakeSession(BaseSession):
+    """
+    Сессия, отвечающая на любой метод API без сети: Message для методов, возвращающих
+    сообщение, True для остальных. latency — искусственная задержка ответа, секунды.
+    Все вызовы записываются в calls как (метод API, chat_id).
+    """
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls: List[Tuple[str, Optional[int]]] = []
+
+    async def make_request(self, bot, method, timeout=None):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        chat_id = getattr(method, "chat_id", None)
+        self.calls.append((method.__api_method__, chat_id))
+        if method.__returning__ is Message:
+            return Message(
+                message_id=len(self.calls),
+                date=datetime.now(),
+                chat=Chat(id=chat_id if isinstance(chat_id, int) else 0, type="private"),
+                text=getattr(method, "text", None),
+            )
+        return True
+
+    async def stream_content(self, url, timeout=None, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+    def count(self, api_method: str) -> int:
+        return sum(1 for name, _ in self.calls if name == api_method)
+
+
+def make_bot(latency: float = 0.0) -> Bot:
+    return Bot(token=FAKE_TOKEN, session=FakeSession(latency))
+
+
+def _user(user_id: int, username: Optional[str]) -> User:
+    return User(id=user_id, is_bot=False, first_name=username or str(user_id), username=username)
+
+
+def message_update(update_id: int, user_id: int, username: Optional[str], text: str) -> Update:
+    """Входящее текстовое сообщение (например, команда /start)."""
+    return Update(update_id=update_id, message=Message(
+        message_id=update_id,
+        date=datetime.now(),
+        chat=Chat(id=user_id, type="private"),
+        from_user=_user(user_id, username),
+        text=text,
+    ))
+
+
+def callback_update(update_id: int, user_id: int, username: Optional[str], data: str,
+                    message_id: int = 1) -> Update:
+    """Нажатие inline-кнопки с callback_data=data под сообщением бота message_id."""
+    return Update(update_id=update_id, callback_query=CallbackQuery(
+        id=str(update_id),
+        from_user=_user(user_id, username),
+        chat_instance=str(user_id),
+        data=data,
+        message=Message(
+            message_id=message_id,
+            date=datetime.now(),
+            chat=Chat(id=user_id, type="private"),
+            text="Главное меню:",
+        ),
+    ))
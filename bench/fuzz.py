@@ -0,0 +1,324 @@
+"""
+Дифференциальный фаззинг: быстрые движки подбора против эталонного перебора сочетаний.
+
+    python -m bench.fuzz --iterations 500 --seed 1
+    python -m bench.fuzz --pool large
+    python -m bench.fuzz --replay
+
+На маленьких случайных пулах (где перебор ещё укладывается во время) оба движка
+запускаются с одним и тем же фиксированным now, и для результата быстрого движка
+проверяются инварианты: участник не больше чем в одной группе, окно внутри слотов
+каждого участника, размер группы разрешён всеми, место подходит по офису,
+вместимости, любимым и нежелательным местам, одиночек не больше, чем у эталона.
+Упавший вход ужимается до минимального и сохраняется в test/fuzz/ — --replay
+прогоняет все сохранённые воспроизведения.
+Пулы двух видов: small — до MAX_USERS человек из разных офисов, large — один офис,
+LARGE_USERS человек с перекрывающимися слотами и размерами 6+/18+ (путь больших групп).
+По умолчанию (mixed) каждая четвёртая итерация — large. Большие группы быстрый движок
+собирает жадно, так что редкое more_solos_than_reference на large — повод посмотреть эвристику.
+"""
+import argparse
+import copy
+import glob
+import hashlib
+import json
+import logging
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+import matcher
+from timeutils import to_minutes
+from . import reference
+from .generator import COMPANY_SIZES, LUNCH_DURATIONS, TIME_OPTIONS
+
+PLACES_FILE = "test/places.csv"
+REPRO_DIR = os.path.join("test", "fuzz")
+FUZZ_NOW = datetime(2026, 1, 5, 10, 0)
+MAX_USERS = 8
+# Пул одного офиса для больших групп: перебор эталона до 6 человек на 12 ещё быстрый
+LARGE_USERS = (6, 12)
+LARGE_SIZES = [["6+"], ["6+"], ["6+", "3-5"], ["18+"], ["6+", "18+"], ["2", "3-5", "6+"]]
+
+# Быстрые движки: (users, places, now) -> группы в формате выходного JSON
+ENGINES: Dict[str, Callable] = {
+    "fast": matcher.find_all_lunch_groups,
+}
+
+
+def random_pool(rng: random.Random, places: List[Dict]) -> List[Dict]:
+    """Маленький пул: слоты по TIME_OPTIONS и вне сетки, пустые слоты, несколько офисов, кластеры одинаковых профилей."""
+    offices = sorted({p["office_name"] for p in places}) + ["Nowhere"]
+    names = [p["name"] for p in places]
+    users = []
+    for i in range(rng.randint(2, MAX_USERS)):
+        if users and rng.random() < 0.3:
+            # Копия чьего-то профиля: проверяет склейку одинаковых пользователей в классы
+            params = copy.deepcopy(rng.choice(users)["parameters"])
+        else:
+            slots = []
+            for _ in range(rng.choice([0, 1, 1, 1, 2]) if rng.random() < 0.1 else rng.choice([1, 1, 2])):
+                a = rng.randrange(len(TIME_OPTIONS) - 1)
+                b = rng.randrange(a + 1, len(TIME_OPTIONS))
+                start, end = TIME_OPTIONS[a], TIME_OPTIONS[b]
+                if rng.random() < 0.2:
+                    start = f"{start[:3]}{rng.randrange(0, 30):02d}"
+                slots.append([start, end])
+            params = {
+                "office": rng.choice(offices[:-1]) if rng.random() < 0.95 else offices[-1],
+                "time_slots": slots,
+                "max_lunch_duration": rng.choice(LUNCH_DURATIONS),
+                "favourite_places": rng.sample(names, rng.randint(0, 3)),
+                "non_desirable_places": rng.sample(names, rng.randint(0, 2)),
+                "team_size_lst": rng.sample(COMPANY_SIZES, rng.randint(1, 3)),
+            }
+        users.append({"login": f"u{i + 1}", "parameters": params})
+    return users
+
+
+def random_large_pool(rng: random.Random, places: List[Dict]) -> List[Dict]:
+    """Пул одного офиса на LARGE_USERS человек: общие окна, размеры 6+/18+, любимые места с большими столами."""
+    office = rng.choice(sorted({p["office_name"] for p in places}))
+    office_places = [p for p in places if p["office_name"] == office]
+    big = [p["name"] for p in office_places if p["max_table_size"] >= 6] or [p["name"] for p in office_places]
+    names = [p["name"] for p in office_places]
+    # Несколько общих окон на весь пул — чтобы нашлось 6 и больше совместимых по времени
+    windows = []
+    for _ in range(rng.randint(1, 3)):
+        a = rng.randrange(len(TIME_OPTIONS) - 2)
+        windows.append([TIME_OPTIONS[a], TIME_OPTIONS[rng.randrange(a + 2, len(TIME_OPTIONS))]])
+    users = []
+    for i in range(rng.randint(*LARGE_USERS)):
+        if users and rng.random() < 0.3:
+            params = copy.deepcopy(rng.choice(users)["parameters"])
+        else:
+            params = {
+                "office": office,
+                "time_slots": copy.deepcopy(rng.sample(windows, rng.randint(1, len(windows)))),
+                "max_lunch_duration": rng.choice(LUNCH_DURATIONS),
+                "favourite_places": rng.sample(big, rng.randint(1, len(big))),
+                "non_desirable_places": rng.sample(names, rng.randint(0, 1)),
+                "team_size_lst": list(rng.choice(LARGE_SIZES)),
+            }
+        users.append({"login": f"u{i + 1}", "parameters": params})
+    return users
+
+
+POOLS = {"small": random_pool, "large": random_large_pool}
+
+
+def pool_for(kind: str, i: int) -> Callable:
+    if kind == "mixed":
+        return random_large_pool if i % 4 == 3 else random_pool
+    return POOLS[kind]
+
+
+def _allowed_size(team_size_lst: List[str], size: int) -> bool:
+    for fmt in team_size_lst:
+        if fmt == "2" and size == 2 or fmt == "3-5" and 3 <= size <= 5:
+            return True
+        if fmt.endswith("+") and fmt[:-1].isdigit() and size >= int(fmt[:-1]):
+            return True
+    return False
+
+
+def _merged_slots(slots: List[List[str]]) -> List[List[int]]:
+    intervals = []
+    for start, end in slots:
+        try:
+            s, e = to_minutes(start), to_minutes(end)
+        except ValueError:
+            continue
+        if s < e:
+            intervals.append([s, e])
+    intervals.sort()
+    merged = []
+    for s, e in intervals:
+        if merged and s <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], e)
+        else:
+            merged.append([s, e])
+    return merged
+
+
+def solo_count(users: List[Dict], groups: List[Dict]) -> int:
+    matched = {login for g in groups if len(g["participants"]) > 1 for login in g["participants"]}
+    return sum(1 for u in users if u["login"] not in matched)
+
+
+def check_invariants(users: List[Dict], places: List[Dict], groups: List[Dict],
+                     reference_groups: List[Dict], now: datetime) -> List[str]:
+    """Нарушенные инварианты результата groups (users — исходный, не нормализованный вход)."""
+    problems = []
+    by_login = {u["login"]: u["parameters"] for u in users}
+    places_by_name = {p["name"]: p for p in places}
+    min_start = to_minutes((now + timedelta(minutes=5)).strftime("%H:%M"))
+    seen = set()
+    for group in groups:
+        members = group["participants"]
+        size = len(members)
+        label = ",".join(members)
+        for login in members:
+            if login not in by_login:
+                problems.append(f"unknown:{login}")
+            elif login in seen:
+                problems.append(f"duplicate:{login}")
+            seen.add(login)
+        params = [by_login[login] for login in members if login in by_login]
+        if len(params) != size:
+            continue
+
+        if size > 1 and not all(_allowed_size(p["team_size_lst"], size) for p in params):
+            problems.append(f"size:{label}")
+
+        start, end = to_minutes(group["lunch_time"][0]), to_minutes(group["lunch_time"][1])
+        if all(_merged_slots(p["time_slots"]) for p in params):
+            if start < min_start:
+                problems.append(f"window_before_now:{label}")
+            if end - start > min(p["max_lunch_duration"] for p in params):
+                problems.append(f"window_too_long:{label}")
+            for login, p in zip(members, params):
+                if not any(s <= start and end <= e for s, e in _merged_slots(p["time_slots"])):
+                    problems.append(f"window_outside_slots:{label}:{login}")
+
+        place = places_by_name.get(group["place"])
+        if place is None:
+            problems.append(f"place_unknown:{label}")
+            continue
+        if any(place["office_name"].strip().lower() != p["office"].strip().lower() for p in params):
+            problems.append(f"place_office:{label}")
+        if place["max_table_size"] < size:
+            problems.append(f"place_capacity:{label}")
+        favourites = [set(p["favourite_places"]) - set(p["non_desirable_places"]) for p in params]
+        common_fav = set.intersection(*favourites) if size > 1 else set()
+        if common_fav and place["name"] not in common_fav:
+            problems.append(f"place_not_common_favourite:{label}")
+        if not common_fav and any(place["name"] in p["non_desirable_places"] for p in params):
+            problems.append(f"place_non_desirable:{label}")
+
+    if solo_count(users, groups) > solo_count(users, reference_groups):
+        problems.append("more_solos_than_reference")
+    return problems
+
+
+def run_case(users: List[Dict], places: List[Dict], engine: Callable, now: datetime) -> List[str]:
+    expected = reference.find_all_lunch_groups(copy.deepcopy(users), places, now)
+    actual = engine(copy.deepcopy(users), places, now)
+    return check_invariants(users, places, actual, expected, now)
+
+
+def _kind(problem: str) -> str:
+    return problem.split(":", 1)[0]
+
+
+def shrink(users: List[Dict], places: List[Dict], engine: Callable, now: datetime,
+           problems: List[str]) -> List[Dict]:
+    """Жадно упрощает вход, пока сохраняется хотя бы один из исходных видов нарушений."""
+    kinds = {_kind(p) for p in problems}
+
+    def still_fails(candidate: List[Dict]) -> bool:
+        if not candidate:
+            return False
+        try:
+            return bool(kinds & {_kind(p) for p in run_case(candidate, places, engine, now)})
+        except Exception:
+            return False
+
+    def simplifications(current: List[Dict]):
+        for i in range(len(current)):
+            yield current[:i] + current[i + 1:]
+        for i, user in enumerate(current):
+            params = user["parameters"]
+            for key in ("time_slots", "favourite_places", "non_desirable_places", "team_size_lst"):
+                for j in range(len(params[key])):
+                    candidate = copy.deepcopy(current)
+                    del candidate[i]["parameters"][key][j]
+                    yield candidate
+
+    current = copy.deepcopy(users)
+    changed = True
+    while changed:
+        changed = False
+        for candidate in simplifications(current):
+            if still_fails(candidate):
+                current = candidate
+                changed = True
+                break
+    return current
+
+
+def save_repro(users: List[Dict], problems: List[str], engine_name: str, now: datetime) -> str:
+    os.makedirs(REPRO_DIR, exist_ok=True)
+    payload = {"engine": engine_name, "now": now.isoformat(), "places": PLACES_FILE,
+               "problems": problems, "users": users}
+    digest = hashlib.sha1(json.dumps(users, sort_keys=True).encode("utf-8")).hexdigest()[:10]
+    path = os.path.join(REPRO_DIR, f"repro_{engine_name}_{digest}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+    return path
+
+
+def fuzz(iterations: int, seed: int, engine_names: List[str], now: datetime = FUZZ_NOW,
+         pool: str = "mixed") -> int:
+    places = matcher.load_places(PLACES_FILE)
+    failures = 0
+    exact = 0
+    for i in range(iterations):
+        rng = random.Random(seed * 1_000_003 + i)
+        users = pool_for(pool, i)(rng, places)
+        for name in engine_names:
+            problems = run_case(users, places, ENGINES[name], now)
+            if problems:
+                failures += 1
+                minimal = shrink(users, places, ENGINES[name], now, problems)
+                path = save_repro(minimal, run_case(minimal, places, ENGINES[name], now), name, now)
+                print(f"❌ [{name}] итерация {i}: {problems[:3]} -> {path}")
+            elif _normalize(ENGINES[name](copy.deepcopy(users), places, now)) == \
+                    _normalize(reference.find_all_lunch_groups(copy.deepcopy(users), places, now)):
+                exact += 1
+    total = iterations * len(engine_names)
+    print(f"Итераций: {total}, нарушений: {failures}, совпадений с эталоном один в один: {exact}")
+    return failures
+
+
+def _normalize(groups: List[Dict]):
+    return sorted((tuple(sorted(g["participants"])), tuple(g["lunch_time"]), g["place"]) for g in groups)
+
+
+def replay(paths: Optional[List[str]] = None) -> int:
+    """Прогоняет сохранённые воспроизведения; возвращает число всё ещё падающих."""
+    failing = 0
+    for path in sorted(paths or glob.glob(os.path.join(REPRO_DIR, "*.json"))):
+        with open(path, "r", encoding="utf-8") as f:
+            case = json.load(f)
+        places = matcher.load_places(case.get("places", PLACES_FILE))
+        engine_name = case.get("engine", "fast")
+        problems = run_case(case["users"], places, ENGINES[engine_name], datetime.fromisoformat(case["now"]))
+        status = "❌" if problems else "✅"
+        print(f"{status} {path} {problems[:3] if problems else ''}")
+        failing += bool(problems)
+    return failing
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Дифференциальный фаззинг движков подбора против эталонного перебора.")
+    parser.add_argument("--iterations", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--engine", action="append", choices=sorted(ENGINES), help="Какие движки проверять (по умолчанию все)")
+    parser.add_argument("--now", default=None, help="Момент прогона (ISO); по умолчанию фиксированный 10:00")
+    parser.add_argument("--pool", choices=["mixed"] + sorted(POOLS), default="mixed",
+                        help="Вид пулов: small, large (один офис, 6–12 человек, группы 6+) или mixed")
+    parser.add_argument("--replay", nargs="*", default=None, help="Прогнать сохранённые воспроизведения из test/fuzz/")
+    args = parser.parse_args(argv)
+    logging.disable(logging.CRITICAL)
+
+    if args.replay is not None:
+        return 1 if replay(args.replay) else 0
+    now = datetime.fromisoformat(args.now) if args.now else FUZZ_NOW
+    return 1 if fuzz(args.iterations, args.seed, args.engine or sorted(ENGINES), now, args.pool) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+"""
+Детерминированный (по seed) генератор пулов пользователей и каталога мест
+в форматах users_to_match.json и places.csv.
+"""
+import copy
+import csv
+import random
+from typing import Dict, List, Optional
+
+# Те же варианты, что в config.py (config не импортируем: он читает токен бота при импорте)
+TIME_OPTIONS = [
+    "11:00", "11:30", "12:00", "12:30", "13:00", "13:30",
+    "14:00", "14:30", "15:00", "15:30", "16:00", "16:30",
+]
+COMPANY_SIZES = ["1", "2", "3-5", "6+", "18+"]
+LUNCH_DURATIONS = [30, 45, 60, 90]
+
+# Распределения начала слота по TIME_OPTIONS (веса по индексам)
+SLOT_PROFILES = {
+    # Пик вокруг 12:00–13:30, как в реальном пуле
+    "lunch": [1, 3, 8, 8, 6, 4, 2, 1, 1, 1, 1, 1],
+    "uniform": [1] * len(TIME_OPTIONS),
+    # Все хотят ровно в полдень
+    "noon": [0, 1, 20, 2, 1, 0, 0, 0, 0, 0, 0, 0],
+}
+
+# Доли форматов компании по умолчанию (мультивыбор: пользователь получает 1–2 формата)
+DEFAULT_SIZE_MIX = {"1": 0.05, "2": 0.35, "3-5": 0.4, "6+": 0.15, "18+": 0.05}
+
+PLACES_FIELDS = ["name", "office_name", "office_address", "maps_link", "time_to_go_min",
+                 "max_table_size", "avg_bill", "min_time_to_eat"]
+
+
+def office_name(i: int) -> str:
+    return f"Office{i + 1}"
+
+
+def generate_places(offices: int, places_per_office: int = 6, seed: int = 0,
+                    office_names: Optional[List[str]] = None) -> List[Dict]:
+    """
+    Каталог мест: у каждого офиса places_per_office мест разной вместимости (от 2 до 20).
+    office_names — названия офисов (например, config.OFFICES), по умолчанию Office1, Office2, ...
+    """
+    rng = random.Random(seed)
+    places = []
+    for o in range(offices):
+        office = office_names[o] if office_names else office_name(o)
+        for p in range(places_per_office):
+            places.append({
+                "name": f"{office} Place{p + 1}",
+                "office_name": office,
+                "office_address": f"ул. Тестовая, {o + 1}",
+                "maps_link": "",
+                "time_to_go_min": rng.randint(1, 10),
+                "max_table_size": rng.choice([2, 4, 6, 8, 10, 20]),
+                "avg_bill": rng.choice([300, 500, 800, 1200]),
+                "min_time_to_eat": rng.choice([15, 20, 30, 45]),
+            })
+    return places
+
+
+def write_places_csv(places: List[Dict], path: str) -> None:
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=PLACES_FIELDS)
+        writer.writeheader()
+        writer.writerows(places)
+
+
+def _time_slots(rng: random.Random, weights: List[int]) -> List[List[str]]:
+    slots = []
+    for _ in range(rng.choice([1, 1, 1, 2])):
+        start = rng.choices(range(len(TIME_OPTIONS) - 1), weights=weights[:-1])[0]
+        end = min(len(TIME_OPTIONS) - 1, start + rng.choice([1, 2, 2, 3, 4]))
+        slots.append([TIME_OPTIONS[start], TIME_OPTIONS[end]])
+    return slots
+
+
+def generate_users(n_users: int, offices: int = 3, places: Optional[List[Dict]] = None,
+                   slot_profile: str = "lunch", fav_overlap: float = 0.6,
+                   size_mix: Optional[Dict[str, float]] = None, seed: int = 0,
+                   distinct_profiles: Optional[int] = None) -> List[Dict]:
+    """
+    Пул из n_users пользователей, равномерно по offices офисам.
+    fav_overlap — вероятность, что любимые места берутся из общего для офиса "популярного"
+    набора (чем выше, тем больше пересечений предпочтений); size_mix — доли форматов компании.
+    distinct_profiles — если задано, параметры берутся из стольких заранее сгенерированных
+    профилей (пользователи выбирают из меню, так что в большом пуле профили повторяются).
+    """
+    if distinct_profiles:
+        prototypes = generate_users(distinct_profiles, offices, places, slot_profile, fav_overlap, size_mix, seed)
+        rng = random.Random(seed + 1)
+        return [{"login": f"bench{i + 1}", "parameters": copy.deepcopy(rng.choice(prototypes)["parameters"])}
+                for i in range(n_users)]
+
+    rng = random.Random(seed)
+    places = places if places is not None else generate_places(offices, seed=seed)
+    weights = SLOT_PROFILES[slot_profile]
+    size_mix = size_mix or DEFAULT_SIZE_MIX
+    sizes, size_weights = list(size_mix), list(size_mix.values())
+
+    names_by_office: Dict[str, List[str]] = {}
+    for place in places:
+        names_by_office.setdefault(place["office_name"], []).append(place["name"])
+    popular = {office: names[:2] for office, names in names_by_office.items()}
+    # Офисы в порядке каталога мест (без каталога — Office1, Office2, ...)
+    office_list = list(names_by_office) or [office_name(o) for o in range(offices)]
+
+    users = []
+    for i in range(n_users):
+        office = office_list[i % len(office_list)]
+        names = names_by_office.get(office, [])
+        if names and rng.random() < fav_overlap:
+            favourites = list(popular[office])
+        else:
+            favourites = rng.sample(names, min(len(names), rng.randint(0, 2)))
+        rest = [n for n in names if n not in favourites]
+        non_desirable = rng.sample(rest, min(len(rest), rng.choice([0, 0, 1])))
+        team_sizes = sorted(set(rng.choices(sizes, weights=size_weights, k=rng.choice([1, 2]))),
+                            key=COMPANY_SIZES.index)
+        users.append({
+            "login": f"bench{i + 1}",
+            "parameters": {
+                "office": office,
+                "time_slots": _time_slots(rng, weights),
+                "max_lunch_duration": rng.choice(LUNCH_DURATIONS),
+                "favourite_places": favourites,
+                "non_desirable_places": non_desirable,
+                "team_size_lst": team_sizes,
+            },
+        })
+    return users
@@ -0,0 +1,279 @@
+"""
+Нагрузочный прогон бота: синтетические Update подаются прямо в Dispatcher,
+настроенный register_all_handlers, ответы даёт поддельный Bot API (bench/fake_api.py).
+
+    python -m bench.load --users 100 --returning 300 --pool 1000 --storm-window 2 -o load.json
+
+Новые виртуальные пользователи (--users) проходят анкету Form (/start → офис → слоты →
+длительность → места → размер компании → подтверждение) с паузами на "раздумье".
+Затем шторм в 12:00: в окне --storm-window секунд "Записаться на обед" жмут они и
+вернувшиеся пользователи (--returning) — профиль есть, но сегодня ещё не записаны.
+--pool — сколько человек уже записано до начала прогона. Отчёт: p50/p95/p99 задержки обработки по типам апдейтов,
+задержка event loop, число запусков matcher.py и вызовов API, ошибки.
+--waves: бот в режиме волн матчинга (bot/waves.py) — клики только пополняют пул, после
+шторма закрывается одна волна на обеды с 12:00, её время и запуски matcher.py — отдельно.
+Хранилище, как в main.py, — актор bot/store.py; --file-lock — прежние синхронные функции
+bot/utils.py с FileLock на каждую запись, для сравнения.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from .bot_bench import REPO_ROOT, bot_workspace, pin_matcher
+from .fake_api import callback_update, make_bot, message_update
+from .generator import generate_places, generate_users
+
+# Момент прогона matcher.py: запись на обед в полдень
+STORM_NOW = datetime(2026, 1, 5, 12, 0)
+# Волна для --waves: закрывается в момент шторма и берёт все обеды до конца дня
+STORM_WAVE = "12:00=12:00-17:00"
+LAG_INTERVAL = 0.01
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))] if ordered else 0.0
+
+
+def latency_summary(values: List[float]) -> Dict:
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(values, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+        "max_ms": round(max(values) * 1000, 2) if values else 0.0,
+    }
+
+
+def profile_flow(params: Dict) -> List[str]:
+    """Нажатия кнопок анкеты Form, которые приводят к профилю с параметрами params."""
+    steps = [f"office:{params['office']}"]
+    for n, (start, end) in enumerate(params["time_slots"]):
+        if n:
+            steps.append("add_slot:yes")
+        steps += [f"time_start:{start}", f"time_end:{end}"]
+    steps += ["add_slot:no", f"duration:{params['max_lunch_duration']}"]
+    steps += [f"fav_place:{place}" for place in params["favourite_places"]] + ["fav_place:done"]
+    steps += [f"dis_place:{place}" for place in params["non_desirable_places"]] + ["dis_place:done"]
+    steps += [f"size:{size}" for size in params["team_size_lst"]] + ["size:done", "confirm:yes"]
+    return steps
+
+
+def update_kind(data: str) -> str:
+    """Тип апдейта для отчёта: префикс callback_data (для меню — с действием) или команда."""
+    if data.startswith("/"):
+        return data
+    prefix, _, action = data.partition(":")
+    return f"{prefix}:{action}" if prefix in ("menu", "confirm", "add_slot") else prefix
+
+
+class LoadStats:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.error_samples: List[str] = []
+        self.loop_lag: List[float] = []
+
+    def record(self, kind: str, seconds: float) -> None:
+        self.latencies.setdefault(kind, []).append(seconds)
+
+    def error(self, kind: str, exc: Exception) -> None:
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+        if len(self.error_samples) < 5:
+            self.error_samples.append(f"{kind}: {exc!r}")
+
+
+async def monitor_loop_lag(stats: LoadStats) -> None:
+    """Насколько позже запланированного просыпается задача — задержка event loop."""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(LAG_INTERVAL)
+        stats.loop_lag.append(max(0.0, loop.time() - started - LAG_INTERVAL))
+
+
+async def feed(dispatcher, bot, update, kind: str, stats: LoadStats) -> None:
+    started = time.perf_counter()
+    try:
+        await dispatcher.feed_update(bot, update)
+    except Exception as e:
+        stats.error(kind, e)
+    stats.record(kind, time.perf_counter() - started)
+
+
+async def fill_profile(user_id: int, username: str, params: Dict, dispatcher, bot, stats: LoadStats,
+                       update_ids, think: float, rng: random.Random) -> None:
+    await asyncio.sleep(rng.uniform(0, think * 5))
+    await feed(dispatcher, bot, message_update(next(update_ids), user_id, username, "/start"), "/start", stats)
+    for data in profile_flow(params):
+        await asyncio.sleep(rng.uniform(0, think))
+        await feed(dispatcher, bot, callback_update(next(update_ids), user_id, username, data),
+                   update_kind(data), stats)
+
+
+async def book_lunch(user_id: int, username: str, dispatcher, bot, stats: LoadStats, update_ids,
+                     storm_window: float, rng: random.Random) -> None:
+    await asyncio.sleep(rng.uniform(0, storm_window))
+    await feed(dispatcher, bot, callback_update(next(update_ids), user_id, username, "menu:book_lunch"),
+               "menu:book_lunch", stats)
+
+
+async def run_load(n_users: int, returning: int, pool: int, think: float, storm_window: float,
+                   api_latency: float, seed: int, record: Optional[str] = None,
+                   spans_file: Optional[str] = None, use_waves: bool = False,
+                   use_store: bool = True) -> Dict:
+    from aiogram import Dispatcher
+    from aiogram.fsm.storage.memory import MemoryStorage
+
+    from bot import register_all_handlers
+    from bot import store, utils, waves
+    from config import OFFICES
+    from .bot_bench import user_id_of
+
+    rng = random.Random(seed)
+    cwd = os.getcwd()
+    offices = OFFICES[:3]
+    places = generate_places(len(offices), seed=seed, office_names=offices)
+    profiles = generate_users(n_users, len(offices), places, seed=seed + 7, distinct_profiles=24)
+    new_users = [(300000 + i, f"load{i + 1}", profile["parameters"]) for i, profile in enumerate(profiles)]
+
+    with bot_workspace(pool + returning, seed, reserve=returning, office_names=offices) as (workspace_users, _), \
+            pin_matcher(STORM_NOW) as matcher_runs:
+        returning_users = [(user_id_of(i), workspace_users[i]["login"])
+                           for i in range(pool, pool + returning)]
+        utils.load_places()
+        if use_store:
+            store.start(utils.USERS_CSV, utils.USERS_TO_MATCH_JSON)
+        bot = make_bot(api_latency)
+        dispatcher = Dispatcher(storage=MemoryStorage())
+        register_all_handlers(dispatcher)
+        recorder = None
+        if record:
+            from bot.recorder import UpdateRecorderMiddleware
+            recorder = UpdateRecorderMiddleware(os.path.join(cwd, record))
+            dispatcher.update.outer_middleware(recorder)
+        if spans_file:
+            from bot.spans import TracingMiddleware, enable_spans
+            enable_spans(os.path.join(cwd, spans_file))
+            dispatcher.update.outer_middleware(TracingMiddleware())
+        scheduler = None
+        if use_waves:
+            scheduler = waves.install(waves.WaveScheduler(
+                bot, waves.parse_schedule(STORM_WAVE), "data/users_to_match.json", "data/places.csv",
+                "data/output.json", clock=lambda: STORM_NOW))
+        stats = LoadStats()
+        update_ids = iter(range(1, 1 << 30))
+        monitor = asyncio.create_task(monitor_loop_lag(stats))
+        started = time.perf_counter()
+        try:
+            # Обработчики печатают отладку в stdout — в отчёт она не попадает
+            with contextlib.redirect_stdout(io.StringIO()):
+                await asyncio.gather(*(
+                    fill_profile(user_id, username, params, dispatcher, bot, stats, update_ids, think,
+                                 random.Random(rng.random()))
+                    for user_id, username, params in new_users))
+                form_done = time.perf_counter()
+                matcher_runs_form = matcher_runs["count"]
+                storm = [(user_id, username) for user_id, username, _ in new_users] + returning_users
+                await asyncio.gather(*(
+                    book_lunch(user_id, username, dispatcher, bot, stats, update_ids, storm_window,
+                               random.Random(rng.random()))
+                    for user_id, username in storm))
+                storm_done = time.perf_counter()
+                matcher_runs_storm = matcher_runs["count"]
+                if scheduler:
+                    await scheduler.run_due()
+        finally:
+            waves.stop()
+            await store.stop()
+            monitor.cancel()
+            await bot.session.close()
+            if recorder:
+                recorder.close()
+            if spans_file:
+                from bot.spans import disable_spans
+                disable_spans()
+        finished = time.perf_counter()
+
+    total_updates = sum(len(v) for v in stats.latencies.values())
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "users": n_users,
+        "returning": returning,
+        "pool": pool,
+        "think_s": think,
+        "storm_window_s": storm_window,
+        "api_latency_s": api_latency,
+        "wall_s": round(finished - started, 3),
+        "form_phase_s": round(form_done - started, 3),
+        "storm_phase_s": round(storm_done - form_done, 3),
+        "wave_s": round(finished - storm_done, 3) if use_waves else None,
+        "updates": total_updates,
+        "updates_per_s": round(total_updates / (finished - started), 1),
+        "latency": {kind: latency_summary(values) for kind, values in sorted(stats.latencies.items())},
+        "loop_lag": latency_summary(stats.loop_lag),
+        "matcher_runs": {"form": matcher_runs_form, "storm": matcher_runs_storm - matcher_runs_form,
+                         "wave": matcher_runs["count"] - matcher_runs_storm},
+        "storage": "actor" if use_store else "file-lock",
+        "api_calls": len(bot.session.calls),
+        "errors": stats.errors,
+        "error_samples": stats.error_samples,
+    }
+
+
+def print_report(report: Dict) -> None:
+    print(f"Новых пользователей: {report['users']}, вернувшихся: {report['returning']}, "
+          f"записано заранее: {report['pool']}; апдейтов: {report['updates']}, "
+          f"{report['updates_per_s']}/с, всего {report['wall_s']} с "
+          f"(анкеты {report['form_phase_s']} с, шторм {report['storm_phase_s']} с"
+          + (f", волна {report['wave_s']} с)" if report.get("wave_s") is not None else ")"))
+    print(f"{'update':<22}{'count':>7}{'p50_ms':>10}{'p95_ms':>10}{'p99_ms':>10}{'max_ms':>10}")
+    for kind, row in report["latency"].items():
+        print(f"{kind:<22}{row['count']:>7}{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}{row['max_ms']:>10}")
+    lag = report["loop_lag"]
+    print(f"Задержка event loop: p50 {lag['p50_ms']} мс, p99 {lag['p99_ms']} мс, max {lag['max_ms']} мс")
+    print(f"Запусков matcher.py: анкеты {report['matcher_runs']['form']}, шторм {report['matcher_runs']['storm']}, "
+          f"волна {report['matcher_runs']['wave']}; "
+          f"вызовов API: {report['api_calls']}; ошибок: {report['errors'] or 0}")
+    for sample in report["error_samples"]:
+        print(f"  {sample}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон бота через Dispatcher с поддельным Bot API.")
+    parser.add_argument("--users", type=int, default=100, help="Виртуальных пользователей, проходящих анкету и запись")
+    parser.add_argument("--returning", type=int, default=100, help="Пользователей с профилем, которые только записываются в шторм")
+    parser.add_argument("--pool", type=int, default=0, help="Уже записанных на обед пользователей до начала прогона")
+    parser.add_argument("--think", type=float, default=0.2, help="Максимальная пауза между нажатиями, секунды")
+    parser.add_argument("--storm-window", type=float, default=2.0, help="За сколько секунд все жмут 'Записаться на обед'")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="Задержка ответа поддельного API, секунды")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("-o", "--output", default=None, help="Куда сохранить отчёт (JSON)")
+    parser.add_argument("--record", default=None, help="Записать апдейты прогона в JSONL (как BOT_RECORD_UPDATES) для bench.replay")
+    parser.add_argument("--spans", default=None, help="Записать span'ы трассировки в JSONL (как BOT_SPANS_FILE) для bench.spans")
+    parser.add_argument("--file-lock", action="store_true", help="Синхронное хранилище с FileLock вместо актора bot/store.py")
+    parser.add_argument("--waves", action="store_true", help="Режим волн матчинга: клики только пополняют пул, группы — одной волной после шторма")
+    args = parser.parse_args(argv)
+
+    import logging
+    logging.disable(logging.CRITICAL)
+    sys.path.insert(0, REPO_ROOT)
+    report = asyncio.run(run_load(args.users, args.returning, args.pool, args.think, args.storm_window, args.api_latency, args.seed,
+                                  args.record, args.spans, args.waves, not args.file_lock))
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
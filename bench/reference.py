@@ -0,0 +1,189 @@
+"""
+Эталонный движок подбора: полный перебор сочетаний из исходного matcher.py
+(до индексов, битовых масок и классов), без отладочного вывода и с явным now.
+Экспоненциален по размеру пула — годится только для маленьких пулов в bench.fuzz.
+Логику не менять: это точка отсчёта для сравнения быстрых движков.
+"""
+from datetime import datetime, time, timedelta
+from itertools import combinations
+from typing import Dict, List, Optional, Tuple
+
+
+def parse_time(time_str: str) -> time:
+    return datetime.strptime(time_str, "%H:%M").time()
+
+
+def is_valid_time_slot(start: str, end: str) -> bool:
+    try:
+        return parse_time(start) < parse_time(end)
+    except ValueError:
+        return False
+
+
+def clean_time_slots(slots: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+    valid_slots = [s for s in slots if is_valid_time_slot(s[0], s[1])]
+    if not valid_slots:
+        return []
+    intervals = sorted((parse_time(s[0]), parse_time(s[1])) for s in valid_slots)
+    merged = [intervals[0]]
+    for current in intervals[1:]:
+        last = merged[-1]
+        if current[0] <= last[1]:
+            merged[-1] = (last[0], max(last[1], current[1]))
+        else:
+            merged.append(current)
+    return [(t[0].strftime("%H:%M"), t[1].strftime("%H:%M")) for t in merged]
+
+
+def process_users(users: List[Dict]) -> List[Dict]:
+    for user in users:
+        params = user["parameters"]
+        if "duration_min" in params:
+            params["max_lunch_duration"] = params.pop("duration_min")
+        params["time_slots"] = clean_time_slots(params["time_slots"])
+        params["favourite_places"] = list(set(params["favourite_places"]) - set(params["non_desirable_places"]))
+    return users
+
+
+def find_common_time_slot(users: List[Dict], now: datetime) -> Optional[Tuple[str, str]]:
+    if any(not u["parameters"]["time_slots"] for u in users):
+        return ("12:00", "13:00")
+    user_time_slots = []
+    for user in users:
+        user_time_slots.append([(parse_time(s[0]), parse_time(s[1])) for s in user["parameters"]["time_slots"]
+                                if parse_time(s[0]) < parse_time(s[1])])
+    common = user_time_slots[0]
+    for user_slots in user_time_slots[1:]:
+        new_common = []
+        for s1 in common:
+            for s2 in user_slots:
+                if s1[0] < s2[1] and s2[0] < s1[1]:
+                    start, end = max(s1[0], s2[0]), min(s1[1], s2[1])
+                    if start < end:
+                        new_common.append((start, end))
+        common = new_common
+        if not common:
+            return None
+
+    max_duration_td = timedelta(minutes=min(u["parameters"]["max_lunch_duration"] for u in users))
+    min_start = (now + timedelta(minutes=5)).time()
+    day = now.date()
+    for start, end in sorted(common):
+        if start < min_start:
+            continue
+        if datetime.combine(day, end) - datetime.combine(day, start) >= max_duration_td:
+            optimal_end = (datetime.combine(day, start) + max_duration_td).time()
+            if optimal_end <= end:
+                return (start.strftime("%H:%M"), optimal_end.strftime("%H:%M"))
+    return None
+
+
+def is_team_size_compatible(users: List[Dict], team_size: int) -> bool:
+    for user in users:
+        allowed = False
+        for size_range in user["parameters"]["team_size_lst"]:
+            if size_range == "2":
+                allowed = team_size == 2
+            elif size_range == "3-5":
+                allowed = 3 <= team_size <= 5
+            elif size_range.endswith("+"):
+                try:
+                    allowed = team_size >= int(size_range.replace("+", ""))
+                except ValueError:
+                    allowed = False
+            if allowed:
+                break
+        if not allowed:
+            return False
+    return True
+
+
+def find_compatible_places(users: List[Dict], places: List[Dict]) -> List[Dict]:
+    office = users[0]["parameters"]["office"].strip().lower()
+    team_size = len(users)
+    if any(user["parameters"]["office"].strip().lower() != office for user in users):
+        return []
+    if not is_team_size_compatible(users, team_size):
+        return []
+    if team_size == 1:
+        non_des = set(users[0]["parameters"].get("non_desirable_places", []))
+        return [p for p in places if p["office_name"].strip().lower() == office
+                and p["name"] not in non_des and p["max_table_size"] >= team_size]
+
+    common_fav = None
+    for user in users:
+        fav_set = set(user["parameters"]["favourite_places"])
+        common_fav = fav_set if common_fav is None else common_fav & fav_set
+    compatible = []
+    for place in places:
+        if place["office_name"].strip().lower() != office or place["max_table_size"] < team_size:
+            continue
+        if common_fav and place["name"] not in common_fav:
+            continue
+        if not common_fav and any(place["name"] in u["parameters"].get("non_desirable_places", []) for u in users):
+            continue
+        compatible.append(place)
+    return compatible
+
+
+def match_lunch_group(users: List[Dict], places: List[Dict], now: datetime) -> Optional[Dict]:
+    common_slot = find_common_time_slot(users, now)
+    if common_slot is None:
+        return None
+    compatible_places = find_compatible_places(users, places)
+    if not compatible_places:
+        return None
+    best_place = min(compatible_places, key=lambda p: p["time_to_go_min"])
+    return {
+        "participants": sorted(u["login"] for u in users),
+        "lunch_time": common_slot,
+        "place": best_place["name"],
+        "maps_link": best_place["maps_link"],
+    }
+
+
+def find_all_lunch_groups(users: List[Dict], places: List[Dict], now: datetime) -> List[Dict]:
+    """Перебор всех сочетаний размера 2–6, сортировка по "жёсткости" и жадный выбор, затем одиночки."""
+    users = process_users(users)
+    if len(users) == 1:
+        if "1" in users[0]["parameters"].get("team_size_lst", []):
+            match = match_lunch_group(users, places, now)
+            return [match] if match else []
+        return []
+
+    users_sorted = sorted(users, key=lambda u: (
+        len(u["parameters"]["time_slots"]) if u["parameters"]["time_slots"] else 0,
+        -u["parameters"]["max_lunch_duration"],
+        len(u["parameters"]["favourite_places"]),
+    ))
+    all_candidates = []
+    for size in range(2, 7):
+        for combo in combinations(users_sorted, size):
+            match = match_lunch_group(list(combo), places, now)
+            if match:
+                all_candidates.append(match)
+
+    by_login = {u["login"]: u for u in users}
+
+    def sort_key(group):
+        urgency = 0
+        for login in group["participants"]:
+            params = by_login[login]["parameters"]
+            urgency += (3 - len(params["time_slots"])) * 2
+            urgency += 3 - len(params["favourite_places"])
+        return (-urgency, -len(group["participants"]), parse_time(group["lunch_time"][0]))
+
+    all_candidates.sort(key=sort_key)
+    result = []
+    used = set()
+    for group in all_candidates:
+        if used.intersection(group["participants"]):
+            continue
+        result.append(group)
+        used.update(group["participants"])
+    for user in users:
+        if user["login"] not in used:
+            single = match_lunch_group([user], places, now)
+            if single:
+                result.append(single)
+    return result
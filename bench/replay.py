@@ -0,0 +1,197 @@
+"""
+Воспроизведение записанного трафика бота (BOT_RECORD_UPDATES, bot/recorder.py)
+против локального бота с поддельным Bot API.
+
+    python -m bench.replay logs/updates.jsonl --speed 1 -o replay.json
+    python -m bench.replay logs/updates.jsonl --speed 0      # без пауз
+
+Апдейты каждого (анонимного) пользователя идут по порядку в своей задаче, пользователи —
+параллельно; паузы между апдейтами — как в записи, делённые на --speed (0 — без пауз).
+Перед первым апдейтом пользователю восстанавливается записанное состояние FSM; тем, кто
+в записи сразу пользуется меню, создаётся синтетический профиль. matcher.py считает от
+времени суток начала записи. Отчёт — как у bench.load, плюс медиана времени обработки
+по типам апдейтов в записи для сравнения.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import statistics
+import sys
+import time
+from datetime import datetime
+from typing import Dict, List
+
+from .bot_bench import REPO_ROOT, bot_workspace, pin_matcher, profile_from_params
+from .fake_api import callback_update, make_bot, message_update
+from .generator import generate_places, generate_users
+from .load import LoadStats, feed, latency_summary, monitor_loop_lag, update_kind
+
+# Колбэки анкеты: пользователю, который их проходит, синтетический профиль не нужен
+FORM_PREFIXES = ("office", "time_start", "time_end", "add_slot", "duration", "fav_place", "dis_place",
+                 "size", "confirm")
+
+
+def load_trace(path: str) -> List[Dict]:
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                records.append(json.loads(line))
+    for record in records:
+        record["at"] = datetime.fromisoformat(record["ts"])
+    records.sort(key=lambda r: r["at"])
+    return records
+
+
+def record_kind(record: Dict) -> str:
+    return update_kind(record["data"]) if record.get("data") else record.get("kind", "unknown")
+
+
+def needs_profile(records: List[Dict]) -> bool:
+    """Пользователь сразу пользуется меню (профиль был до начала записи)."""
+    for record in records:
+        data = record.get("data") or ""
+        if data == "/start" or data.split(":", 1)[0] in FORM_PREFIXES:
+            return False
+        if data.startswith(("menu:", "lunch:", "edit:")):
+            return True
+    return False
+
+
+async def replay_user(user_id: int, username: str, records: List[Dict], start: datetime, speed: float,
+                      dispatcher, bot, stats: LoadStats, update_ids, loop_start: float) -> None:
+    from aiogram.fsm.storage.base import StorageKey
+
+    if records[0].get("state"):
+        key = StorageKey(bot_id=bot.id, chat_id=user_id, user_id=user_id)
+        await dispatcher.storage.set_state(key, records[0]["state"])
+    loop = asyncio.get_running_loop()
+    for record in records:
+        if speed:
+            delay = loop_start + (record["at"] - start).total_seconds() / speed - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        data = record.get("data")
+        if record.get("kind") == "callback":
+            update = callback_update(next(update_ids), user_id, username, data or "")
+        elif record.get("kind") == "message":
+            update = message_update(next(update_ids), user_id, username, data or "…")
+        else:
+            continue
+        await feed(dispatcher, bot, update, record_kind(record), stats)
+
+
+async def run_replay(records: List[Dict], speed: float, pool: int, api_latency: float, seed: int) -> Dict:
+    from aiogram import Dispatcher
+    from aiogram.fsm.storage.memory import MemoryStorage
+
+    from bot import register_all_handlers
+    from bot import store, utils
+    from config import OFFICES
+
+    by_user: Dict[str, List[Dict]] = {}
+    for record in records:
+        by_user.setdefault(record.get("user") or "anonymous", []).append(record)
+    users = [(400000 + n, f"replay{n + 1}", user_records) for n, user_records in enumerate(by_user.values())]
+    start = records[0]["at"]
+
+    offices = OFFICES[:3]
+    places = generate_places(len(offices), seed=seed, office_names=offices)
+    profiles = generate_users(len(users), len(offices), places, seed=seed + 11, distinct_profiles=24)
+
+    with bot_workspace(pool, seed, office_names=offices), pin_matcher(start) as matcher_runs:
+        for (user_id, username, user_records), profile in zip(users, profiles):
+            if needs_profile(user_records):
+                utils.save_user_data(user_id, username, profile_from_params(profile["parameters"]))
+        utils.load_places()
+        store.start(utils.USERS_CSV, utils.USERS_TO_MATCH_JSON)
+        bot = make_bot(api_latency)
+        dispatcher = Dispatcher(storage=MemoryStorage())
+        register_all_handlers(dispatcher)
+        stats = LoadStats()
+        update_ids = iter(range(1, 1 << 30))
+        monitor = asyncio.create_task(monitor_loop_lag(stats))
+        started = time.perf_counter()
+        loop_start = asyncio.get_running_loop().time()
+        try:
+            # Обработчики печатают отладку в stdout — в отчёт она не попадает
+            with contextlib.redirect_stdout(io.StringIO()):
+                await asyncio.gather(*(
+                    replay_user(user_id, username, user_records, start, speed, dispatcher, bot, stats,
+                                update_ids, loop_start)
+                    for user_id, username, user_records in users))
+        finally:
+            await store.stop()
+            monitor.cancel()
+            await bot.session.close()
+        finished = time.perf_counter()
+
+    recorded: Dict[str, List[float]] = {}
+    for record in records:
+        if record.get("ms") is not None:
+            recorded.setdefault(record_kind(record), []).append(record["ms"])
+    total_updates = sum(len(v) for v in stats.latencies.values())
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "trace_start": start.isoformat(),
+        "trace_span_s": round((records[-1]["at"] - start).total_seconds(), 3),
+        "speed": speed,
+        "users": len(users),
+        "pool": pool,
+        "wall_s": round(finished - started, 3),
+        "updates": total_updates,
+        "latency": {kind: latency_summary(values) for kind, values in sorted(stats.latencies.items())},
+        "recorded_p50_ms": {kind: round(statistics.median(values), 2) for kind, values in sorted(recorded.items())},
+        "loop_lag": latency_summary(stats.loop_lag),
+        "matcher_runs": matcher_runs["count"],
+        "api_calls": len(bot.session.calls),
+        "errors": stats.errors,
+        "error_samples": stats.error_samples,
+    }
+
+
+def print_report(report: Dict) -> None:
+    print(f"Запись: {report['trace_span_s']} с от {report['trace_start']}, пользователей {report['users']}, "
+          f"скорость {report['speed'] or 'без пауз'}; воспроизведено {report['updates']} апдейтов за {report['wall_s']} с")
+    print(f"{'update':<22}{'count':>7}{'p50_ms':>10}{'p95_ms':>10}{'p99_ms':>10}{'rec_p50':>10}")
+    for kind, row in report["latency"].items():
+        recorded = report["recorded_p50_ms"].get(kind, "")
+        print(f"{kind:<22}{row['count']:>7}{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}{recorded:>10}")
+    lag = report["loop_lag"]
+    print(f"Задержка event loop: p50 {lag['p50_ms']} мс, p99 {lag['p99_ms']} мс, max {lag['max_ms']} мс")
+    print(f"Запусков matcher.py: {report['matcher_runs']}; вызовов API: {report['api_calls']}; "
+          f"ошибок: {report['errors'] or 0}")
+    for sample in report["error_samples"]:
+        print(f"  {sample}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Воспроизведение записанных апдейтов против локального бота.")
+    parser.add_argument("trace", help="JSONL, записанный с BOT_RECORD_UPDATES")
+    parser.add_argument("--speed", type=float, default=1.0, help="Во сколько раз быстрее записи; 0 — без пауз")
+    parser.add_argument("--pool", type=int, default=0, help="Уже записанных на обед пользователей до начала")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="Задержка ответа поддельного API, секунды")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("-o", "--output", default=None, help="Куда сохранить отчёт (JSON)")
+    args = parser.parse_args(argv)
+
+    import logging
+    logging.disable(logging.CRITICAL)
+    sys.path.insert(0, REPO_ROOT)
+    records = load_trace(args.trace)
+    if not records:
+        print(f"В {args.trace} нет записей")
+        return 1
+    report = asyncio.run(run_replay(records, args.speed, args.pool, args.api_latency, args.seed))
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
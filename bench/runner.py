@@ -0,0 +1,202 @@
+"""
+Прогон match_lunch на синтетических пулах разного размера.
+
+    python -m bench.runner --sizes 10,50,100,500,1000,2000 --baseline bench/baselines/lunch.json
+
+Для каждого размера: медиана времени по --repeat прогонам, пропускная способность
+(пользователей в секунду), пик памяти (отдельный прогон под tracemalloc), число групп
+и одиночек. Каждый размер считается в отдельном процессе с таймаутом; после таймаута
+большие размеры не запускаются. С --save-baseline отчёт сохраняется как базовый,
+иначе сравнивается с ним: рост времени или памяти больше --threshold, новый таймаут
+или больше одиночек — регрессия, код возврата 1.
+"""
+import argparse
+import copy
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from .generator import SLOT_PROFILES, generate_places, generate_users, write_places_csv
+
+DEFAULT_SIZES = [10, 25, 50, 100, 200, 500, 1000, 2000]
+# Фиксированный момент прогона: результат и время не зависят от часа запуска
+BENCH_NOW = datetime(2026, 1, 5, 10, 0)
+# Изменения меньше этих порогов считаются шумом
+TIME_NOISE_S = 0.005
+MEMORY_NOISE_KB = 64
+
+
+def measure(n_users: int, spec: Dict, repeat: int) -> Dict:
+    """Замер одного размера пула (выполняется в дочернем процессе)."""
+    import matcher
+    logging.disable(logging.CRITICAL)
+
+    places = generate_places(spec["offices"], spec["places_per_office"], seed=spec["seed"])
+    users = generate_users(n_users, spec["offices"], places, slot_profile=spec["slot_profile"],
+                           fav_overlap=spec["fav_overlap"], seed=spec["seed"])
+    with tempfile.TemporaryDirectory() as tmp:
+        places_file = os.path.join(tmp, "places.csv")
+        write_places_csv(places, places_file)
+
+        timings = []
+        for _ in range(repeat):
+            matcher.clear_result_cache()
+            data = copy.deepcopy(users)
+            started = time.perf_counter()
+            result = matcher.match_lunch(data, places_file, now=BENCH_NOW)
+            timings.append(time.perf_counter() - started)
+        metrics = matcher.get_last_metrics()
+
+        matcher.clear_result_cache()
+        data = copy.deepcopy(users)
+        tracemalloc.start()
+        matcher.match_lunch(data, places_file, now=BENCH_NOW)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    median = statistics.median(timings)
+    matched = sum(len(g["participants"]) for g in result if len(g["participants"]) > 1)
+    return {
+        "n": n_users,
+        "status": "ok",
+        "median_s": round(median, 6),
+        "users_per_s": round(n_users / median, 1) if median else None,
+        "peak_kb": round(peak / 1024, 1),
+        "groups": sum(1 for g in result if len(g["participants"]) > 1),
+        "solos": n_users - matched,
+        "phases_ms": metrics["phases_ms"],
+    }
+
+
+def _worker(n_users: int, spec: Dict, repeat: int, queue) -> None:
+    queue.put(measure(n_users, spec, repeat))
+
+
+def run_size(n_users: int, spec: Dict, repeat: int, timeout: float) -> Dict:
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_worker, args=(n_users, spec, repeat, queue))
+    process.start()
+    process.join(timeout)
+    if process.is_alive():
+        process.terminate()
+        process.join()
+        return {"n": n_users, "status": "timeout", "timeout_s": timeout}
+    if process.exitcode != 0 or queue.empty():
+        return {"n": n_users, "status": "error", "exitcode": process.exitcode}
+    return queue.get()
+
+
+def compare(report: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """Список регрессий отчёта относительно базового."""
+    regressions = []
+    base_by_n = {r["n"]: r for r in baseline.get("results", [])}
+    for current in report["results"]:
+        base = base_by_n.get(current["n"])
+        if not base or base["status"] != "ok":
+            continue
+        n = current["n"]
+        if current["status"] != "ok":
+            regressions.append(f"N={n}: {current['status']} (в базовом {base['median_s']:.3f} с)")
+            continue
+        if (current["median_s"] > base["median_s"] * (1 + threshold)
+                and current["median_s"] - base["median_s"] > TIME_NOISE_S):
+            regressions.append(f"N={n}: время {base['median_s']:.4f} -> {current['median_s']:.4f} с")
+        if (current["peak_kb"] > base["peak_kb"] * (1 + threshold)
+                and current["peak_kb"] - base["peak_kb"] > MEMORY_NOISE_KB):
+            regressions.append(f"N={n}: пик памяти {base['peak_kb']} -> {current['peak_kb']} КБ")
+        if current["solos"] > base["solos"]:
+            regressions.append(f"N={n}: одиночек {base['solos']} -> {current['solos']}")
+    return regressions
+
+
+def format_row(row: Dict) -> str:
+    if row["status"] != "ok":
+        return f"{row['n']:>6}  {row['status']}"
+    return (f"{row['n']:>6}  {row['median_s']:>10.4f}  {row['users_per_s']:>10}  "
+            f"{row['peak_kb']:>10}  {row['groups']:>6}  {row['solos']:>6}")
+
+
+def load_baseline(path: str) -> Optional[Dict]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Бенчмарк match_lunch на синтетических пулах.")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="Размеры пула через запятую")
+    parser.add_argument("--offices", type=int, default=3)
+    parser.add_argument("--places-per-office", type=int, default=6)
+    parser.add_argument("--slot-profile", choices=sorted(SLOT_PROFILES), default="lunch")
+    parser.add_argument("--fav-overlap", type=float, default=0.6, help="Доля пользователей с общими любимыми местами офиса")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=3, help="Прогонов на размер (берётся медиана)")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Таймаут на размер, секунды")
+    parser.add_argument("--baseline", default=None, help="JSON базового отчёта")
+    parser.add_argument("--save-baseline", action="store_true", help="Сохранить отчёт как базовый вместо сравнения")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Допустимый рост времени и памяти (0.25 = 25%%)")
+    parser.add_argument("-o", "--output", default=None, help="Куда сохранить отчёт этого прогона")
+    args = parser.parse_args(argv)
+
+    spec = {
+        "offices": args.offices,
+        "places_per_office": args.places_per_office,
+        "slot_profile": args.slot_profile,
+        "fav_overlap": args.fav_overlap,
+        "seed": args.seed,
+    }
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "spec": spec,
+        "repeat": args.repeat,
+        "results": [],
+    }
+    print(f"{'N':>6}  {'median_s':>10}  {'users/s':>10}  {'peak_kb':>10}  {'groups':>6}  {'solos':>6}")
+    for n_users in sorted(int(n) for n in args.sizes.split(",")):
+        row = run_size(n_users, spec, args.repeat, args.timeout)
+        report["results"].append(row)
+        print(format_row(row), flush=True)
+        if row["status"] != "ok":
+            # Большие пулы заведомо не уложатся в таймаут
+            break
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if not args.baseline:
+        return 0
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Базовый отчёт сохранён в {args.baseline}")
+        return 0
+
+    baseline = load_baseline(args.baseline)
+    if baseline is None:
+        print(f"Базовый отчёт {args.baseline} не найден, сравнение пропущено")
+        return 0
+    if baseline.get("spec") != spec:
+        print("Параметры генерации отличаются от базового отчёта, сравнение пропущено")
+        return 0
+    regressions = compare(report, baseline, args.threshold)
+    for line in regressions:
+        print(f"РЕГРЕССИЯ {line}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+"""
+Разбор span'ов сквозной трассировки бота (BOT_SPANS_FILE, bot/spans.py).
+
+    python -m bench.spans logs/spans.jsonl                  # самые долгие апдейты с разбивкой
+    python -m bench.spans logs/spans.jsonl --trace 3f2a…    # дерево одного апдейта
+
+Разбивка апдейта — суммарное время по видам вложенных операций: прогоны matcher.py
+(с фазами перебора из --metrics), файловое хранилище, отправка уведомлений.
+Вложенные операции одного вида могут идти параллельно, поэтому сумма может
+превышать длительность апдейта.
+"""
+import argparse
+import json
+import sys
+from collections import defaultdict
+from typing import Dict, List
+
+
+def load_spans(path: str) -> Dict[str, List[Dict]]:
+    traces = defaultdict(list)
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                record = json.loads(line)
+                traces[record["trace"]].append(record)
+    return traces
+
+
+def root_of(spans: List[Dict]) -> Dict:
+    ids = {s["span"] for s in spans}
+    roots = [s for s in spans if s["parent"] not in ids]
+    return max(roots, key=lambda s: s["ms"])
+
+
+def breakdown(spans: List[Dict]) -> Dict[str, float]:
+    """Суммарные мс по имени span (кроме корня) и по фазам matcher.py."""
+    root = root_of(spans)
+    totals = defaultdict(float)
+    counts = defaultdict(int)
+    for s in spans:
+        if s is root:
+            continue
+        totals[s["name"]] += s["ms"]
+        counts[s["name"]] += 1
+        for phase, ms in (s.get("matcher_phases_ms") or {}).items():
+            totals[f"  matcher:{phase}"] += ms
+    return {name: (round(ms, 1), counts.get(name)) for name, ms in sorted(totals.items())}
+
+
+def print_tree(spans: List[Dict]) -> None:
+    children = defaultdict(list)
+    for s in spans:
+        children[s["parent"]].append(s)
+    root = root_of(spans)
+    start = root["ts"]
+    skip = {"span", "parent", "trace", "name", "ts", "ms", "matcher_phases_ms"}
+
+    def walk(node: Dict, depth: int) -> None:
+        extra = " ".join(f"{k}={v}" for k, v in node.items() if k not in skip)
+        offset = (node["ts"] - start) * 1000
+        print(f"{'  ' * depth}{node['name']:<{32 - 2 * depth}} +{offset:9.1f} ms {node['ms']:10.1f} ms  {extra}")
+        phases = node.get("matcher_phases_ms")
+        if phases:
+            slowest = sorted(phases.items(), key=lambda kv: -kv[1])[:5]
+            print(f"{'  ' * (depth + 1)}фазы: " + ", ".join(f"{k}={v:.1f}" for k, v in slowest))
+        for child in sorted(children[node["span"]], key=lambda s: s["ts"]):
+            walk(child, depth + 1)
+
+    print(f"trace {root['trace']}")
+    walk(root, 0)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Разбор span'ов трассировки бота.")
+    parser.add_argument("spans", help="JSONL, записанный с BOT_SPANS_FILE")
+    parser.add_argument("--trace", default=None, help="Показать дерево одного trace id")
+    parser.add_argument("--top", type=int, default=10, help="Сколько самых долгих апдейтов показать")
+    parser.add_argument("--prefix", default=None, help="Только апдейты с этим префиксом, например menu:")
+    args = parser.parse_args(argv)
+
+    traces = load_spans(args.spans)
+    if args.trace:
+        matching = [tid for tid in traces if tid.startswith(args.trace)]
+        if not matching:
+            print(f"trace {args.trace} не найден")
+            return 1
+        for tid in matching:
+            print_tree(traces[tid])
+        return 0
+
+    roots = [(tid, root_of(spans)) for tid, spans in traces.items()]
+    if args.prefix:
+        roots = [(tid, root) for tid, root in roots if root.get("prefix") == args.prefix]
+    roots.sort(key=lambda item: -item[1]["ms"])
+    print(f"Трейсов: {len(traces)}; самые долгие {min(args.top, len(roots))}:")
+    for tid, root in roots[:args.top]:
+        print(f"\n{tid} {root['name']} {root.get('prefix', '')} {root['ms']:.1f} ms")
+        for name, (ms, count) in breakdown(traces[tid]).items():
+            print(f"  {name:<34}{ms:>10.1f} ms" + (f"  ×{count}" if count else ""))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
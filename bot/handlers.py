@@ -1,3 +1,5 @@
+import asyncio
+from datetime import date
 from aiogram import F
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
@@ -7,12 +9,17 @@ import os
 from config import USERS_TO_MATCH_JSON, PLACES_CSV
 from aiogram.exceptions import TelegramBadRequest
 
+from .metrics import NOTIFICATIONS
+from .spans import span
 from .states import Form, MainMenu
 from .utils import (
-    get_user_data, save_user_data, update_user_to_match, 
     get_places_for_office, is_valid_time_interval, convert_to_match_format,
-    run_matcher_and_get_result, read_notified_groups, write_notified_groups, is_user_notified, mark_user_notified
+    run_matcher_and_get_result_async, read_notified_groups, write_notified_groups,
+    get_match_logins, get_user_ids
 )
+from . import results as result_store
+from . import store
+from . import waves
 from .keyboards import (
     get_office_keyboard, get_time_start_keyboard, get_time_end_keyboard,
     get_add_slot_keyboard, get_lunch_duration_keyboard, get_favorite_places_keyboard,
@@ -28,76 +35,107 @@ from aiogram import Router, F, types
 logger = logging.getLogger(__name__)
 
 # --- Переместить notify_all_new_groups выше ---
-async def notify_all_new_groups(bot: Bot, output_file: str):
-    import json
-    import logging
-    print("notify_all_new_groups CALLED", flush=True)
-    logging.info("notify_all_new_groups CALLED")
-    notified = read_notified_groups()
-    with open(output_file, 'r', encoding='utf-8') as f:
-        groups = json.load(f)
-    # Получим всех пользователей, участвующих в подборе (users_to_match.json)
-    with open('data/users_to_match.json', 'r', encoding='utf-8') as f:
-        users_to_match = json.load(f)
-    match_usernames = set(u['login'] for u in users_to_match)
-    # Получим user_id для этих пользователей из users_data.csv
-    import csv
-    user_id_map = {}
+# pending — записи, которые ещё ждут волны матчинга: сообщение "слотов нет" им пока не шлём
+async def notify_all_new_groups(bot: Bot, output_file: str, pending=frozenset()):
+    with span('notify.all'):
+        await _notify_all_new_groups(bot, output_file, pending)
+
+# Текст уведомления о назначении пользователя
+def _group_message(group, username):
+    if group["lunch_time"] and group["place"]:
+        partners = [p for p in group["participants"] if p != username]
+        partners_str = ", ".join(partners) if partners else "Вы обедаете в одиночку."
+        lunch_time = f"{group['lunch_time'][0]}–{group['lunch_time'][1]}"
+        place = group["place"]
+        maps_link = group.get("maps_link", "")
+        return (
+            f"🍽 Ваш обед:\n"
+            f"Время: {lunch_time}\n"
+            f"Место: {place}\n"
+            f"Ссылка: {maps_link}\n"
+            f"Партнеры: {partners_str}"
+        )
+    return NO_MATCH_MESSAGE
+
+NO_MATCH_MESSAGE = "Пока что мы не смогли подобрать вам пару или компанию для обеда, но обязательно подберём!"
+NO_SLOTS_MESSAGE = 'Сегодня больше нет подходящих слотов для обеда. Попробуйте завтра!'
+
+# Ответ на запись в пул. В режиме волн — когда сформируется группа; иначе прогон matcher.py,
+# назначение пользователя и рассылка изменившихся групп. solo — профиль "обедаю один"
+async def _match_and_reply(message, bot, username, match_params, solo=False):
+    if waves.enabled():
+        # Режим волн: запись только пополняет пул, группу сформирует ближайшая волна
+        await message.answer(waves.scheduler().booking_message(username, match_params))
+        return
+    output_file = os.path.join("data", "output.json")
     try:
-        with open('data/users_data.csv', 'r', encoding='utf-8') as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                if row['username'] in match_usernames:
-                    user_id_map[row['username']] = int(row['user_id'])
+        group = await run_matcher_and_get_result_async(username, USERS_TO_MATCH_JSON, PLACES_CSV, output_file)
+        if solo and group and not (group["lunch_time"] and group["place"]):
+            msg = "Вы успешно записаны на обед в одиночку! Приятного аппетита :)"
+        else:
+            msg = _group_message(group, username) if group else NO_MATCH_MESSAGE
+        await message.answer(msg)
+        await notify_all_new_groups(bot, output_file)
     except Exception as e:
-        logging.error(f"Ошибка при чтении users_data.csv: {e}")
-    # Соберём всех пользователей, для которых нашлась группа
-    users_with_group = set()
-    for group in groups:
-        if group.get("lunch_time") and group.get("place"):
-            users_with_group.update(group["participants"])
-    # Отправим сообщение тем, у кого нет группы
-    for username in match_usernames - users_with_group:
-        user_id = user_id_map.get(username)
-        logging.info(f"[notify_all_new_groups] Нет группы для {username} (user_id={user_id})")
-        if user_id:
-            try:
-                await bot.send_message(user_id, 'Сегодня больше нет подходящих слотов для обеда. Попробуйте завтра!')
-                logging.info(f"[notify_all_new_groups] Сообщение 'нет слотов' отправлено {username} (user_id={user_id})")
-            except Exception as e:
-                logging.warning(f"Не удалось отправить уведомление {username} ({user_id}): {e}")
-    # Стандартная логика для найденных групп
-    for group in groups:
-        group_key = f"{sorted(group['participants'])}_{group.get('lunch_time')}_{group.get('place')}"
-        for username in group['participants']:
-            if not is_user_notified(username, group_key):
-                user_id = user_id_map.get(username)
-                logging.info(f"[notify_all_new_groups] Группа: {group}, username={username}, user_id={user_id}")
-                if user_id:
-                    if group["lunch_time"] and group["place"]:
-                        partners = [p for p in group["participants"] if p != username]
-                        partners_str = ", ".join(partners) if partners else "Вы обедаете в одиночку."
-                        lunch_time = f"{group['lunch_time'][0]}–{group['lunch_time'][1]}"
-                        place = group["place"]
-                        maps_link = group.get("maps_link", "")
-                        msg = (
-                            f"🍽 Ваш обед:\n"
-                            f"Время: {lunch_time}\n"
-                            f"Место: {place}\n"
-                            f"Ссылка: {maps_link}\n"
-                            f"Партнеры: {partners_str}"
-                        )
-                    else:
-                        msg = "Пока что мы не смогли подобрать вам пару или компанию для обеда, но обязательно подберём!"
-                    logging.info(f"[notify_all_new_groups] Пытаюсь отправить сообщение {username} (user_id={user_id}): {msg}")
-                    try:
+        logging.error(f"[_match_and_reply] Ошибка подбора для {username}: {e}")
+        await message.answer(f"Ошибка при подборе компании для обеда: {e}")
+
+# Раунды рассылки идут по одному: следующий видит базу, обновлённую предыдущим
+_notify_lock = None
+
+# Рассылка по разнице между уже разосланной версией результата и текущей:
+# сообщение получают только пользователи, чьё назначение изменилось
+async def _notify_all_new_groups(bot: Bot, output_file: str, pending=frozenset()):
+    global _notify_lock
+    logging.info("notify_all_new_groups CALLED")
+    if _notify_lock is None:
+        _notify_lock = asyncio.Lock()
+    async with _notify_lock:
+        # Оповещения действуют в пределах дня: со сменой даты база и notified_groups.json сбрасываются
+        today = date.today()
+        snapshot = result_store.snapshot_for(output_file)
+        changes = result_store.diff(result_store.notified_baseline(today), snapshot)
+        notified = result_store.keys_of_day(read_notified_groups(), today)
+        # Пользователи, участвующие в подборе (users_to_match.json), и их user_id из users_data.csv;
+        # оба файла разбираются заново, только если изменились
+        match_usernames = get_match_logins()
+        user_id_map = {}
+        try:
+            user_ids = get_user_ids()
+            user_id_map = {username: user_ids[username] for username in match_usernames if username in user_ids}
+        except Exception as e:
+            logging.error(f"Ошибка при чтении users_data.csv: {e}")
+        # Кандидаты: участники изменившихся групп и ещё ни разу не оповещённые из пула
+        candidates = changes.affected_logins() | {u for u in match_usernames if u not in notified}
+        logging.info(f"[notify_all_new_groups] Версии {changes.old_version}→{changes.new_version}: "
+                     f"{changes.summary()}, кандидатов {len(candidates)}")
+        sent = 0
+        for username in sorted(candidates):
+            group = snapshot.group_of(username)
+            if group is None and (username not in match_usernames or username in pending):
+                continue
+            key = result_store.group_key(group, today)
+            if notified.get(username) == key:
+                continue
+            user_id = user_id_map.get(username)
+            kind = 'group' if group else 'no_slots'
+            msg = _group_message(group, username) if group else NO_SLOTS_MESSAGE
+            logging.info(f"[notify_all_new_groups] {username} (user_id={user_id}): {kind}, группа {group}")
+            if user_id:
+                try:
+                    with span('notify.send', kind=kind):
                         await bot.send_message(user_id, msg)
-                        logging.info(f"[notify_all_new_groups] Сообщение отправлено {username} (user_id={user_id})")
-                    except Exception as e:
-                        logging.warning(f"Не удалось отправить уведомление {username} ({user_id}): {e}")
-                else:
-                    logging.warning(f"[notify_all_new_groups] Не найден user_id для {username}")
-                mark_user_notified(username, group_key)
+                    NOTIFICATIONS.inc(kind=kind, result='sent')
+                    sent += 1
+                except Exception as e:
+                    NOTIFICATIONS.inc(kind=kind, result='failed')
+                    logging.warning(f"Не удалось отправить уведомление {username} ({user_id}): {e}")
+            else:
+                logging.warning(f"[notify_all_new_groups] Не найден user_id для {username}")
+            notified[username] = key
+        write_notified_groups(notified)
+        result_store.mark_notified(snapshot, today)
+        logging.info(f"[notify_all_new_groups] Отправлено {sent} из {len(candidates)} кандидатов")
 
 # Заменить все вызовы edit_text на безопасный вариант с обработкой TelegramBadRequest
 async def safe_edit_text(message, text, **kwargs):
@@ -130,7 +168,7 @@ async def cmd_start(message: Message, state: FSMContext):
     user_id = message.from_user.id
     username = message.from_user.username or "No username"
     
-    user_data = get_user_data(user_id)
+    user_data = await store.get_user_data(user_id)
     
     if user_data:
         await show_main_menu(message, user_data)
@@ -139,9 +177,26 @@ async def cmd_start(message: Message, state: FSMContext):
         await start_profile_creation(message, state)
 
 async def cmd_notify_groups(message: types.Message):
-    await notify_all_new_groups(message.bot, "data/output.json")
+    pending = waves.scheduler().pending_logins() if waves.enabled() else frozenset()
+    await notify_all_new_groups(message.bot, "data/output.json", pending)
     await message.answer("Рассылка по группам из output.json выполнена.")
 
+# Профилированный прогон matcher.py по живому пулу (только для администраторов)
+async def cmd_profile_matcher(message: types.Message):
+    from config import ADMIN_IDS
+    from .utils import run_profiled_matcher_async
+    if message.from_user.id not in ADMIN_IDS:
+        logging.info(f"[cmd_profile_matcher] Отказано пользователю {message.from_user.id}")
+        return
+    await message.answer("Запускаю профилированный прогон matcher.py...")
+    try:
+        out_dir, artifacts = await run_profiled_matcher_async(USERS_TO_MATCH_JSON, PLACES_CSV)
+    except Exception as e:
+        logging.error(f"[cmd_profile_matcher] Ошибка профилирования: {e}")
+        await message.answer(f"Профилирование завершилось с ошибкой: {e}")
+        return
+    await message.answer(f"Готово. Артефакты в {out_dir}:\n" + "\n".join(artifacts.values()))
+
 router = Router()
 
 # Обработчик для главного меню
@@ -149,47 +204,36 @@ async def process_main_menu(callback_query: CallbackQuery, state: FSMContext):
     action = callback_query.data.split(':')[1]
     user_id = callback_query.from_user.id
     username = callback_query.from_user.username or f"user{user_id}"
-    user_data = get_user_data(user_id)
+    user_data = await store.get_user_data(user_id)
     
     if action == "book_lunch":
         # --- ДОБАВЛЕНО: автозаполнение users_to_match.json из профиля ---
         if user_data:
-            from .utils import update_user_to_match, run_matcher_and_get_result_async, convert_to_match_format
+            from .utils import run_matcher_and_get_result_async, convert_to_match_format
             import asyncio
-            import json
             import logging
             import os
             match_params = convert_to_match_format(user_data, username)
-            update_user_to_match(username, match_params)
-            # Проверяем, сколько пользователей сейчас в users_to_match.json
-            with open("data/users_to_match.json", "r", encoding="utf-8") as f:
-                users_to_match = json.load(f)
-            if len(users_to_match) >= 2:
-                # Очищаем notified_groups.json перед подбором
-                notified_path = os.path.join("data", "notified_groups.json")
-                if os.path.exists(notified_path):
-                    os.remove(notified_path)
-                from config import USERS_TO_MATCH_JSON, PLACES_CSV
-                output_file = os.path.join("data", "output.json")
-                await run_matcher_and_get_result_async(username, USERS_TO_MATCH_JSON, PLACES_CSV, output_file)
-                logging.info("BEFORE notify_all_new_groups")
-                print("BEFORE notify_all_new_groups", flush=True)
-                try:
-                    await notify_all_new_groups(callback_query.bot, output_file)
-                except Exception as e:
-                    logging.error(f"notify_all_new_groups ERROR: {e}")
-                    print(f"notify_all_new_groups ERROR: {e}", flush=True)
-                logging.info("AFTER notify_all_new_groups")
-                print("AFTER notify_all_new_groups", flush=True)
-                await safe_edit_text(callback_query.message,
-                    "Компания на обед подбирается! Когда найдется подходящая компания, мы вас оповестим!",
-                    reply_markup=get_back_to_menu_keyboard()
-                )
+            await store.update_user_to_match(username, match_params)
+            if waves.enabled():
+                # Режим волн: запись только пополняет пул, группу сформирует ближайшая волна
+                text = waves.scheduler().booking_message(username, match_params)
             else:
-                await safe_edit_text(callback_query.message,
-                    "Вы записаны, ждите компанию! Как только кто-то ещё запишется, мы подберём группу.",
-                    reply_markup=get_back_to_menu_keyboard()
-                )
+                # Проверяем, сколько пользователей сейчас в пуле записи
+                if await store.match_pool_size() >= 2:
+                    from config import USERS_TO_MATCH_JSON, PLACES_CSV
+                    output_file = os.path.join("data", "output.json")
+                    await run_matcher_and_get_result_async(username, USERS_TO_MATCH_JSON, PLACES_CSV, output_file)
+                    logging.info("BEFORE notify_all_new_groups")
+                    try:
+                        await notify_all_new_groups(callback_query.bot, output_file)
+                    except Exception as e:
+                        logging.error(f"notify_all_new_groups ERROR: {e}")
+                    logging.info("AFTER notify_all_new_groups")
+                    text = "Компания на обед подбирается! Когда найдется подходящая компания, мы вас оповестим!"
+                else:
+                    text = "Вы записаны, ждите компанию! Как только кто-то ещё запишется, мы подберём группу."
+            await safe_edit_text(callback_query.message, text, reply_markup=get_back_to_menu_keyboard())
             await state.set_state(MainMenu.main)
             await callback_query.answer()
             return
@@ -248,14 +292,14 @@ async def process_lunch_preference(callback_query: CallbackQuery, state: FSMCont
     choice = callback_query.data.split(':')[1]
     user_id = callback_query.from_user.id
     username = callback_query.from_user.username or f"user{user_id}"
-    user_data = get_user_data(user_id)
+    user_data = await store.get_user_data(user_id)
     
     if choice == "by_profile":
         # Пользователь хочет использовать свои настройки из профиля
         if user_data:
             # Конвертируем данные в формат для матчинга и сохраняем
             match_params = convert_to_match_format(user_data, username)
-            update_user_to_match(username, match_params)
+            await store.update_user_to_match(username, match_params)
             
             await safe_edit_text(callback_query.message,
                 "Отлично! Мы используем ваши настройки из профиля для подбора компании на обед сегодня.\n"
@@ -397,7 +441,7 @@ async def process_lunch_place(callback_query: CallbackQuery, state: FSMContext):
         custom_lunch_data['favourite_places'] = fav_places
         await state.update_data(custom_lunch_data=custom_lunch_data)
         user_id = callback_query.from_user.id
-        user_data = get_user_data(user_id)
+        user_data = await store.get_user_data(user_id)
         office = user_data.get('office') if user_data else None
         places_for_office = get_places_for_office(office)
         keyboard = get_lunch_favorite_places_keyboard(places_for_office, fav_places)
@@ -415,7 +459,7 @@ async def process_lunch_company(callback_query: CallbackQuery, state: FSMContext
     if company_size == "done":
         user_id = callback_query.from_user.id
         username = callback_query.from_user.username or f"user{user_id}"
-        user_data = get_user_data(user_id)
+        user_data = await store.get_user_data(user_id)
         match_params = convert_to_match_format(user_data, username)
         if 'time_slots' in custom_lunch_data:
             match_params['time_slots'] = custom_lunch_data['time_slots']
@@ -471,7 +515,7 @@ async def process_lunch_confirmation(callback_query: CallbackQuery, state: FSMCo
         
         user_id = callback_query.from_user.id
         username = callback_query.from_user.username or f"user{user_id}"
-        user_data = get_user_data(user_id)
+        user_data = await store.get_user_data(user_id)
         
         if user_data:
             # Берем базовые параметры из профиля
@@ -488,49 +532,11 @@ async def process_lunch_confirmation(callback_query: CallbackQuery, state: FSMCo
                 match_params['max_lunch_duration'] = custom_lunch_data['max_lunch_duration']
             
             # Сохраняем данные для матчинга
-            update_user_to_match(username, match_params)
+            await store.update_user_to_match(username, match_params)
             
-            # Запускаем matcher.py и отправляем результат пользователю
-            output_file = os.path.join("data", "output.json")
-            try:
-                logging.info(f'[DEBUG] about to call run_matcher_and_get_result for {username}')
-                group = run_matcher_and_get_result(
-                    username,
-                    USERS_TO_MATCH_JSON,
-                    PLACES_CSV,
-                    output_file
-                )
-                logging.info(f'[DEBUG] run_matcher_and_get_result успешно вызван для {username}')
-                if group:
-                    if group["lunch_time"] and group["place"]:
-                        partners = [p for p in group["participants"] if p != username]
-                        partners_str = ", ".join(partners) if partners else "Вы обедаете в одиночку."
-                        lunch_time = f"{group['lunch_time'][0]}–{group['lunch_time'][1]}"
-                        place = group["place"]
-                        maps_link = group.get("maps_link", "")
-                        msg = (
-                            f"🍽 Ваш обед:\n"
-                            f"Время: {lunch_time}\n"
-                            f"Место: {place}\n"
-                            f"Ссылка: {maps_link}\n"
-                            f"Партнеры: {partners_str}"
-                        )
-                    else:
-                        # --- ДОБАВЛЕНО: обработка одиночного обеда ---
-                        user_data_check = get_user_data(user_id)
-                        if user_data_check and user_data_check.get('company_size') == ['1']:
-                            msg = "Вы успешно записаны на обед в одиночку! Приятного аппетита :)"
-                        else:
-                            msg = "Пока что мы не смогли подобрать вам пару или компанию для обеда, но обязательно подберём!"
-                else:
-                    msg = "Пока что мы не смогли подобрать вам пару или компанию для обеда, но обязательно подберём!"
-                await callback_query.message.answer(msg)
-                logging.info(f'[DEBUG] сообщение пользователю отправлено для {username}')
-                await notify_all_new_groups(callback_query.bot, output_file)
-                logging.info(f'[DEBUG] notify_all_new_groups вызван для {username}')
-            except Exception as e:
-                logging.error(f'[DEBUG] Exception in process_lunch_confirmation for {username}: {e}')
-                await callback_query.message.answer(f"Ошибка при подборе компании для обеда: {e}")
+            # Запускаем matcher.py (или ставим в волну) и отвечаем пользователю
+            await _match_and_reply(callback_query.message, callback_query.bot, username, match_params,
+                                   solo=user_data.get('company_size') == ['1'])
             
             await safe_edit_text(callback_query.message,
                 "Вы успешно записаны на обед! Мы оповестим вас о найденной компании в ближайшее время.",
@@ -598,7 +604,7 @@ async def process_edit_field(callback_query: CallbackQuery, state: FSMContext):
     elif field == "favorite_places":
         # Редактирование любимых мест
         user_id = callback_query.from_user.id
-        user_data = get_user_data(user_id)
+        user_data = await store.get_user_data(user_id)
         office = user_data.get('office') if user_data else None
         favorite_places = user_data.get('favorite_places', []) if user_data else []
         
@@ -624,7 +630,7 @@ async def process_edit_field(callback_query: CallbackQuery, state: FSMContext):
     elif field == "disliked_places":
         # Редактирование нелюбимых мест
         user_id = callback_query.from_user.id
-        user_data = get_user_data(user_id)
+        user_data = await store.get_user_data(user_id)
         office = user_data.get('office') if user_data else None
         disliked_places = user_data.get('disliked_places', []) if user_data else []
         
@@ -651,7 +657,7 @@ async def process_edit_field(callback_query: CallbackQuery, state: FSMContext):
         # Редактирование размера компании
         user_id = callback_query.from_user.id
         username = callback_query.from_user.username or f"user{user_id}"
-        user_data = get_user_data(user_id)
+        user_data = await store.get_user_data(user_id)
         company_size = user_data.get('company_size', []) if user_data else []
         
         keyboard = get_company_size_keyboard(company_size)
@@ -666,7 +672,7 @@ async def process_edit_field(callback_query: CallbackQuery, state: FSMContext):
     elif field == "back":
         # Возврат в главное меню
         user_id = callback_query.from_user.id
-        user_data = get_user_data(user_id)
+        user_data = await store.get_user_data(user_id)
         
         await show_main_menu(callback_query.message, user_data)
         await state.set_state(MainMenu.main)
@@ -703,13 +709,13 @@ async def process_office(callback_query: CallbackQuery, state: FSMContext):
         # Сохраняем изменения и возвращаемся в меню редактирования
         user_id = callback_query.from_user.id
         username = callback_query.from_user.username or f"user{user_id}"
-        user_data = get_user_data(user_id) or {}
+        user_data = await store.get_user_data(user_id) or {}
         
         # Обновляем офис
         user_data['office'] = office
         
         # Сохраняем изменения
-        save_user_data(user_id, username, user_data)
+        await store.save_user_data(user_id, username, user_data)
         
         # Показываем сообщение об успешном обновлении
         keyboard = get_after_edit_keyboard()
@@ -771,13 +777,13 @@ async def process_add_more_slots(callback_query: CallbackQuery, state: FSMContex
         await state.set_state(Form.select_time_start)
     else:
         user_id = callback_query.from_user.id
-        user_data = get_user_data(user_id)
+        user_data = await store.get_user_data(user_id)
         if user_data:
             data = await state.get_data()
             time_slots = data.get('time_slots', [])
             user_data['time_slots'] = time_slots
             username = callback_query.from_user.username or f"user{user_id}"
-            save_user_data(user_id, username, user_data)
+            await store.save_user_data(user_id, username, user_data)
             keyboard = get_after_edit_keyboard()
             await safe_edit_text(callback_query.message,
                 "Временные слоты успешно обновлены.",
@@ -802,46 +808,17 @@ async def process_lunch_duration(callback_query: CallbackQuery, state: FSMContex
     
     # Проверяем, это новый профиль или редактирование
     user_id = callback_query.from_user.id
-    user_data = get_user_data(user_id)
+    user_data = await store.get_user_data(user_id)
     
     if user_data and 'time_slots' not in await state.get_data():
         # Это редактирование - сохраняем новую длительность и возвращаемся в меню редактирования
         user_data['lunch_duration'] = duration
         username = callback_query.from_user.username or f"user{user_id}"
-        save_user_data(user_id, username, user_data)
+        await store.save_user_data(user_id, username, user_data)
         # --- Запуск matcher.py и рассылка результата ---
-        from config import USERS_TO_MATCH_JSON, PLACES_CSV
-        import os
-        output_file = os.path.join("data", "output.json")
-        from .utils import run_matcher_and_get_result
         match_params = convert_to_match_format(user_data, username)
-        update_user_to_match(username, match_params)
-        try:
-            group = run_matcher_and_get_result(
-                username,
-                USERS_TO_MATCH_JSON,
-                PLACES_CSV,
-                output_file
-            )
-            if group and group["lunch_time"] and group["place"]:
-                partners = [p for p in group["participants"] if p != username]
-                partners_str = ", ".join(partners) if partners else "Вы обедаете в одиночку."
-                lunch_time = f"{group['lunch_time'][0]}–{group['lunch_time'][1]}"
-                place = group["place"]
-                maps_link = group.get("maps_link", "")
-                msg = (
-                    f"🍽 Ваш обед:\n"
-                    f"Время: {lunch_time}\n"
-                    f"Место: {place}\n"
-                    f"Ссылка: {maps_link}\n"
-                    f"Партнеры: {partners_str}"
-                )
-            else:
-                msg = "Пока что мы не смогли подобрать вам пару или компанию для обеда, но обязательно подберём!"
-            await callback_query.message.answer(msg)
-            await notify_all_new_groups(callback_query.bot, output_file)
-        except Exception as e:
-            await callback_query.message.answer(f"Ошибка при подборе компании для обеда: {e}")
+        await store.update_user_to_match(username, match_params)
+        await _match_and_reply(callback_query.message, callback_query.bot, username, match_params)
         keyboard = get_after_edit_keyboard()
         await safe_edit_text(callback_query.message,
             f"Длительность обеда успешно обновлена на: {duration} минут",
@@ -884,7 +861,7 @@ async def process_favorite_places(callback_query: CallbackQuery, state: FSMConte
     if choice == "done":
         # Проверяем, это новый профиль или редактирование
         user_id = callback_query.from_user.id
-        user_data = get_user_data(user_id)
+        user_data = await store.get_user_data(user_id)
         import logging
         logging.info(f'[DEBUG] user_id={user_id}, user_data={user_data} в process_favorite_places')
         if user_data:
@@ -892,40 +869,11 @@ async def process_favorite_places(callback_query: CallbackQuery, state: FSMConte
             # Это редактирование - сохраняем новые любимые места и возвращаемся в меню редактирования
             user_data['favorite_places'] = favorite_places
             username = callback_query.from_user.username or f"user{user_id}"
-            save_user_data(user_id, username, user_data)
+            await store.save_user_data(user_id, username, user_data)
             # --- Запуск matcher.py и рассылка результата ---
-            from config import USERS_TO_MATCH_JSON, PLACES_CSV
-            import os
-            output_file = os.path.join("data", "output.json")
-            from .utils import run_matcher_and_get_result
             match_params = convert_to_match_format(user_data, username)
-            update_user_to_match(username, match_params)
-            try:
-                group = run_matcher_and_get_result(
-                    username,
-                    USERS_TO_MATCH_JSON,
-                    PLACES_CSV,
-                    output_file
-                )
-                if group and group["lunch_time"] and group["place"]:
-                    partners = [p for p in group["participants"] if p != username]
-                    partners_str = ", ".join(partners) if partners else "Вы обедаете в одиночку."
-                    lunch_time = f"{group['lunch_time'][0]}–{group['lunch_time'][1]}"
-                    place = group["place"]
-                    maps_link = group.get("maps_link", "")
-                    msg = (
-                        f"🍽 Ваш обед:\n"
-                        f"Время: {lunch_time}\n"
-                        f"Место: {place}\n"
-                        f"Ссылка: {maps_link}\n"
-                        f"Партнеры: {partners_str}"
-                    )
-                else:
-                    msg = "Пока что мы не смогли подобрать вам пару или компанию для обеда, но обязательно подберём!"
-                await callback_query.message.answer(msg)
-                await notify_all_new_groups(callback_query.bot, output_file)
-            except Exception as e:
-                await callback_query.message.answer(f"Ошибка при подборе компании для обеда: {e}")
+            await store.update_user_to_match(username, match_params)
+            await _match_and_reply(callback_query.message, callback_query.bot, username, match_params)
             keyboard = get_after_edit_keyboard()
             await safe_edit_text(callback_query.message,
                 "Любимые места успешно обновлены.",
@@ -979,7 +927,7 @@ async def process_disliked_places(callback_query: CallbackQuery, state: FSMConte
     if choice == "done":
         # Проверяем, это новый профиль или редактирование
         user_id = callback_query.from_user.id
-        user_data = get_user_data(user_id)
+        user_data = await store.get_user_data(user_id)
         import logging
         logging.info(f'[DEBUG] user_id={user_id}, user_data={user_data} в process_disliked_places')
         if user_data:
@@ -988,41 +936,12 @@ async def process_disliked_places(callback_query: CallbackQuery, state: FSMConte
             user_data['disliked_places'] = disliked_places
             username = callback_query.from_user.username or f"user{user_id}"
             
-            save_user_data(user_id, username, user_data)
+            await store.save_user_data(user_id, username, user_data)
             
             # --- Запуск matcher.py и рассылка результата ---
-            from config import USERS_TO_MATCH_JSON, PLACES_CSV
-            import os
-            output_file = os.path.join("data", "output.json")
-            from .utils import run_matcher_and_get_result
             match_params = convert_to_match_format(user_data, username)
-            update_user_to_match(username, match_params)
-            try:
-                group = run_matcher_and_get_result(
-                    username,
-                    USERS_TO_MATCH_JSON,
-                    PLACES_CSV,
-                    output_file
-                )
-                if group and group["lunch_time"] and group["place"]:
-                    partners = [p for p in group["participants"] if p != username]
-                    partners_str = ", ".join(partners) if partners else "Вы обедаете в одиночку."
-                    lunch_time = f"{group['lunch_time'][0]}–{group['lunch_time'][1]}"
-                    place = group["place"]
-                    maps_link = group.get("maps_link", "")
-                    msg = (
-                        f"🍽 Ваш обед:\n"
-                        f"Время: {lunch_time}\n"
-                        f"Место: {place}\n"
-                        f"Ссылка: {maps_link}\n"
-                        f"Партнеры: {partners_str}"
-                    )
-                else:
-                    msg = "Пока что мы не смогли подобрать вам пару или компанию для обеда, но обязательно подберём!"
-                await callback_query.message.answer(msg)
-                await notify_all_new_groups(callback_query.bot, output_file)
-            except Exception as e:
-                await callback_query.message.answer(f"Ошибка при подборе компании для обеда: {e}")
+            await store.update_user_to_match(username, match_params)
+            await _match_and_reply(callback_query.message, callback_query.bot, username, match_params)
             keyboard = get_after_edit_keyboard()
             await safe_edit_text(callback_query.message,
                 "Нелюбимые места успешно обновлены.",
@@ -1073,7 +992,7 @@ async def process_company_size(callback_query: CallbackQuery, state: FSMContext)
     if choice == "done":
         # Проверяем, это новый профиль или редактирование
         user_id = callback_query.from_user.id
-        user_data = get_user_data(user_id)
+        user_data = await store.get_user_data(user_id)
         import logging
         logging.info(f'[DEBUG] user_id={user_id}, user_data={user_data} в process_company_size')
         if user_data:
@@ -1082,41 +1001,12 @@ async def process_company_size(callback_query: CallbackQuery, state: FSMContext)
             user_data['company_size'] = company_size
             username = callback_query.from_user.username or f"user{user_id}"
             
-            save_user_data(user_id, username, user_data)
+            await store.save_user_data(user_id, username, user_data)
             
             # --- Запуск matcher.py и рассылка результата ---
-            from config import USERS_TO_MATCH_JSON, PLACES_CSV
-            import os
-            output_file = os.path.join("data", "output.json")
-            from .utils import run_matcher_and_get_result
             match_params = convert_to_match_format(user_data, username)
-            update_user_to_match(username, match_params)
-            try:
-                group = run_matcher_and_get_result(
-                    username,
-                    USERS_TO_MATCH_JSON,
-                    PLACES_CSV,
-                    output_file
-                )
-                if group and group["lunch_time"] and group["place"]:
-                    partners = [p for p in group["participants"] if p != username]
-                    partners_str = ", ".join(partners) if partners else "Вы обедаете в одиночку."
-                    lunch_time = f"{group['lunch_time'][0]}–{group['lunch_time'][1]}"
-                    place = group["place"]
-                    maps_link = group.get("maps_link", "")
-                    msg = (
-                        f"🍽 Ваш обед:\n"
-                        f"Время: {lunch_time}\n"
-                        f"Место: {place}\n"
-                        f"Ссылка: {maps_link}\n"
-                        f"Партнеры: {partners_str}"
-                    )
-                else:
-                    msg = "Пока что мы не смогли подобрать вам пару или компанию для обеда, но обязательно подберём!"
-                await callback_query.message.answer(msg)
-                await notify_all_new_groups(callback_query.bot, output_file)
-            except Exception as e:
-                await callback_query.message.answer(f"Ошибка при подборе компании для обеда: {e}")
+            await store.update_user_to_match(username, match_params)
+            await _match_and_reply(callback_query.message, callback_query.bot, username, match_params)
             keyboard = get_after_edit_keyboard()
             await safe_edit_text(callback_query.message,
                 "Размер компании успешно обновлен.",
@@ -1182,46 +1072,12 @@ async def process_confirmation(callback_query: CallbackQuery, state: FSMContext)
             data['disliked_places'] = []
         if not data.get('company_size'):
             data['company_size'] = []
-        save_user_data(user_id, username, data)
+        await store.save_user_data(user_id, username, data)
         logging.info(f'[DEBUG] после save_user_data для {username}')
         match_params = convert_to_match_format(data, username)
-        update_user_to_match(username, match_params)
+        await store.update_user_to_match(username, match_params)
         logging.info(f'[DEBUG] после update_user_to_match для {username}')
-        output_file = os.path.join("data", "output.json")
-        try:
-            logging.info(f'[DEBUG] about to call run_matcher_and_get_result for {username}')
-            group = run_matcher_and_get_result(
-                username,
-                USERS_TO_MATCH_JSON,
-                PLACES_CSV,
-                output_file
-            )
-            logging.info(f'[DEBUG] run_matcher_and_get_result успешно вызван для {username}')
-            if group:
-                if group["lunch_time"] and group["place"]:
-                    partners = [p for p in group["participants"] if p != username]
-                    partners_str = ", ".join(partners) if partners else "Вы обедаете в одиночку."
-                    lunch_time = f"{group['lunch_time'][0]}–{group['lunch_time'][1]}"
-                    place = group["place"]
-                    maps_link = group.get("maps_link", "")
-                    msg = (
-                        f"🍽 Ваш обед:\n"
-                        f"Время: {lunch_time}\n"
-                        f"Место: {place}\n"
-                        f"Ссылка: {maps_link}\n"
-                        f"Партнеры: {partners_str}"
-                    )
-                else:
-                    msg = "Пока что мы не смогли подобрать вам пару или компанию для обеда, но обязательно подберём!"
-            else:
-                msg = "Пока что мы не смогли подобрать вам пару или компанию для обеда, но обязательно подберём!"
-            await callback_query.message.answer(msg)
-            logging.info(f'[DEBUG] сообщение пользователю отправлено для {username}')
-            await notify_all_new_groups(callback_query.bot, output_file)
-            logging.info(f'[DEBUG] notify_all_new_groups вызван для {username}')
-        except Exception as e:
-            logging.error(f'[DEBUG] Exception in process_confirmation for {username}: {e}')
-            await callback_query.message.answer(f"Ошибка при подборе компании для обеда: {e}")
+        await _match_and_reply(callback_query.message, callback_query.bot, username, match_params)
         await safe_edit_text(callback_query.message,
             "Спасибо! Ваша анкета сохранена. Теперь вы можете записаться на обед или изменить настройки.")
         await show_main_menu(callback_query.message, data)
@@ -1350,6 +1206,7 @@ def register_all_handlers(dp):
     # Регистрация обработчиков команд
     dp.message.register(cmd_start, Command("start"))
     dp.message.register(cmd_notify_groups, Command("notify_groups"))
+    dp.message.register(cmd_profile_matcher, Command("profile_matcher"))
 
     # Регистрация обработчиков для главного меню
     dp.callback_query.register(process_main_menu, F.data.startswith("menu:"))
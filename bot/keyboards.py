@@ -1,5 +1,6 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from config import OFFICES, TIME_OPTIONS, LUNCH_DURATIONS, COMPANY_SIZES
+from timeutils import to_minutes
 
 # Клавиатура выбора офиса
 def get_office_keyboard():
@@ -15,7 +16,7 @@ def get_time_start_keyboard():
 
 # Клавиатура выбора времени конца
 def get_time_end_keyboard(start_time):
-    filtered_times = [t for t in TIME_OPTIONS if t > start_time]
+    filtered_times = [t for t in TIME_OPTIONS if to_minutes(t) > to_minutes(start_time)]
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text=(time_opt if ':' in time_opt else f"{int(time_opt):02d}:00"), callback_data=f"time_end:{(time_opt if ':' in time_opt else f'{int(time_opt):02d}:00')}")] for time_opt in filtered_times
     ] + [[InlineKeyboardButton(text="⬅️ Назад", callback_data="back:time_end")]])
@@ -115,7 +116,7 @@ def get_lunch_time_start_keyboard():
 def get_lunch_time_end_keyboard(start_time):
     from config import TIME_OPTIONS
     from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-    filtered_times = [t for t in TIME_OPTIONS if t > start_time]
+    filtered_times = [t for t in TIME_OPTIONS if to_minutes(t) > to_minutes(start_time)]
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text=time_opt, callback_data=f"lunch_time_end:{time_opt}")] for time_opt in filtered_times
     ] + [[InlineKeyboardButton(text="⬅️ Назад", callback_data="back:lunch_time_end")]])
@@ -0,0 +1,255 @@
+import asyncio
+import functools
+import logging
+import threading
+import time
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+from . import spans
+
+# Живые метрики процесса бота в текстовом формате Prometheus.
+# Сервер поднимается только при заданном BOT_METRICS_PORT и слушает localhost:
+# GET /metrics. Сами счётчики дешёвые и считаются всегда — в памяти процесса.
+# Синхронный matcher.py работает в пуле потоков, поэтому у каждой метрики свой Lock.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+REGISTRY = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels_text(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{value}"' for name, value in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._sample_lines(key, value))
+        return lines
+
+    def _sample_lines(self, key, value):
+        return [f'{self.name}{_labels_text(self.labelnames, key)} {_number(value)}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        # Значение без меток можно вычислять в момент запроса /metrics
+        self.function = function
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def expose(self):
+        if self.function is not None:
+            try:
+                self.set(self.function())
+            except Exception as e:
+                logging.warning(f"[metrics] Не удалось вычислить {self.name}: {e}")
+        return super().expose()
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def _sample_lines(self, key, value):
+        counts, total, count = value
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            labels = _labels_text(self.labelnames, key, [('le', _number(bound))])
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = _labels_text(self.labelnames, key)
+        lines.append(f'{self.name}_sum{labels} {_number(total)}')
+        lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+HANDLER_SECONDS = Histogram('bot_handler_seconds', 'Время обработки апдейта по префиксу колбэка или команде', ['prefix'])
+HANDLER_ERRORS = Counter('bot_handler_errors_total', 'Исключения из обработчиков', ['prefix'])
+MATCHER_SECONDS = Histogram('bot_matcher_run_seconds', 'Длительность прогона matcher.py по офису', ['office', 'mode'])
+MATCHER_RUNS = Counter('bot_matcher_runs_total', 'Прогоны matcher.py по результату', ['result'])
+MATCHER_IN_FLIGHT = Gauge('bot_matcher_runs_in_flight', 'Прогоны matcher.py, запущенные и ещё не завершённые')
+MATCHER_STALE_SHARDS = Histogram('bot_matcher_stale_shards', 'Офисов к пересчёту на один вызов матчинга',
+                                 buckets=(0, 1, 2, 3, 5, 10, 20))
+STORAGE_SECONDS = Histogram('bot_storage_seconds', 'Операции с файловым хранилищем', ['op'])
+NOTIFICATIONS = Counter('bot_notifications_total', 'Отправка уведомлений о группах', ['kind', 'result'])
+LOOP_LAG_SECONDS = Histogram('bot_event_loop_lag_seconds', 'Опоздание пробуждения event loop',
+                             buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+_loop_lag_max = 0.0
+
+
+def _take_loop_lag_max():
+    global _loop_lag_max
+    value, _loop_lag_max = _loop_lag_max, 0.0
+    return value
+
+
+LOOP_LAG_MAX = Gauge('bot_event_loop_lag_max_seconds', 'Максимальное опоздание event loop с прошлого /metrics',
+                     function=_take_loop_lag_max)
+
+
+def expose():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.expose())
+    return '\n'.join(lines) + '\n'
+
+
+# Замер времени синхронной функции хранилища: @timed_storage('save_user_data');
+# при включённой трассировке операция пишется и как span "storage.<op>"
+def timed_storage(op):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                if spans.spans_enabled():
+                    with spans.span(f'storage.{op}'):
+                        return func(*args, **kwargs)
+                return func(*args, **kwargs)
+            finally:
+                STORAGE_SECONDS.observe(time.perf_counter() - started, op=op)
+        return wrapper
+    return decorator
+
+
+# Команды бота; прочий текст с "/" попадает в одну метку, чтобы не раздувать число рядов
+KNOWN_COMMANDS = ('/start', '/notify_groups', '/profile_matcher')
+
+
+# Метка апдейта: префикс колбэка ("menu:", "lunch_confirm:") или команда ("/start")
+def update_prefix(event: Update):
+    if event.callback_query:
+        data = event.callback_query.data or ''
+        return data.split(':', 1)[0] + ':' if ':' in data else 'callback'
+    if event.message:
+        text = event.message.text or ''
+        if not text.startswith('/'):
+            return 'message'
+        command = text.split()[0].split('@', 1)[0]
+        return command if command in KNOWN_COMMANDS else '/other'
+    return event.event_type
+
+
+class MetricsMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event: Update, data):
+        prefix = update_prefix(event)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(prefix=prefix)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, prefix=prefix)
+
+
+# Опоздание пробуждений event loop относительно запрошенного sleep
+async def monitor_loop_lag(interval=0.1):
+    global _loop_lag_max
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - expected)
+        LOOP_LAG_SECONDS.observe(lag)
+        _loop_lag_max = max(_loop_lag_max, lag)
+
+
+# Размер FSM-хранилища: записей и записей с активным состоянием (для MemoryStorage)
+def watch_fsm_storage(storage):
+    records = getattr(storage, 'storage', None)
+    if records is None:
+        return
+    Gauge('bot_fsm_storage_records', 'Записей в FSM-хранилище', function=lambda: len(records))
+    Gauge('bot_fsm_active_states', 'Пользователей с активным состоянием FSM',
+          function=lambda: sum(1 for record in list(records.values()) if record.state is not None))
+
+
+# Запуск HTTP-сервера /metrics и фонового замера задержки event loop
+async def start_metrics_server(port, host='127.0.0.1', storage=None):
+    from aiohttp import web
+
+    async def handle_metrics(request):
+        return web.Response(text=expose(), content_type='text/plain', charset='utf-8',
+                            headers={'X-Content-Type-Options': 'nosniff'})
+
+    if storage is not None:
+        watch_fsm_storage(storage)
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    lag_task = asyncio.create_task(monitor_loop_lag())
+    logging.info(f"[start_metrics_server] Метрики на http://{host}:{port}/metrics")
+    return runner, lag_task
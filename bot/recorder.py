@@ -0,0 +1,53 @@
+import hmac
+import json
+import logging
+import os
+import time
+from datetime import datetime
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+from logutils import QueuedLineWriter
+
+# Запись входящих апдейтов для офлайн-воспроизведения (bench/replay.py).
+# Включается переменной окружения BOT_RECORD_UPDATES=путь.jsonl, по умолчанию выключена.
+# Пользователи анонимизированы: вместо id и username — HMAC с солью, которая живёт
+# только в памяти процесса, так что записи разных запусков между собой не связываются.
+# Текст сообщений, кроме команд, не сохраняется. Строки пишет фоновый поток
+# (logutils.QueuedLineWriter), event loop только кладёт их в очередь.
+
+class UpdateRecorderMiddleware(BaseMiddleware):
+    def __init__(self, path):
+        self.path = path
+        self._salt = os.urandom(16)
+        self._writer = QueuedLineWriter(path)
+        logging.info(f"[UpdateRecorderMiddleware] Запись апдейтов в {path}")
+
+    def _pseudonym(self, user_id):
+        return hmac.new(self._salt, str(user_id).encode('utf-8'), 'sha256').hexdigest()[:12]
+
+    async def __call__(self, handler, event: Update, data):
+        record = {'ts': datetime.now().isoformat(timespec='milliseconds')}
+        user = data.get('event_from_user')
+        record['user'] = self._pseudonym(user.id) if user else None
+        if event.callback_query:
+            record['kind'] = 'callback'
+            record['data'] = event.callback_query.data
+        elif event.message:
+            text = event.message.text or ''
+            record['kind'] = 'message'
+            record['data'] = text.split()[0] if text.startswith('/') else None
+        else:
+            record['kind'] = event.event_type
+        state = data.get('state')
+        record['state'] = await state.get_state() if state else None
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            record['ms'] = round((time.perf_counter() - started) * 1000, 2)
+            self._writer.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')))
+
+    def close(self):
+        self._writer.close()
@@ -0,0 +1,197 @@
+import json
+import os
+import stat
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import date
+from types import MappingProxyType
+
+# Опубликованный результат матчинга. Каждое слияние шардов публикует новый снимок:
+# неизменяемый список групп и индекс login → группа, с растущим номером версии.
+# Публикация — одна замена ссылки, поэтому читатель всегда видит целый снимок,
+# а поиск группы пользователя — O(1). Группы внутри снимка только для чтения.
+# Снимок на диске (output.json) пишется во временный файл и переименовывается.
+
+
+@dataclass(frozen=True)
+class ResultSnapshot:
+    version: int
+    groups: tuple
+    by_login: MappingProxyType
+    path: str = None
+    # (inode, mtime, размер) записанного снимка: по нему видно, что файл не подменили
+    file_key: tuple = None
+    published_at: float = field(default_factory=time.time)
+
+    def group_of(self, login):
+        return self.by_login.get(login)
+
+
+def _build(groups, version, path, file_key=None):
+    groups = tuple(groups)
+    by_login = {}
+    for group in groups:
+        for login in group.get('participants', ()):
+            by_login[login] = group
+    return ResultSnapshot(version, groups, MappingProxyType(by_login), path, file_key)
+
+
+def _file_key(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+_current = _build((), 0, None)
+_publish_lock = threading.Lock()
+
+
+def current():
+    return _current
+
+
+# Запись файла целиком или никак: пишем во временный файл рядом и делаем os.replace,
+# так что читатели без блокировки видят либо старое, либо новое содержимое
+@contextmanager
+def atomic_write(path, newline=None):
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        # mkstemp создаёт файл с правами 0600 — сохраняем права заменяемого файла
+        try:
+            os.chmod(tmp_path, stat.S_IMODE(os.stat(path).st_mode))
+        except FileNotFoundError:
+            os.chmod(tmp_path, 0o644)
+        with os.fdopen(fd, 'w', encoding='utf-8', newline=newline) as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def write_json_atomic(path, data, **dump_kwargs):
+    with atomic_write(path) as f:
+        json.dump(data, f, ensure_ascii=False, **dump_kwargs)
+
+
+# Публикует новый результат и, если задан path, атомарно пишет его снимок на диск
+def publish(groups, path=None):
+    global _current
+    with _publish_lock:
+        groups = tuple(groups)
+        file_key = None
+        if path:
+            write_json_atomic(path, list(groups), separators=(',', ':'))
+            file_key = _file_key(path)
+        snapshot = _build(groups, _current.version + 1, path, file_key)
+        _current = snapshot
+    return snapshot
+
+
+# Снимок для файла результата: опубликованный, если файл — ровно его запись, иначе прочитанный с диска
+def snapshot_for(path):
+    snapshot = _current
+    file_key = _file_key(path)
+    if snapshot.version and snapshot.path == path and file_key is not None and snapshot.file_key == file_key:
+        return snapshot
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            groups = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        groups = []
+    return _build(groups, 0, path, file_key)
+
+
+# При старте бота: последний результат с диска становится текущим снимком
+def load(path):
+    global _current
+    snapshot = snapshot_for(path)
+    with _publish_lock:
+        if not _current.version:
+            _current = _build(snapshot.groups, 1, path, snapshot.file_key)
+    return _current
+
+
+# Ключ назначения пользователя: день, состав, время и место группы (без группы — только день).
+# Та же группа на следующий день — новое назначение, о нём снова оповещаем
+def group_key(group, day=None):
+    day = (day or date.today()).isoformat()
+    if not group:
+        return f"{day}_"
+    return f"{day}_{sorted(group['participants'])}_{group.get('lunch_time')}_{group.get('place')}"
+
+
+# Ключи из notified_groups.json, выданные в этот день; вчерашние оповещения не в счёт
+def keys_of_day(notified, day=None):
+    prefix = group_key(None, day)
+    return {login: key for login, key in notified.items() if isinstance(key, str) and key.startswith(prefix)}
+
+
+# Разница между двумя версиями результата. Группа опознаётся по составу участников:
+# тот же состав с другим временем или местом — changed, новый состав — added,
+# исчезнувший — dissolved
+@dataclass(frozen=True)
+class GroupDiff:
+    old_version: int
+    new_version: int
+    added: tuple
+    dissolved: tuple
+    changed: tuple  # пары (старая группа, новая группа)
+    unchanged: tuple
+
+    # Пользователи, чьё назначение могло измениться: участники новых, изменённых и распавшихся групп
+    def affected_logins(self):
+        logins = set()
+        for group in self.added + self.dissolved:
+            logins.update(group['participants'])
+        for _, group in self.changed:
+            logins.update(group['participants'])
+        return logins
+
+    def summary(self):
+        return {'added': len(self.added), 'dissolved': len(self.dissolved),
+                'changed': len(self.changed), 'unchanged': len(self.unchanged)}
+
+
+def diff(old, new):
+    old_by_members = {frozenset(group['participants']): group for group in old.groups}
+    new_by_members = {frozenset(group['participants']): group for group in new.groups}
+    added, changed, unchanged = [], [], []
+    for members, group in new_by_members.items():
+        previous = old_by_members.get(members)
+        if previous is None:
+            added.append(group)
+        elif (previous.get('lunch_time'), previous.get('place')) != (group.get('lunch_time'), group.get('place')):
+            changed.append((previous, group))
+        else:
+            unchanged.append(group)
+    dissolved = [group for members, group in old_by_members.items() if members not in new_by_members]
+    return GroupDiff(old.version, new.version, tuple(added), tuple(dissolved), tuple(changed), tuple(unchanged))
+
+
+# Снимок, о котором пользователи уже оповещены в этот день: база для следующего diff.
+# После перезапуска и со сменой дня база пустая — первый diff считает все группы новыми,
+# а лишние повторы отсекает notified_groups.json
+_notified = _current
+_notified_day = None
+
+
+def notified_baseline(day=None):
+    if _notified_day != (day or date.today()):
+        return _build((), 0, None)
+    return _notified
+
+
+def mark_notified(snapshot, day=None):
+    global _notified, _notified_day
+    _notified, _notified_day = snapshot, day or date.today()
@@ -0,0 +1,94 @@
+import contextvars
+import json
+import os
+import time
+import uuid
+from contextlib import contextmanager
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+from logutils import QueuedLineWriter
+
+# Сквозная трассировка: у каждого апдейта свой trace id, он идёт через контекстную
+# переменную во все вложенные операции (хранилище, прогоны matcher.py, рассылку),
+# в matcher.py — через переменную окружения LUNCH_TRACE_ID. Каждая операция —
+# span: строка JSON с trace, id, parent, именем, временем начала и длительностью.
+# Включается BOT_SPANS_FILE=путь.jsonl; выключенная трассировка почти ничего не стоит.
+
+TRACE_ENV = 'LUNCH_TRACE_ID'
+
+_writer = None
+# (trace id, id текущего span) или None вне трассируемой операции
+_current = contextvars.ContextVar('lunch_span', default=None)
+
+
+def enable_spans(path):
+    global _writer
+    disable_spans()
+    _writer = QueuedLineWriter(path)
+    return _writer
+
+
+def disable_spans():
+    global _writer
+    if _writer is not None:
+        _writer.close()
+        _writer = None
+
+
+def spans_enabled():
+    return _writer is not None
+
+
+def new_id():
+    return uuid.uuid4().hex[:16]
+
+
+def current_trace_id():
+    current = _current.get()
+    return current[0] if current else None
+
+
+# Окружение для дочернего matcher.py: текущий trace id в LUNCH_TRACE_ID (None — унаследовать как есть)
+def subprocess_env():
+    trace_id = current_trace_id()
+    if trace_id is None:
+        return None
+    return {**os.environ, TRACE_ENV: trace_id}
+
+
+# with span('matcher.shard', office=...) as fields: ... — fields можно дополнить внутри блока.
+# Без активного трейса начинается новый (например, для фоновых задач).
+@contextmanager
+def span(name, **fields):
+    if _writer is None:
+        yield fields
+        return
+    parent = _current.get()
+    trace_id = parent[0] if parent else new_id()
+    span_id = new_id()
+    token = _current.set((trace_id, span_id))
+    started_at = time.time()
+    started = time.perf_counter()
+    try:
+        yield fields
+    except BaseException as e:
+        fields.setdefault('error', type(e).__name__)
+        raise
+    finally:
+        _current.reset(token)
+        record = {
+            'trace': trace_id, 'span': span_id, 'parent': parent[1] if parent else None, 'name': name,
+            'ts': round(started_at, 6), 'ms': round((time.perf_counter() - started) * 1000, 3),
+        }
+        record.update(fields)
+        _writer.write(json.dumps(record, ensure_ascii=False, separators=(',', ':'), default=str))
+
+
+# Корневой span апдейта; подключается как outer middleware на dp.update
+class TracingMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event: Update, data):
+        from .metrics import update_prefix
+        with span('update', prefix=update_prefix(event), update_id=event.update_id):
+            return await handler(event, data)
@@ -0,0 +1,259 @@
+import asyncio
+import logging
+import os
+import time
+
+from filelock import FileLock
+
+from .metrics import STORAGE_SECONDS, Histogram
+from .results import write_json_atomic
+from .spans import span
+from . import utils
+
+# Однопоточный актор хранилища: профили (users_data.csv) и пул записи на обед
+# (users_to_match.json) живут в памяти одной задачи asyncio. Обработчики шлют ей сообщения
+# чтения и upsert'а; чтение отвечает из памяти сразу, запись ждёт групповой фиксации —
+# все изменения, накопившиеся, пока шла предыдущая запись на диск, уходят одной атомарной
+# заменой файла в потоке, не блокируя event loop. Когда upsert вернулся, файл уже на диске,
+# поэтому matcher.py и волны читают актуальный пул.
+# FileLock берётся только при записи на диск — это граница с другими процессами (скрипты,
+# бенчмарки с синхронными функциями bot/utils.py). Файл, заменённый другим процессом,
+# перечитывается перед следующим сообщением.
+
+PROFILES = 'profiles'
+POOL = 'pool'
+# Чтения отвечают из памяти сразу, остальные сообщения ждут записи на диск
+READS = {'get_user_data', 'match_pool_size'}
+
+COMMIT_BATCH = Histogram('bot_storage_commit_batch', 'Изменений хранилища в одной записи на диск',
+                         buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500))
+
+
+def _file_key(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+class StorageActor:
+    def __init__(self, users_csv, users_to_match_json):
+        self.paths = {PROFILES: users_csv, POOL: users_to_match_json}
+        # user_id (строка) → строка CSV; логин → запись пула. Записи не меняются на месте,
+        # а заменяются целиком — снимок словаря безопасно сериализовать в потоке
+        self.profiles = {}
+        self.pool = {}
+        # Ключи файлов после нашей последней записи или чтения
+        self.file_keys = {}
+        self._queue = asyncio.Queue()
+        self._dirty = set()
+        self._writing = set()
+        self._waiting = []
+        self._task = None
+        self._commit_task = None
+
+    def load(self):
+        self._load(PROFILES)
+        self._load(POOL)
+        logging.info(f"[StorageActor] Загружено профилей: {len(self.profiles)}, записей в пуле: {len(self.pool)}")
+
+    def _load(self, kind):
+        path = self.paths[kind]
+        self.file_keys[kind] = _file_key(path)
+        if kind == PROFILES:
+            self.profiles = {row[0]: row for row in utils.read_profile_rows(path)}
+        else:
+            pool = utils.read_match_pool(path)
+            # Запись без логина (файл правили руками) пропускаем, а не роняем актор
+            self.pool = {user['login']: user for user in pool if isinstance(user, dict) and user.get('login')}
+            if len(self.pool) < len(pool):
+                logging.warning(f"[StorageActor] {path}: пропущено записей без логина: {len(pool) - len(self.pool)}")
+
+    # Файл заменил другой процесс: перечитываем, если у нас нет незаписанных изменений
+    def _refresh(self):
+        for kind, path in self.paths.items():
+            if kind in self._dirty or kind in self._writing or _file_key(path) == self.file_keys.get(kind):
+                continue
+            logging.info(f"[StorageActor] {path} изменён извне, перечитываем")
+            self._load(kind)
+
+    def start(self):
+        self.load()
+        self._task = asyncio.create_task(self._run())
+        return self._task
+
+    async def stop(self):
+        await self.flush()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _call(self, op, *args):
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((op, args, future))
+        return await future
+
+    async def get_user_data(self, user_id):
+        return await self._call('get_user_data', user_id)
+
+    async def save_user_data(self, user_id, username, data):
+        return await self._call('save_user_data', user_id, username, data)
+
+    async def update_user_to_match(self, username, parameters):
+        return await self._call('update_user_to_match', username, parameters)
+
+    async def match_pool_size(self):
+        return await self._call('match_pool_size')
+
+    # Дождаться записи на диск всех принятых изменений
+    async def flush(self):
+        if self._task is not None:
+            await self._call('flush')
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            while not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            # Ошибка одного сообщения или перечитывания файла отдаётся ждущим этого пакета,
+            # а актор продолжает принимать следующие
+            try:
+                self._refresh()
+                for op, args, future in batch:
+                    try:
+                        result = getattr(self, '_' + op)(*args)
+                    except Exception as e:
+                        future.set_exception(e)
+                        continue
+                    if op in READS:
+                        future.set_result(result)
+                    else:
+                        self._waiting.append(future)
+                if self._waiting and (self._commit_task is None or self._commit_task.done()):
+                    self._commit_task = asyncio.create_task(self._commit())
+            except Exception as e:
+                logging.error(f"[StorageActor] Ошибка обработки пакета из {len(batch)} сообщений: {e}")
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _get_user_data(self, user_id):
+        row = self.profiles.get(str(user_id))
+        return utils.parse_profile_row(row) if row else None
+
+    def _save_user_data(self, user_id, username, data):
+        self.profiles[str(user_id)] = utils.profile_row(user_id, username, data)
+        self._dirty.add(PROFILES)
+
+    def _update_user_to_match(self, username, parameters):
+        if username in self.pool:
+            logging.info(f"[update_user_to_match] Обновлен пользователь: {username}")
+        else:
+            logging.info(f"[update_user_to_match] Добавлен новый пользователь: {username}")
+        self.pool[username] = {"login": username, "parameters": parameters}
+        self._dirty.add(POOL)
+
+    def _match_pool_size(self):
+        return len(self.pool)
+
+    def _flush(self):
+        pass
+
+    # Групповая фиксация: пока идёт запись, новые изменения копятся и уходят следующей записью
+    async def _commit(self):
+        while self._waiting:
+            waiting, self._waiting = self._waiting, []
+            dirty, self._dirty = self._dirty, set()
+            self._writing = dirty
+            snapshots = {PROFILES: list(self.profiles.values()) if PROFILES in dirty else None,
+                         POOL: list(self.pool.values()) if POOL in dirty else None}
+            started = time.perf_counter()
+            try:
+                with span('storage.commit', changes=len(waiting)):
+                    keys = await asyncio.to_thread(self._write, snapshots)
+            except Exception as e:
+                logging.error(f"[StorageActor] Ошибка записи на диск: {e}")
+                # Изменения остаются в памяти — попробуем записать их со следующей фиксацией
+                self._dirty |= dirty
+                for future in waiting:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            finally:
+                self._writing = set()
+                STORAGE_SECONDS.observe(time.perf_counter() - started, op='commit')
+            self.file_keys.update(keys)
+            COMMIT_BATCH.observe(len(waiting))
+            for future in waiting:
+                if not future.done():
+                    future.set_result(None)
+
+    def _write(self, snapshots):
+        keys = {}
+        if snapshots[PROFILES] is not None:
+            path = self.paths[PROFILES]
+            with FileLock(path + '.lock', timeout=10):
+                utils.write_profile_rows(snapshots[PROFILES], path)
+                keys[PROFILES] = _file_key(path)
+        if snapshots[POOL] is not None:
+            path = self.paths[POOL]
+            with FileLock(path + '.lock', timeout=10):
+                write_json_atomic(path, snapshots[POOL], indent=2)
+                keys[POOL] = _file_key(path)
+            logging.info(f"[update_user_to_match] Всего пользователей: {len(snapshots[POOL])}")
+        return keys
+
+
+_actor = None
+
+
+def start(users_csv, users_to_match_json):
+    global _actor
+    _actor = StorageActor(users_csv, users_to_match_json)
+    _actor.start()
+    return _actor
+
+
+async def stop():
+    global _actor
+    actor, _actor = _actor, None
+    if actor is not None:
+        await actor.stop()
+
+
+def enabled():
+    return _actor is not None
+
+
+# Точки входа для обработчиков: через актор, а без него (бенчмарки, скрипты) —
+# синхронные функции bot/utils.py с FileLock, как раньше
+async def _timed(op, call, fallback):
+    if _actor is None:
+        return fallback()
+    started = time.perf_counter()
+    try:
+        with span(f'storage.{op}'):
+            return await call(_actor)
+    finally:
+        STORAGE_SECONDS.observe(time.perf_counter() - started, op=op)
+
+
+async def get_user_data(user_id):
+    return await _timed('get_user_data', lambda actor: actor.get_user_data(user_id),
+                        lambda: utils.get_user_data(user_id))
+
+
+async def save_user_data(user_id, username, data):
+    return await _timed('save_user_data', lambda actor: actor.save_user_data(user_id, username, data),
+                        lambda: utils.save_user_data(user_id, username, data))
+
+
+async def update_user_to_match(username, parameters):
+    return await _timed('update_user_to_match', lambda actor: actor.update_user_to_match(username, parameters),
+                        lambda: utils.update_user_to_match(username, parameters))
+
+
+async def match_pool_size():
+    return await _timed('match_pool_size', lambda actor: actor.match_pool_size(),
+                        lambda: len(utils.read_match_pool()))
@@ -2,13 +2,28 @@ import csv
 import os
 import re
 import json
-from datetime import datetime, time
+from datetime import datetime
 import logging
 import subprocess
+import sys
+import hashlib
+import time
+import threading
+import contextvars
+from types import MappingProxyType
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from filelock import FileLock
 import asyncio
 
 from config import USERS_CSV, PLACES_CSV, USERS_TO_MATCH_JSON
+from logutils import QueuedLineWriter, truncate_text
+from timeutils import is_valid_interval, min_start_minutes, to_minutes
+from .metrics import (
+    MATCHER_IN_FLIGHT, MATCHER_RUNS, MATCHER_SECONDS, MATCHER_STALE_SHARDS, timed_storage
+)
+from .spans import span, subprocess_env
+from . import results as result_store
+from .results import atomic_write, write_json_atomic
 
 # Глобальные переменные для хранения данных
 PLACES = []
@@ -49,54 +64,90 @@ def load_places():
     
     return place_names
 
+USERS_CSV_HEADER = ['user_id', 'username', 'office', 'time_slots', 'lunch_duration',
+                    'favorite_places', 'disliked_places', 'company_size', 'last_updated']
+
 # Проверка и создание CSV-файла
-def ensure_csv_exists():
-    if not os.path.exists(USERS_CSV):
-        with open(USERS_CSV, 'w', newline='', encoding='utf-8') as file:
+def ensure_csv_exists(path=USERS_CSV):
+    if not os.path.exists(path):
+        with open(path, 'w', newline='', encoding='utf-8') as file:
             writer = csv.writer(file)
-            writer.writerow(['user_id', 'username', 'office', 'time_slots', 'lunch_duration', 
-                            'favorite_places', 'disliked_places', 'company_size', 'last_updated'])
+            writer.writerow(USERS_CSV_HEADER)
 
 # Проверка и создание JSON-файла
-def ensure_json_exists():
-    if not os.path.exists(USERS_TO_MATCH_JSON):
-        with open(USERS_TO_MATCH_JSON, 'w', encoding='utf-8') as file:
+def ensure_json_exists(path=USERS_TO_MATCH_JSON):
+    if not os.path.exists(path):
+        with open(path, 'w', encoding='utf-8') as file:
             json.dump([], file, ensure_ascii=False, indent=2)
 
+# Строка users_data.csv из профиля пользователя
+def profile_row(user_id, username, data):
+    return [str(user_id), username, data['office'],
+            ';'.join([f"{start}-{end}" for start, end in data['time_slots']]),
+            data['lunch_duration'],
+            ';'.join(data['favorite_places']),
+            ';'.join(data['disliked_places']),
+            ';'.join(data['company_size']),
+            datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ")]
+
+# Профиль пользователя из строки users_data.csv
+def parse_profile_row(row):
+    # Преобразуем строки обратно в списки
+    return {
+        'office': row[2],
+        'time_slots': [slot.split('-') for slot in row[3].split(';')] if row[3] else [],
+        'lunch_duration': row[4],
+        'favorite_places': row[5].split(';') if row[5] else [],
+        'disliked_places': row[6].split(';') if row[6] else [],
+        'company_size': row[7].split(';') if row[7] else [],
+        'last_updated': row[8]
+    }
+
+# Все строки users_data.csv без заголовка
+def read_profile_rows(path=USERS_CSV):
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', newline='', encoding='utf-8') as file:
+        reader = csv.reader(file)
+        next(reader, None)
+        return [row for row in reader if row]
+
+def write_profile_rows(rows, path=USERS_CSV):
+    with atomic_write(path, newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(USERS_CSV_HEADER)
+        writer.writerows(rows)
+
+# Все записи users_to_match.json; испорченный файл читается как пустой пул
+def read_match_pool(path=USERS_TO_MATCH_JSON):
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as file:
+        try:
+            return json.load(file)
+        except json.JSONDecodeError:
+            return []
+
+# Синхронные функции хранилища ниже берут FileLock и перечитывают файл целиком — они для
+# отдельных процессов (скрипты, бенчмарки). Бот пишет через однопоточный актор bot/store.py
+
 # Сохранение данных пользователя
+@timed_storage('save_user_data')
 def save_user_data(user_id, username, data):
     ensure_csv_exists()
-    time_slots_str = ';'.join([f"{start}-{end}" for start, end in data['time_slots']])
-    favorite_places_str = ';'.join(data['favorite_places'])
-    disliked_places_str = ';'.join(data['disliked_places'])
-    company_size_str = ';'.join(data['company_size'])
-    lock_path = USERS_CSV + '.lock'
-    with FileLock(lock_path, timeout=10):
-        rows = []
-        user_exists = False
-        if os.path.exists(USERS_CSV):
-            with open(USERS_CSV, 'r', newline='', encoding='utf-8') as file:
-                reader = csv.reader(file)
-                header = next(reader)
-                for row in reader:
-                    if row and row[0] == str(user_id):
-                        row = [str(user_id), username, data['office'], time_slots_str, data['lunch_duration'],
-                              favorite_places_str, disliked_places_str, company_size_str,
-                              datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ")]
-                        user_exists = True
-                    rows.append(row)
-        if not user_exists:
-            new_row = [str(user_id), username, data['office'], time_slots_str, data['lunch_duration'],
-                      favorite_places_str, disliked_places_str, company_size_str,
-                      datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ")]
+    new_row = profile_row(user_id, username, data)
+    with FileLock(USERS_CSV + '.lock', timeout=10):
+        rows = read_profile_rows()
+        for i, row in enumerate(rows):
+            if row[0] == str(user_id):
+                rows[i] = new_row
+                break
+        else:
             rows.append(new_row)
-        with open(USERS_CSV, 'w', newline='', encoding='utf-8') as file:
-            writer = csv.writer(file)
-            writer.writerow(['user_id', 'username', 'office', 'time_slots', 'lunch_duration', 
-                            'favorite_places', 'disliked_places', 'company_size', 'last_updated'])
-            writer.writerows(rows)
+        write_profile_rows(rows)
 
 # Получение данных пользователя
+@timed_storage('get_user_data')
 def get_user_data(user_id):
     if not os.path.exists(USERS_CSV):
         return None
@@ -106,57 +157,74 @@ def get_user_data(user_id):
         header = next(reader)  # Пропускаем заголовок
         for row in reader:
             if row and row[0] == str(user_id):
-                # Преобразуем строки обратно в списки
-                time_slots = [slot.split('-') for slot in row[3].split(';')] if row[3] else []
-                favorite_places = row[5].split(';') if row[5] else []
-                disliked_places = row[6].split(';') if row[6] else []
-                company_size = row[7].split(';') if row[7] else []
-                
-                return {
-                    'office': row[2],
-                    'time_slots': time_slots,
-                    'lunch_duration': row[4],
-                    'favorite_places': favorite_places,
-                    'disliked_places': disliked_places,
-                    'company_size': company_size,
-                    'last_updated': row[8]
-                }
+                return parse_profile_row(row)
     
     return None
 
 # Обновление данных пользователя для матчинга
 
+@timed_storage('update_user_to_match')
 def update_user_to_match(username, parameters):
     ensure_json_exists()
-    lock_path = USERS_TO_MATCH_JSON + '.lock'
-    import logging
-    with FileLock(lock_path, timeout=10):
-        users = []
-        user_exists = False
-        if os.path.exists(USERS_TO_MATCH_JSON):
-            with open(USERS_TO_MATCH_JSON, 'r', encoding='utf-8') as file:
-                try:
-                    users = json.load(file)
-                except json.JSONDecodeError:
-                    users = []
+    with FileLock(USERS_TO_MATCH_JSON + '.lock', timeout=10):
+        users = read_match_pool()
         # Проверяем, есть ли уже такой пользователь
         for user in users:
             if user.get('login') == username:
                 user['parameters'] = parameters
-                user_exists = True
                 logging.info(f"[update_user_to_match] Обновлен пользователь: {username}")
                 break
-        if not user_exists:
+        else:
             users.append({
                 "login": username,
                 "parameters": parameters
             })
             logging.info(f"[update_user_to_match] Добавлен новый пользователь: {username}")
         # Сохраняем всех пользователей обратно
-        with open(USERS_TO_MATCH_JSON, 'w', encoding='utf-8') as file:
-            json.dump(users, file, ensure_ascii=False, indent=2)
+        write_json_atomic(USERS_TO_MATCH_JSON, users, indent=2)
         logging.info(f"[update_user_to_match] Всего пользователей: {len(users)}")
 
+# Разобранное содержимое файла данных по (путь, загрузчик); перечитывается, только если файл сменился.
+# Файлы пишутся через os.replace, поэтому каждая запись меняет inode и mtime
+_FILE_CACHE = {}
+
+def _read_cached(path, loader):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    key = (st.st_ino, st.st_mtime_ns, st.st_size)
+    cached = _FILE_CACHE.get((path, loader))
+    if cached and cached[0] == key:
+        return cached[1]
+    value = loader(path)
+    _FILE_CACHE[(path, loader)] = (key, value)
+    return value
+
+def _load_user_ids(path):
+    with open(path, 'r', newline='', encoding='utf-8') as file:
+        return MappingProxyType({row['username']: int(row['user_id']) for row in csv.DictReader(file)})
+
+def _load_match_logins(path):
+    with open(path, 'r', encoding='utf-8') as file:
+        return frozenset(user['login'] for user in json.load(file))
+
+def _load_match_pool(path):
+    with open(path, 'r', encoding='utf-8') as file:
+        return tuple(json.load(file))
+
+# username → user_id из users_data.csv (только для чтения)
+def get_user_ids():
+    return _read_cached(USERS_CSV, _load_user_ids) or MappingProxyType({})
+
+# Логины из пула записи на обед (users_to_match.json)
+def get_match_logins():
+    return _read_cached(USERS_TO_MATCH_JSON, _load_match_logins) or frozenset()
+
+# Записи пула целиком (общий разобранный список — только для чтения)
+def get_match_pool(path=USERS_TO_MATCH_JSON):
+    return _read_cached(path, _load_match_pool) or ()
+
 # Получение списка мест для офиса
 def get_places_for_office(office):
     if office not in PLACES_BY_OFFICE:
@@ -165,16 +233,7 @@ def get_places_for_office(office):
 
 # Проверка валидности временного интервала
 def is_valid_time_interval(start_time, end_time):
-    try:
-        start_h, start_m = map(int, start_time.split(':'))
-        end_h, end_m = map(int, end_time.split(':'))
-        
-        start = time(hour=start_h, minute=start_m)
-        end = time(hour=end_h, minute=end_m)
-        
-        return start < end
-    except:
-        return False
+    return is_valid_interval(start_time, end_time)
 
 # Конвертация данных в формат для матчинга
 def convert_to_match_format(data, username):
@@ -187,67 +246,398 @@ def convert_to_match_format(data, username):
         "team_size_lst": data.get('company_size', [])
     }
 
-# Запуск matcher.py и получение результата для пользователя
+# --- Шарды матчинга по офисам ---
+# Группы разных офисов никогда не пересекаются, поэтому matcher.py можно запускать
+# отдельно для каждого офиса и только для тех офисов, чей пул записей изменился.
+SHARDS_DIR = os.path.join('data', 'shards')
 
-def run_matcher_and_get_result(user_login, users_file, places_file, output_file):
-    print("=== DEBUG: run_matcher_and_get_result вызван ===")
-    import logging
-    logging.info("=== DEBUG: run_matcher_and_get_result вызван ===")
-    log_path = 'logs/bot.log'
-    matcher_path = os.path.abspath('matcher.py')
-    logging.info(f"[DEBUG] run_matcher_and_get_result вызван для {user_login}, matcher_path={matcher_path}")
-    with open(log_path, 'a', encoding='utf-8') as log_file:
-        log_file.write(f"\n[run_matcher_and_get_result] Запуск matcher.py для {user_login} (matcher_path={matcher_path})\n")
+def _office_key(office):
+    return (office or '').strip().lower()
+
+def _office_shard_id(office_key):
+    return hashlib.sha1(office_key.encode('utf-8')).hexdigest()[:12]
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Временная корзина шарда, как time_bucket в matcher.py: дата и число различных начал
+# слотов, которые к now уже недоступны. Группы меняются, только когда корзина сдвигается
+def _shard_time_bucket(office_users, now):
+    min_start = min_start_minutes(now)
+    starts = set()
+    for user in office_users:
+        for slot in user.get('parameters', {}).get('time_slots') or []:
+            try:
+                starts.add(to_minutes(slot[0]))
+            except (ValueError, TypeError, IndexError):
+                continue
+    return f"{now.date().isoformat()}:{sum(1 for start in starts if start < min_start)}"
+
+# Хеш содержимого шарда: записи офиса (без учёта порядка) + каталог мест + временная корзина
+def _shard_hash(office_users, places_digest, now):
+    canonical = json.dumps(
+        sorted(office_users, key=lambda u: u.get('login', '')),
+        ensure_ascii=False, sort_keys=True, separators=(',', ':')
+    )
+    bucket = _shard_time_bucket(office_users, now)
+    return hashlib.sha256(f"{places_digest}:{bucket}:{canonical}".encode('utf-8')).hexdigest()
+
+def _shard_path(shard_id, suffix='json'):
+    return os.path.join(SHARDS_DIR, f"{shard_id}.{suffix}")
+
+def _read_shard(shard_id):
+    try:
+        with open(_shard_path(shard_id), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+# Последний спланированный шард по shard_id: записи офиса, которые надо посчитать сейчас.
+# Прогоны одного шарда не идут параллельно: прогон досчитывает до последнего плана,
+# а остальные записавшиеся в этот офис ждут его (single-flight) — более старый прогон
+# не перезапишет <shard>.json и не делит с другим <shard>.cache.json и metrics.json
+_planned_shards = {}
+_shard_runs = {}
+_shard_thread_locks = {}
+_shard_thread_locks_guard = threading.Lock()
+
+def _shard_is_current(shard_id):
+    return (_read_shard(shard_id) or {}).get('hash') == _planned_shards[shard_id]['hash']
+
+def split_users_by_office(users):
+    shards = {}
+    for user in users:
+        office = _office_key(user.get('parameters', {}).get('office'))
+        shards.setdefault(office, []).append(user)
+    return shards
+
+# Разбивает пул на шарды и определяет, какие из них нужно пересчитать:
+# изменились записи офиса, каталог мест или временная корзина на момент now
+def plan_office_shards(users_file, places_file, now=None):
+    now = now or datetime.now()
+    try:
+        with open(users_file, 'r', encoding='utf-8') as f:
+            users = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        users = []
+    places_digest = _file_digest(places_file)
+    shards = {}
+    for office, office_users in split_users_by_office(users).items():
+        shard_id = _office_shard_id(office)
+        shards[shard_id] = {
+            'office': office,
+            'hash': _shard_hash(office_users, places_digest, now),
+            'users': office_users,
+        }
+    _planned_shards.update(shards)
+    stale = [
+        shard_id for shard_id, shard in shards.items()
+        if (_read_shard(shard_id) or {}).get('hash') != shard['hash']
+    ]
+    return shards, stale
+
+# Вход шарда для matcher.py через stdin: компактный JSON без промежуточного файла
+def _shard_payload(shard):
+    os.makedirs(SHARDS_DIR, exist_ok=True)
+    return json.dumps(shard['users'], ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+# matcher.py из бота логирует только в stderr: прогоны офисов идут параллельно, а ротируемый
+# logs/matcher.log должен писать один процесс — бот (_log_matcher_output)
+def _matcher_command(users_file, places_file, output_file, cache_file=None, metrics_file=None):
+    command = [
+        sys.executable, os.path.abspath('matcher.py'),
+        "-i", users_file,
+        "-p", places_file,
+        "-o", output_file,
+        "--log-file", "-"
+    ]
+    if cache_file:
+        command += ["--cache", cache_file]
+    if metrics_file:
+        command += ["--metrics", metrics_file]
+    return command
+
+# Шард считается в потоковом режиме: пользователи в stdin, группы — JSONL из stdout.
+# now — момент прогона для matcher.py (--now), по умолчанию текущий
+def _shard_command(shard_id, places_file, now=None):
+    command = _matcher_command('-', places_file, '-',
+                               _shard_path(shard_id, 'cache.json'), _shard_path(shard_id, 'metrics.json'))
+    if now is not None:
+        command += ["--now", now.isoformat(timespec='minutes')]
+    return command
+
+def _parse_group_line(line):
+    line = line.strip()
+    return json.loads(line) if line else None
+
+# Одна строка с итогами прогона matcher.py по его --metrics (время фаз и счётчики)
+def _metrics_summary(metrics):
+    phases = metrics.get('phases_ms', {})
+    counters = metrics.get('counters', {})
+    rejects = ' '.join(f"{reason}={counters.get('reject_' + reason, 0)}" for reason in ('time', 'office', 'size', 'place'))
+    slowest = ', '.join(f"{name}={ms:.1f}" for name, ms in sorted(phases.items(), key=lambda kv: -kv[1])[:3])
+    return (f"total={metrics.get('total_ms', 0):.1f}ms users={counters.get('users', 0)} "
+            f"groups={counters.get('groups', 0)} cache_hit={counters.get('cache_hit', 0)} "
+            f"rejects[{rejects}] slowest[{slowest}]")
+
+def _log_shard_metrics(shard_id, shard):
+    try:
+        with open(_shard_path(shard_id, 'metrics.json'), 'r', encoding='utf-8') as f:
+            metrics = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    logging.info(f"[matcher metrics office={shard['office']}] {_metrics_summary(metrics)}")
+    return metrics
+
+def _store_shard(shard_id, shard, groups):
+    write_json_atomic(_shard_path(shard_id), {'office': shard['office'], 'hash': shard['hash'], 'groups': groups},
+                      separators=(',', ':'))
+
+# Собирает результат из актуальных шардов (шарды ушедших офисов отбрасываются),
+# публикует его как новый снимок (bot/results.py) и атомарно пишет output.json
+@timed_storage('merge_shard_results')
+def merge_shard_results(shards, output_file):
+    results = []
+    for shard_id in sorted(shards, key=lambda sid: shards[sid]['office']):
+        stored = _read_shard(shard_id)
+        if stored:
+            results.extend(stored.get('groups', []))
+    return result_store.publish(results, output_file)
+
+# Вывод matcher.py в логе (stdout занят группами, сообщения и лог — в stderr):
+# в логе бота успешный прогон — только начало и конец, ошибка — подробнее;
+# в logs/matcher.log — целиком, одним писателем на все параллельные прогоны
+MATCHER_OUTPUT_LOG_CHARS = 2000
+MATCHER_ERROR_LOG_CHARS = 8000
+MATCHER_LOG = os.path.join('logs', 'matcher.log')
+_matcher_log = None
+
+def _matcher_log_writer():
+    global _matcher_log
+    if _matcher_log is None:
+        _matcher_log = QueuedLineWriter(MATCHER_LOG)
+    return _matcher_log
+
+def _log_matcher_output(office, stderr, failed=False):
+    limit = MATCHER_ERROR_LOG_CHARS if failed else MATCHER_OUTPUT_LOG_CHARS
+    level = logging.ERROR if failed else logging.INFO
+    text = stderr.decode('utf-8', 'replace') if isinstance(stderr, bytes) else stderr or ''
+    if text.strip():
+        _matcher_log_writer().write(text.rstrip('\n'))
+    logging.log(level, f"[matcher.py stderr office={office}]\n{truncate_text(text, limit)}")
+
+# Время фаз из --metrics прогона — в поля span шарда
+def _span_matcher_metrics(fields, metrics):
+    if metrics:
+        fields['matcher_total_ms'] = metrics.get('total_ms')
+        fields['matcher_phases_ms'] = metrics.get('phases_ms')
+
+def _run_shard(shard_id, shard, places_file):
+    with span('matcher.shard', office=shard['office'], users=len(shard['users']), mode='sync') as fields:
+        payload = _shard_payload(shard)
+        MATCHER_IN_FLIGHT.inc()
+        started = time.perf_counter()
         try:
-            result = subprocess.run([
-                "python3", matcher_path,
-                "-i", users_file,
-                "-p", places_file,
-                "-o", output_file
-            ], check=True, capture_output=True, text=True)
-            log_file.write(f"[matcher.py stdout]\n{result.stdout}\n")
-            log_file.write(f"[matcher.py stderr]\n{result.stderr}\n")
-            logging.info(f"[DEBUG] matcher.py успешно завершён для {user_login}")
+            result = subprocess.run(
+                _shard_command(shard_id, places_file), input=payload,
+                check=True, capture_output=True, env=subprocess_env()
+            )
         except subprocess.CalledProcessError as e:
-            log_file.write(f"[matcher.py ERROR] {e}\n[stdout]\n{e.stdout}\n[stderr]\n{e.stderr}\n")
-            logging.error(f"[DEBUG] matcher.py завершился с ошибкой для {user_login}: {e}")
+            MATCHER_RUNS.inc(result='error')
+            logging.error(f"[matcher.py ERROR office={shard['office']}] {e}")
+            _log_matcher_output(shard['office'], e.stderr, failed=True)
             raise
+        finally:
+            MATCHER_IN_FLIGHT.dec()
+            MATCHER_SECONDS.observe(time.perf_counter() - started, office=shard['office'], mode='sync')
+        MATCHER_RUNS.inc(result='ok')
+        groups = [group for group in map(_parse_group_line, result.stdout.decode('utf-8').splitlines()) if group]
+        fields['groups'] = len(groups)
+        _log_matcher_output(shard['office'], result.stderr)
+        _store_shard(shard_id, shard, groups)
+        _span_matcher_metrics(fields, _log_shard_metrics(shard_id, shard))
+
+# Досчитать шард до последнего плана; прогоны одного шарда идут по одному
+def _ensure_shard(shard_id, places_file):
+    with _shard_thread_locks_guard:
+        lock = _shard_thread_locks.setdefault(shard_id, threading.Lock())
+    with lock:
+        while not _shard_is_current(shard_id):
+            _run_shard(shard_id, _planned_shards[shard_id], places_file)
+
+# Синхронный запуск (скрипты, бенчмарки): изменившиеся офисы считаются параллельно в пуле потоков
+def run_sharded_matcher(users_file, places_file, output_file):
+    shards, stale = plan_office_shards(users_file, places_file)
+    logging.info(f"[run_sharded_matcher] Офисов: {len(shards)}, к пересчёту: {len(stale)}")
+    MATCHER_STALE_SHARDS.observe(len(stale))
+    if stale:
+        with ThreadPoolExecutor(max_workers=len(stale)) as pool:
+            # Каждому потоку — копия контекста, чтобы trace id апдейта дошёл до matcher.py
+            futures = {pool.submit(contextvars.copy_context().run, _ensure_shard, sid, places_file): sid
+                       for sid in stale}
+            errors = []
+            for future in as_completed(futures):
+                shard_id = futures[future]
+                try:
+                    future.result()
+                    merge_shard_results(shards, output_file)
+                except Exception as e:
+                    logging.error(f"[run_sharded_matcher] Ошибка шарда {shards[shard_id]['office']}: {e}")
+                    errors.append(e)
+            if errors:
+                raise errors[0]
+    return merge_shard_results(shards, output_file)
+
+async def _run_shard_async(shard_id, shard, places_file, now=None, mode='async'):
+    with span('matcher.shard', office=shard['office'], users=len(shard['users']), mode=mode) as fields:
+        payload = _shard_payload(shard)
+        MATCHER_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        groups = []
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *_shard_command(shard_id, places_file, now),
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                env=subprocess_env()
+            )
+
+            async def feed():
+                proc.stdin.write(payload)
+                await proc.stdin.drain()
+                proc.stdin.close()
+
+            # Группы разбираются по мере того, как matcher.py их выбирает
+            async def consume():
+                async for line in proc.stdout:
+                    group = _parse_group_line(line)
+                    if group:
+                        if not groups:
+                            fields['first_group_ms'] = round((time.perf_counter() - started) * 1000, 3)
+                        groups.append(group)
+
+            _, _, stderr = await asyncio.gather(feed(), consume(), proc.stderr.read())
+            await proc.wait()
+        finally:
+            MATCHER_IN_FLIGHT.dec()
+            MATCHER_SECONDS.observe(time.perf_counter() - started, office=shard['office'], mode=mode)
+        MATCHER_RUNS.inc(result='ok' if proc.returncode == 0 else 'error')
+        fields['groups'] = len(groups)
+        _log_matcher_output(shard['office'], stderr, failed=proc.returncode != 0)
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, 'matcher.py', None, stderr)
+        # Шарды хранят результат по всему пулу офиса; группы волны публикует bot/waves.py
+        if mode != 'wave':
+            _store_shard(shard_id, shard, groups)
+        _span_matcher_metrics(fields, _log_shard_metrics(shard_id, shard))
+    return groups
+
+async def _drain_shard_async(shard_id, places_file):
+    while not _shard_is_current(shard_id):
+        await _run_shard_async(shard_id, _planned_shards[shard_id], places_file)
+
+# Асинхронный вариант _ensure_shard: к идущему прогону шарда присоединяемся, а не запускаем второй.
+# План, появившийся во время прогона, тот же прогон досчитает следующим
+async def _ensure_shard_async(shard_id, places_file):
+    task = _shard_runs.get(shard_id)
+    if task is None or task.done():
+        task = _shard_runs[shard_id] = asyncio.create_task(_drain_shard_async(shard_id, places_file))
+    # Отмена одного ожидающего не должна отменять прогон, который ждут другие
+    await asyncio.shield(task)
+
+# Асинхронный запуск (бот): офисы считаются конкурентно, output.json обновляется по мере готовности шардов
+async def run_sharded_matcher_async(users_file, places_file, output_file):
+    shards, stale = plan_office_shards(users_file, places_file)
+    logging.info(f"[run_sharded_matcher_async] Офисов: {len(shards)}, к пересчёту: {len(stale)}")
+    MATCHER_STALE_SHARDS.observe(len(stale))
+    tasks = [asyncio.create_task(_ensure_shard_async(sid, places_file)) for sid in stale]
+    errors = []
+    for finished in asyncio.as_completed(tasks):
+        try:
+            await finished
+            merge_shard_results(shards, output_file)
         except Exception as e:
-            log_file.write(f"[matcher.py UNEXPECTED ERROR] {e}\n")
-            logging.error(f"[DEBUG] matcher.py неожиданная ошибка для {user_login}: {e}")
-            raise
-    with open(output_file, "r", encoding="utf-8") as f:
-        results = json.load(f)
-    for group in results:
-        if user_login in group["participants"]:
-            return group
-    return None
+            logging.error(f"[run_sharded_matcher_async] Ошибка шарда: {e}")
+            errors.append(e)
+    if errors:
+        raise errors[0]
+    return merge_shard_results(shards, output_file)
+
+# Прогон волны (bot/waves.py): matcher.py по записям волны, офисы конкурентно, с моментом now.
+# Шарды и output.json не трогаются; офис с ошибкой не даёт групп, его записи ждут следующей волны
+async def run_wave_matcher_async(users, places_file, now):
+    shards = {f"{_office_shard_id(office)}-wave": {'office': office, 'users': office_users}
+              for office, office_users in split_users_by_office(users).items()}
+    tasks = {shard_id: asyncio.create_task(_run_shard_async(shard_id, shard, places_file, now, mode='wave'))
+             for shard_id, shard in shards.items()}
+    groups = []
+    for shard_id, task in tasks.items():
+        try:
+            groups.extend(await task)
+        except Exception as e:
+            logging.error(f"[run_wave_matcher_async] Ошибка офиса {shards[shard_id]['office']}: {e}")
+    return groups
+
+# Профилированный прогон matcher.py по всему текущему пулу: cProfile и tracemalloc, артефакты в logs/profile/<время>/
+PROFILE_DIR = os.path.join('logs', 'profile')
+
+async def run_profiled_matcher_async(users_file, places_file):
+    out_dir = os.path.join(PROFILE_DIR, datetime.now().strftime('%Y%m%d-%H%M%S'))
+    os.makedirs(out_dir, exist_ok=True)
+    artifacts = {}
+    for mode, name in (('cpu', 'run.pstats'), ('mem', 'mem.txt')):
+        profile_out = os.path.join(out_dir, name)
+        metrics_out = os.path.join(out_dir, f'metrics_{mode}.json')
+        proc = await asyncio.create_subprocess_exec(
+            *_matcher_command(users_file, places_file, os.path.join(out_dir, 'output.json'),
+                              metrics_file=metrics_out),
+            "--profile", mode, "--profile-out", profile_out,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        stdout, stderr = await proc.communicate()
+        with open(os.path.join(out_dir, f'matcher_{mode}.log'), 'wb') as f:
+            f.write(stdout + stderr)
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, 'matcher.py', stdout, stderr)
+        artifacts[mode] = profile_out
+        artifacts[f'metrics_{mode}'] = metrics_out
+    logging.info(f"[run_profiled_matcher_async] Артефакты профилирования: {artifacts}")
+    return out_dir, artifacts
+
+# Запуск matcher.py и получение результата для пользователя
+
+def run_matcher_and_get_result(user_login, users_file, places_file, output_file):
+    import logging
+    logging.info("=== DEBUG: run_matcher_and_get_result вызван ===")
+    logging.info(f"[run_matcher_and_get_result] Запуск matcher.py для {user_login} по офисам")
+    try:
+        with span('matcher.run', mode='sync'):
+            results = run_sharded_matcher(users_file, places_file, output_file)
+        logging.info(f"[DEBUG] matcher.py успешно завершён для {user_login}")
+    except subprocess.CalledProcessError as e:
+        logging.error(f"[DEBUG] matcher.py завершился с ошибкой для {user_login}: {e}")
+        raise
+    except Exception as e:
+        logging.error(f"[DEBUG] matcher.py неожиданная ошибка для {user_login}: {e}")
+        raise
+    return results.group_of(user_login)
 
 async def run_matcher_and_get_result_async(user_login, users_file, places_file, output_file):
-    import sys
     import logging
     logging.info("=== DEBUG: run_matcher_and_get_result_async вызван ===")
-    matcher_path = os.path.abspath('matcher.py')
-    proc = await asyncio.create_subprocess_exec(
-        sys.executable, matcher_path,
-        "-i", users_file,
-        "-p", places_file,
-        "-o", output_file,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE
-    )
-    stdout, stderr = await proc.communicate()
-    logging.info(f"[matcher.py stdout]\n{stdout.decode()}")
-    logging.info(f"[matcher.py stderr]\n{stderr.decode()}")
-    with open(output_file, "r", encoding="utf-8") as f:
-        results = json.load(f)
-    for group in results:
-        if user_login in group["participants"]:
-            return group
-    return None
+    with span('matcher.run', mode='async'):
+        results = await run_sharded_matcher_async(users_file, places_file, output_file)
+    return results.group_of(user_login)
 
 NOTIFIED_GROUPS_JSON = os.path.join('data', 'notified_groups.json')
 
+@timed_storage('read_notified_groups')
 def read_notified_groups():
     if not os.path.exists(NOTIFIED_GROUPS_JSON):
         return {}
@@ -257,9 +647,9 @@ def read_notified_groups():
     except Exception:
         return {}
 
+@timed_storage('write_notified_groups')
 def write_notified_groups(data):
-    with open(NOTIFIED_GROUPS_JSON, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    write_json_atomic(NOTIFIED_GROUPS_JSON, data, indent=2)
 
 def is_user_notified(username, group_key):
     notified = read_notified_groups()
@@ -0,0 +1,273 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime
+
+from timeutils import clock_minutes, format_minutes, is_valid_interval, parse_interval, to_minutes
+from . import results as result_store
+from .metrics import Counter, Histogram
+from .spans import span
+from .utils import _office_key, get_match_pool, run_wave_matcher_async, split_users_by_office
+
+# Волны матчинга: клик "Записаться на обед" только пополняет пул (users_to_match.json),
+# а группы формирует планировщик. Волна закрывает запись на обеды, начинающиеся в её окне
+# (например, 12:00–13:00 закрывается в 11:40): один прогон matcher.py по офису на записях,
+# собранных к этому моменту, со слотами, обрезанными по окну. Найденные группы замораживаются
+# до конца дня и уходят в рассылку; неподобранные ждут следующей волны, в окно которой
+# попадают их слоты. Время matcher.py ограничено числом волн, а не числом кликов.
+
+# Волна по умолчанию закрывается за столько минут до начала своего окна
+DEFAULT_LEAD_MINUTES = 20
+# Планировщик просыпается не реже — чтобы заметить офис, записавшийся после закрытия волны
+POLL_SECONDS = 60
+
+WAVE_SECONDS = Histogram('bot_wave_seconds', 'Волна матчинга: прогон matcher.py, публикация и рассылка',
+                         buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120))
+WAVE_USERS = Counter('bot_wave_users_total', 'Записи в волнах матчинга по итогу', ['result'])
+
+
+@dataclass(frozen=True, order=True)
+class Wave:
+    cutoff: int  # закрытие записи, минуты от полуночи
+    start: int   # окно начала обеда [start, end)
+    end: int
+
+    def label(self):
+        return f"{format_minutes(self.start)}–{format_minutes(self.end)}"
+
+    # Слоты пользователя внутри волны: начало не раньше окна, обед начинается до конца окна
+    def clip(self, time_slots, duration):
+        clipped = []
+        for slot in time_slots:
+            if len(slot) != 2 or not is_valid_interval(slot[0], slot[1]):
+                continue
+            start, end = parse_interval(slot[0], slot[1])
+            # Слот с началом в конце окна и позже — обед следующей волны
+            if start >= self.end:
+                continue
+            start, end = max(start, self.start), min(end, self.end + duration)
+            if start < end:
+                clipped.append([format_minutes(start), format_minutes(end)])
+        return clipped
+
+    # Попадает ли запись в волну; без слотов matcher.py даёт окно по умолчанию — подходит любая
+    def covers(self, parameters):
+        slots = parameters.get('time_slots') or []
+        return not slots or bool(self.clip(slots, int(parameters.get('max_lunch_duration', 30))))
+
+
+# Волна на каждый час из вариантов времени: окно HH:00–HH+1:00, закрытие за lead минут
+def default_waves(time_options, lead=DEFAULT_LEAD_MINUTES):
+    hours = sorted({to_minutes(option) // 60 for option in time_options})
+    return tuple(Wave(hour * 60 - lead, hour * 60, hour * 60 + 60) for hour in hours)
+
+
+# Расписание из строки "закрытие=начало-конец" через запятую: "11:40=12:00-13:00,12:40=13:00-14:00".
+# Элемент "Офис|11:30=12:00-13:00" задаёт расписание отдельного офиса, остальные — общее.
+# "on" — расписание по умолчанию, пустая строка или "off" — без волн (матчинг по каждому клику).
+# Возвращает {ключ офиса или None: волны по времени закрытия}
+def parse_schedule(spec, time_options=()):
+    spec = (spec or '').strip()
+    if not spec or spec.lower() == 'off':
+        return {}
+    if spec.lower() == 'on':
+        return {None: default_waves(time_options)}
+    schedule = {}
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        office, _, wave_spec = item.rpartition('|')
+        cutoff, _, window = wave_spec.partition('=')
+        start, _, end = window.partition('-')
+        try:
+            wave = Wave(to_minutes(cutoff.strip()), *parse_interval(start.strip(), end.strip()))
+        except ValueError:
+            raise ValueError(f"Некорректная волна матчинга: {item!r}")
+        if wave.start >= wave.end or wave.cutoff > wave.start:
+            raise ValueError(f"Волна должна закрываться до начала непустого окна: {item!r}")
+        schedule.setdefault(_office_key(office) if office else None, []).append(wave)
+    return {office: tuple(sorted(waves)) for office, waves in schedule.items()}
+
+
+class WaveScheduler:
+    def __init__(self, bot, schedule, users_file, places_file, output_file, clock=datetime.now):
+        self.bot = bot
+        self.schedule = schedule
+        self.users_file = users_file
+        self.places_file = places_file
+        self.output_file = output_file
+        self.clock = clock
+        self.day = None
+        # Замороженные за день группы и их участники; закрытые волны — (офис, волна)
+        self.groups = []
+        self.frozen = set()
+        self.closed = set()
+
+    def waves_for(self, office):
+        return self.schedule.get(office, self.schedule.get(None, ()))
+
+    def _start_day(self, now):
+        if self.day == now.date():
+            return
+        self.day = now.date()
+        self.groups, self.frozen, self.closed = [], set(), set()
+        # После перезапуска в тот же день группы из output.json остаются замороженными
+        snapshot = result_store.snapshot_for(self.output_file)
+        if snapshot.groups and datetime.fromtimestamp(snapshot.file_key[1] / 1e9).date() == self.day:
+            self.groups = list(snapshot.groups)
+            self.frozen = {login for group in self.groups for login in group['participants']}
+            logging.info(f"[WaveScheduler] Продолжаем день: {len(self.groups)} групп уже заморожено")
+
+    # Ближайшая незакрытая волна офиса, в окно которой попадает запись (None — таких сегодня нет)
+    def next_wave(self, office, parameters, now):
+        minute = clock_minutes(now)
+        for wave in self.waves_for(office):
+            if (office, wave) not in self.closed and minute < wave.end and wave.covers(parameters):
+                return wave
+        return None
+
+    # Записи, которые ещё ждут своей волны: им рано сообщать, что подходящих слотов нет
+    def pending_logins(self, now=None):
+        now = now or self.clock()
+        self._start_day(now)
+        pending = set()
+        for office, users in split_users_by_office(get_match_pool(self.users_file)).items():
+            for user in users:
+                if user['login'] not in self.frozen and self.next_wave(office, user['parameters'], now):
+                    pending.add(user['login'])
+        return pending
+
+    # Ответ на запись: когда сформируется группа
+    def booking_message(self, username, parameters):
+        now = self.clock()
+        self._start_day(now)
+        if username in self.frozen:
+            return "Ваша группа на сегодня уже сформирована — мы прислали её отдельным сообщением."
+        wave = self.next_wave(_office_key(parameters.get('office')), parameters, now)
+        if wave is None:
+            return "Запись на сегодня для ваших слотов уже закрыта. Попробуйте завтра!"
+        closes_at = max(wave.cutoff, int(clock_minutes(now)) + 1)
+        return (f"Вы записаны! Группы на обед {wave.label()} сформируем в {format_minutes(closes_at)} "
+                f"и сразу пришлём результат.")
+
+    # Волны, время закрытия которых наступило: по офису — самая ранняя незакрытая
+    def due_waves(self, offices, now):
+        minute = clock_minutes(now)
+        due = {}
+        for office in offices:
+            for wave in self.waves_for(office):
+                if (office, wave) in self.closed:
+                    continue
+                if wave.cutoff <= minute:
+                    due[office] = wave
+                break
+        return due
+
+    async def run_due(self, now=None):
+        now = now or self.clock()
+        self._start_day(now)
+        while True:
+            by_office = split_users_by_office(get_match_pool(self.users_file))
+            due = self.due_waves(self.schedule_offices(by_office), now)
+            if not due:
+                return
+            minute = clock_minutes(now)
+            for office, wave in due.items():
+                self.closed.add((office, wave))
+                if minute >= wave.end:
+                    logging.info(f"[run_due] Окно {wave.label()} офиса {office!r} уже прошло, волна пропущена")
+            due = {office: wave for office, wave in due.items() if minute < wave.end}
+            if due:
+                await self.run_wave(due, by_office, now)
+
+    # Офисы с записями; у офиса без записей волна закрывается без прогона
+    def schedule_offices(self, by_office):
+        return set(by_office) | {office for office in self.schedule if office is not None}
+
+    # Одна волна: записи закрытых окон, один matcher.py на офис, заморозка групп, публикация и рассылка
+    async def run_wave(self, due, by_office, now):
+        from .handlers import notify_all_new_groups
+
+        started = time.perf_counter()
+        batch = []
+        for office, wave in due.items():
+            for user in by_office.get(office, ()):
+                params = user['parameters']
+                if user['login'] in self.frozen or not wave.covers(params):
+                    continue
+                clipped = dict(params, time_slots=wave.clip(params.get('time_slots') or [],
+                                                            int(params.get('max_lunch_duration', 30))))
+                batch.append({'login': user['login'], 'parameters': clipped})
+        labels = {office: wave.label() for office, wave in due.items()}
+        logging.info(f"[run_wave] Волна {now:%H:%M}: {labels}, записей {len(batch)}")
+        with span('matcher.wave', offices=len(due), users=len(batch)) as fields:
+            groups = await run_wave_matcher_async(batch, self.places_file, now) if batch else []
+            for group in groups:
+                self.frozen.update(group['participants'])
+            self.groups.extend(groups)
+            matched = sum(len(group['participants']) for group in groups)
+            WAVE_USERS.inc(matched, result='matched')
+            WAVE_USERS.inc(len(batch) - matched, result='waiting')
+            fields['groups'] = len(groups)
+            result_store.publish(self.groups, self.output_file)
+            try:
+                await notify_all_new_groups(self.bot, self.output_file, self.pending_logins(now))
+            except Exception as e:
+                logging.error(f"[run_wave] Ошибка рассылки: {e}")
+        WAVE_SECONDS.observe(time.perf_counter() - started)
+        logging.info(f"[run_wave] Заморожено {len(groups)} групп ({matched} из {len(batch)} записей) "
+                     f"за {time.perf_counter() - started:.2f} с")
+
+    # До ближайшего закрытия волны, но не дольше POLL_SECONDS
+    def seconds_until_next(self, now):
+        minute = clock_minutes(now)
+        upcoming = [wave.cutoff for waves in self.schedule.values() for wave in waves if wave.cutoff > minute]
+        if not upcoming:
+            return POLL_SECONDS
+        return min(POLL_SECONDS, max(1.0, (min(upcoming) - minute) * 60))
+
+    async def run(self):
+        logging.info(f"[WaveScheduler] Расписание волн: "
+                     f"{ {office: [w.label() for w in waves] for office, waves in self.schedule.items()} }")
+        while True:
+            now = self.clock()
+            try:
+                await self.run_due(now)
+            except Exception as e:
+                logging.error(f"[WaveScheduler] Ошибка волны: {e}")
+            await asyncio.sleep(self.seconds_until_next(self.clock()))
+
+
+_scheduler = None
+_task = None
+
+
+# Планировщик, к которому обращаются обработчики записи; без него — матчинг по каждой записи
+def install(scheduler):
+    global _scheduler
+    _scheduler = scheduler
+    return scheduler
+
+
+def start(bot, schedule, users_file, places_file, output_file):
+    global _task
+    scheduler = install(WaveScheduler(bot, schedule, users_file, places_file, output_file))
+    _task = asyncio.create_task(scheduler.run())
+    return _task
+
+
+def stop():
+    global _scheduler, _task
+    if _task is not None:
+        _task.cancel()
+    _scheduler = _task = None
+
+
+def enabled():
+    return _scheduler is not None
+
+
+def scheduler():
+    return _scheduler
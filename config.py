@@ -15,6 +15,15 @@ USERS_CSV = os.path.join(DATA_DIR, 'users_data.csv')
 PLACES_CSV = os.path.join(DATA_DIR, 'places.csv')
 USERS_TO_MATCH_JSON = os.path.join(DATA_DIR, 'users_to_match.json')
 
+# Запись апдейтов для офлайн-воспроизведения (bot/recorder.py): путь к JSONL или None — выключено
+RECORD_UPDATES_FILE = os.environ.get('BOT_RECORD_UPDATES')
+
+# Порт HTTP-сервера метрик Prometheus на 127.0.0.1 (bot/metrics.py); 0 — выключено
+METRICS_PORT = int(os.environ.get('BOT_METRICS_PORT', '0'))
+
+# Сквозная трассировка апдейтов (bot/spans.py): путь к JSONL со span'ами или None — выключено
+SPANS_FILE = os.environ.get('BOT_SPANS_FILE')
+
 # Создаем папку data, если ее нет
 os.makedirs(DATA_DIR, exist_ok=True)
 
@@ -27,8 +36,23 @@ TIME_OPTIONS = [
     "14:00", "14:30", "15:00", "15:30", "16:00", "16:30",
 ]
 
+# Волны матчинга (bot/waves.py), включаются явно: "закрытие=начало-конец" через запятую, например
+# "11:40=12:00-13:00"; "Офис|11:30=12:00-13:00" — расписание отдельного офиса; "on" — волна на каждый
+# час TIME_OPTIONS за 20 минут до начала. Пусто или "off" — matcher.py по каждой записи, как раньше
+MATCH_WAVES = os.environ.get('BOT_MATCH_WAVES', '')
+
 # Размеры компании
 COMPANY_SIZES = ["1", "2", "3-5", "6+", "18+"]
 
 # Длительность обеда
 LUNCH_DURATIONS = ["30", "45", "60", "90"]
+
+# Администраторы бота (Telegram user id, по одному в строке): служебные команды вроде /profile_matcher
+def get_admin_ids():
+    try:
+        with open(os.path.join(DATA_DIR, 'admins.txt'), 'r') as f:
+            return {int(line) for line in f.read().split() if line.strip().isdigit()}
+    except FileNotFoundError:
+        return set()
+
+ADMIN_IDS = get_admin_ids()
@@ -0,0 +1,126 @@
+"""
+Неблокирующее логирование для бота и matcher.py: logging.* только кладёт запись в
+очередь (QueueHandler), а в файл и консоль её пишет фоновый поток QueueListener.
+Файл ротируется по размеру; слишком длинные сообщения (вывод matcher.py, группы)
+обрезаются до начала и конца ещё до постановки в очередь.
+Ротация безопасна только при одном пишущем процессе: matcher.py, запущенный ботом,
+логирует в stderr, а в logs/matcher.log его вывод дописывает бот.
+"""
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+from typing import Optional
+
+LOG_FORMAT = '%(asctime)s %(levelname)s %(message)s'
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+# Длиннее — обрезается с пометкой, сколько символов пропущено
+MAX_MESSAGE_CHARS = 8000
+
+_listener: Optional[logging.handlers.QueueListener] = None
+# Фоновые писатели отдельных файлов (QueuedLineWriter)
+_line_writers = []
+
+
+def truncate_text(text: str, limit: int = MAX_MESSAGE_CHARS) -> str:
+    """Начало и конец длинного текста с пометкой о пропущенной середине."""
+    if limit <= 0 or len(text) <= limit:
+        return text
+    head = limit * 2 // 3
+    tail = limit - head
+    return f"{text[:head]}\n… [пропущено {len(text) - head - tail} символов] …\n{text[-tail:]}"
+
+
+class TruncatingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который обрезает сообщение перед постановкой в очередь."""
+
+    def __init__(self, log_queue, max_chars: int = MAX_MESSAGE_CHARS):
+        super().__init__(log_queue)
+        self.max_chars = max_chars
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = super().prepare(record)
+        record.msg = truncate_text(record.msg, self.max_chars)
+        return record
+
+
+def setup_queued_logging(log_file: Optional[str], level: int = logging.INFO, console: bool = True,
+                         max_bytes: int = LOG_MAX_BYTES, backup_count: int = LOG_BACKUP_COUNT,
+                         max_chars: int = MAX_MESSAGE_CHARS) -> logging.handlers.QueueListener:
+    """
+    Заменяет обработчики корневого логгера на очередь с фоновой записью в log_file
+    (RotatingFileHandler; None — без файла) и, если console, в stderr. Повторный вызов
+    перенастраивает логирование; очередь дописывается при выходе из процесса.
+    """
+    global _listener
+    if _listener is not None:
+        _stop_listener(_listener)
+        _listener = None
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = []
+    if log_file:
+        os.makedirs(os.path.dirname(log_file) or '.', exist_ok=True)
+        handlers.append(logging.handlers.RotatingFileHandler(log_file, maxBytes=max_bytes,
+                                                             backupCount=backup_count, encoding='utf-8'))
+    if console:
+        handlers.append(logging.StreamHandler())
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(TruncatingQueueHandler(log_queue, max_chars))
+    root.setLevel(level)
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+class QueuedLineWriter:
+    """
+    Построчная запись в отдельный ротируемый файл (JSONL) через свою очередь и фоновый
+    поток — как у логов, но мимо логгеров: не зависит от уровней и logging.disable.
+    """
+
+    def __init__(self, path: str, max_bytes: int = LOG_MAX_BYTES, backup_count: int = LOG_BACKUP_COUNT):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count,
+                                                       encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        self._queue = queue.SimpleQueue()
+        self._listener = logging.handlers.QueueListener(self._queue, handler)
+        self._listener.start()
+        _line_writers.append(self)
+
+    def write(self, line: str) -> None:
+        self._queue.put_nowait(logging.makeLogRecord({'msg': line}))
+
+    def close(self) -> None:
+        """Дописывает очередь и закрывает файл."""
+        if self._listener is not None:
+            _stop_listener(self._listener)
+            self._listener = None
+        if self in _line_writers:
+            _line_writers.remove(self)
+
+
+def _stop_listener(listener: logging.handlers.QueueListener) -> None:
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
+
+
+def stop_queued_logging() -> None:
+    """Дописывает очереди и останавливает фоновые потоки (вызывается и при выходе)."""
+    global _listener
+    if _listener is not None:
+        _stop_listener(_listener)
+        _listener = None
+    for writer in _line_writers[:]:
+        writer.close()
+
+
+atexit.register(stop_queued_logging)
@@ -1,22 +1,23 @@
 import asyncio
 import logging
-import os
 from aiogram import Bot, Dispatcher
 from aiogram.fsm.storage.memory import MemoryStorage
-from config import BOT_TOKEN  # Импортируем API_TOKEN из config.py
+from config import (  # Импортируем API_TOKEN из config.py
+    BOT_TOKEN, RECORD_UPDATES_FILE, METRICS_PORT, SPANS_FILE, MATCH_WAVES, TIME_OPTIONS,
+    USERS_CSV, USERS_TO_MATCH_JSON, PLACES_CSV
+)
 from bot import register_all_handlers
+from bot.metrics import MetricsMiddleware, start_metrics_server
+from bot.recorder import UpdateRecorderMiddleware
+from bot.spans import TracingMiddleware, enable_spans
+from bot import results as result_store
+from bot import store as data_store
+from bot import waves
 from bot.utils import ensure_csv_exists, ensure_json_exists, load_places
+from logutils import setup_queued_logging
 
-# Настройка логирования
-os.makedirs('logs', exist_ok=True)
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s %(levelname)s %(message)s',
-    handlers=[
-        logging.FileHandler('logs/bot.log', encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+# Настройка логирования: запись в файл и консоль идёт в фоновом потоке, с ротацией
+setup_queued_logging('logs/bot.log')
 logging.info('main.py запущен')
 
 # Инициализация бота и диспетчера
@@ -32,12 +33,40 @@ async def main():
     
     # Загружаем список мест для обеда
     load_places()
+
+    # Последний результат матчинга с диска — текущий снимок до первого прогона
+    result_store.load('data/output.json')
+
+    # Профили и пул записи держит в памяти актор хранилища, на диск пишет групповыми фиксациями
+    data_store.start(USERS_CSV, USERS_TO_MATCH_JSON)
     
     # Регистрируем обработчики
     register_all_handlers(dp)
+
+    # Опциональная запись апдейтов (BOT_RECORD_UPDATES=logs/updates.jsonl)
+    if RECORD_UPDATES_FILE:
+        dp.update.outer_middleware(UpdateRecorderMiddleware(RECORD_UPDATES_FILE))
+
+    # Опциональные метрики Prometheus на localhost (BOT_METRICS_PORT=9108)
+    if METRICS_PORT:
+        dp.update.outer_middleware(MetricsMiddleware())
+        await start_metrics_server(METRICS_PORT, storage=storage)
+
+    # Опциональная сквозная трассировка апдейтов (BOT_SPANS_FILE=logs/spans.jsonl)
+    if SPANS_FILE:
+        enable_spans(SPANS_FILE)
+        dp.update.outer_middleware(TracingMiddleware())
+
+    # Волны матчинга по расписанию: клики только пополняют пул, группы формирует планировщик
+    schedule = waves.parse_schedule(MATCH_WAVES, TIME_OPTIONS)
+    if schedule:
+        waves.start(bot, schedule, USERS_TO_MATCH_JSON, PLACES_CSV, 'data/output.json')
     
     # Запускаем бота
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await data_store.stop()
 
 if __name__ == '__main__':
     logging.info('main.py: запуск asyncio.run(main())')
@@ -3,34 +3,209 @@ import json
 import csv
 import argparse
 import sys
-from datetime import datetime, time, timedelta
-from typing import List, Dict, Tuple, Optional, Set
-from itertools import combinations
+from datetime import datetime, time
+from typing import Callable, List, Dict, Tuple, Optional, Set
+import heapq
 import logging
+import random
+import cProfile
+import io
+import pstats
+import tracemalloc
+import time as clock
+from contextlib import contextmanager
+from operator import attrgetter
 import os
+import copy
+import hashlib
+import tempfile
+
+from logutils import setup_queued_logging
+from timeutils import to_minutes, format_minutes, is_valid_interval, min_start_minutes, parse_now
+
+def setup_logging(log_file: Optional[str] = 'logs/matcher.log') -> None:
+    """
+    Настройка логирования matcher.py при запуске из командной строки.
+    log_file None — только stderr: так запускает бот, он сам дописывает вывод в logs/matcher.log.
+    """
+    setup_queued_logging(log_file)
+    logging.info('=== matcher.py: запуск скрипта ===')
+
+
+class Tracer:
+    """
+    Трассировка перебора для отладки (включается флагом --trace).
+    Одна запись — строка JSON; поля записи формируются лениво (fields — функция),
+    так что отброшенные семплированием записи ничего не стоят. Пишет один
+    буферизованный файл, открытый на весь прогон.
+    """
+
+    def __init__(self, path: str, sample: float = 1.0, buffer_size: int = 1 << 16):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.sample = sample
+        self._file = open(path, 'a', encoding='utf-8', buffering=buffer_size)
+        self._random = random.Random().random
+        self.emitted = 0
+        self.dropped = 0
+
+    def emit(self, event: str, fields) -> None:
+        if self.sample < 1.0 and self._random() >= self.sample:
+            self.dropped += 1
+            return
+        record = fields()
+        record["event"] = event
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.emitted += 1
+
+    def close(self) -> None:
+        self._file.close()
+
+
+# Активный трассировщик; None — трассировка выключена, в горячих циклах остаётся одна проверка
+TRACE: Optional[Tracer] = None
+
+
+def enable_trace(path: str = 'logs/matcher_debug.log', sample: float = 1.0) -> Tracer:
+    """Включает трассировку перебора в файл path с долей записей sample."""
+    global TRACE
+    disable_trace()
+    TRACE = Tracer(path, sample)
+    return TRACE
+
+
+def disable_trace() -> None:
+    """Выключает трассировку и сбрасывает буфер на диск."""
+    global TRACE
+    if TRACE is not None:
+        logging.info(f"trace: {TRACE.emitted} записей, {TRACE.dropped} отброшено семплированием -> {TRACE.path}")
+        TRACE.close()
+        TRACE = None
+
+
+class RunMetrics:
+    """
+    Время (мс) и счётчики по фазам одного прогона матчинга.
+    Фазы и счётчики накапливаются: фаза, вызванная несколько раз, суммирует время.
+    Если включён tracemalloc (--profile mem), для каждой фазы запоминается и пик памяти.
+    """
+
+    def __init__(self):
+        self.phases: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+        self.mem_peaks: Dict[str, int] = {}
+        self.snapshot = None
+        self._started = clock.perf_counter()
+
+    @contextmanager
+    def phase(self, name: str):
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+        started = clock.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + (clock.perf_counter() - started) * 1000
+            if tracing:
+                peak = tracemalloc.get_traced_memory()[1]
+                self.mem_peaks[name] = max(self.mem_peaks.get(name, 0), peak)
+
+    def count(self, name: str, n: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def to_dict(self) -> Dict:
+        return {
+            "total_ms": round((clock.perf_counter() - self._started) * 1000, 3),
+            "phases_ms": {name: round(ms, 3) for name, ms in self.phases.items()},
+            "counters": dict(self.counters),
+            **({"mem_peak_kb": {name: round(peak / 1024, 1) for name, peak in self.mem_peaks.items()}}
+               if self.mem_peaks else {}),
+        }
+
+
+# Метрики текущего (или последнего) прогона; заводятся заново в match_lunch и find_all_lunch_groups
+METRICS = RunMetrics()
+
+
+def start_metrics() -> RunMetrics:
+    """Начинает сбор метрик нового прогона."""
+    global METRICS
+    METRICS = RunMetrics()
+    return METRICS
 
-# === Диагностика запуска matcher.py ===
-import os
-os.makedirs('logs', exist_ok=True)
-with open('logs/matcher.log', 'a', encoding='utf-8') as f:
-    f.write('=== matcher.py: запуск скрипта ===\n')
-print('=== matcher.py: запуск скрипта ===', flush=True)
-print('=== DEBUG: matcher.py действительно запускается ===', flush=True)
-
-# Настройка логирования matcher.py
-os.makedirs('logs', exist_ok=True)
-for handler in logging.root.handlers[:]:
-    logging.root.removeHandler(handler)
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s %(levelname)s %(message)s',
-    handlers=[
-        logging.FileHandler('logs/matcher.log', encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
-logging.info('=== LOGGING CONFIGURED ===')
-print('=== LOGGING CONFIGURED PRINT ===', flush=True)
+
+def get_last_metrics() -> Dict:
+    """Возвращает метрики последнего прогона (фазы в мс и счётчики)."""
+    return METRICS.to_dict()
+
+
+def write_json_atomic(path: str, data, **dump_kwargs) -> None:
+    """Пишет JSON во временный файл рядом и переименовывает: читатель видит файл целиком или старый."""
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, **dump_kwargs)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def save_metrics(metrics_file: str, trace_id: Optional[str] = None) -> None:
+    metrics = get_last_metrics()
+    if trace_id:
+        metrics["trace_id"] = trace_id
+    write_json_atomic(metrics_file, metrics, indent=2)
+
+
+PROFILE_TOP = 25
+
+
+def run_profiled(mode: str, profile_out: str, func, *args, **kwargs):
+    """
+    Выполняет func под профилировщиком и сохраняет артефакт в profile_out.
+    mode="cpu" — cProfile, файл .pstats (смотреть через python -m pstats или snakeviz);
+    mode="mem" — tracemalloc, текстовый отчёт: пик памяти по фазам и топ мест выделения.
+    """
+    os.makedirs(os.path.dirname(profile_out) or '.', exist_ok=True)
+    if mode == "cpu":
+        profiler = cProfile.Profile()
+        result = profiler.runcall(func, *args, **kwargs)
+        profiler.dump_stats(profile_out)
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(PROFILE_TOP)
+        logging.info(f"profile cpu: сохранён в {profile_out}\n{report.getvalue()}")
+        return result
+
+    tracemalloc.start(10)
+    try:
+        result = func(*args, **kwargs)
+        peak = tracemalloc.get_traced_memory()[1]
+        snapshot = METRICS.snapshot or tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    mem_peaks = METRICS.mem_peaks
+    METRICS.snapshot = None
+    overall_peak = max([peak, *mem_peaks.values()])
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+    ])
+    with open(profile_out, "w", encoding="utf-8") as f:
+        f.write(f"peak_kb: {overall_peak / 1024:.1f}\n\n")
+        f.write("peak_kb по фазам:\n")
+        for name, phase_peak in mem_peaks.items():
+            f.write(f"  {name}: {phase_peak / 1024:.1f}\n")
+        f.write(f"\nтоп-{PROFILE_TOP} мест выделения (живые объекты перед жадным выбором):\n")
+        for stat in snapshot.statistics("lineno")[:PROFILE_TOP]:
+            f.write(f"  {stat}\n")
+    logging.info(f"profile mem: пик {overall_peak / 1024:.1f} КБ, отчёт в {profile_out}")
+    return result
 
 
 def validate_input(data: List[Dict]) -> None:
@@ -51,26 +226,20 @@ def validate_input(data: List[Dict]) -> None:
 
 def parse_time(time_str: str) -> time:
     """Парсит строку времени в объект time."""
-    return datetime.strptime(time_str, "%H:%M").time()
+    minutes = to_minutes(time_str)
+    return time(minutes // 60, minutes % 60)
 
 
 def is_valid_time_slot(start: str, end: str) -> bool:
     """Проверяет, что начало слота раньше конца."""
-    try:
-        start_time = parse_time(start)
-        end_time = parse_time(end)
-        return start_time < end_time
-    except ValueError:
-        return False
+    return is_valid_interval(start, end)
 
 
-def clean_time_slots(slots: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
-    """Очищает и объединяет пересекающиеся временные слоты."""
-    valid_slots = [s for s in slots if is_valid_time_slot(s[0], s[1])]
-    if not valid_slots:
+def merge_slot_minutes(slots: List[Tuple[str, str]]) -> List[Tuple[int, int]]:
+    """Отбрасывает некорректные слоты и объединяет пересекающиеся; результат — минуты от полуночи."""
+    intervals = sorted((to_minutes(s[0]), to_minutes(s[1])) for s in slots if is_valid_time_slot(s[0], s[1]))
+    if not intervals:
         return []
-    intervals = [(parse_time(s[0]), parse_time(s[1])) for s in valid_slots]
-    intervals.sort()
     merged = [intervals[0]]
     for current in intervals[1:]:
         last = merged[-1]
@@ -78,7 +247,12 @@ def clean_time_slots(slots: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
             merged[-1] = (last[0], max(last[1], current[1]))
         else:
             merged.append(current)
-    return [(t[0].strftime("%H:%M"), t[1].strftime("%H:%M")) for t in merged]
+    return merged
+
+
+def clean_time_slots(slots: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+    """Очищает и объединяет пересекающиеся временные слоты."""
+    return [(format_minutes(start), format_minutes(end)) for start, end in merge_slot_minutes(slots)]
 
 
 def clean_preferences(user: Dict) -> None:
@@ -107,316 +281,939 @@ def load_places(filename: str) -> List[Dict]:
         sys.exit(1)
 
 
-def find_common_time_slot(users: List[Dict]) -> Optional[Tuple[str, str]]:
+# Шаг сетки битовых масок слотов, минуты
+SLOT_STEP_MIN = 5
+# Окно по умолчанию, если у кого-то из участников нет слотов
+FALLBACK_SLOT = (12 * 60, 13 * 60)
+
+
+def slots_to_mask(slots: Tuple[Tuple[int, int], ...]) -> Optional[int]:
+    """Битовая маска слотов на сетке SLOT_STEP_MIN или None, если слоты не кратны сетке."""
+    mask = 0
+    for start, end in slots:
+        if start % SLOT_STEP_MIN or end % SLOT_STEP_MIN:
+            return None
+        mask |= ((1 << ((end - start) // SLOT_STEP_MIN)) - 1) << (start // SLOT_STEP_MIN)
+    return mask
+
+
+def mask_runs(mask: int):
+    """Непрерывные интервалы (начало, конец) в минутах из маски слотов, по возрастанию."""
+    while mask:
+        low = (mask & -mask).bit_length() - 1
+        rest = mask >> low
+        length = ((rest + 1) & ~rest).bit_length() - 1
+        yield low * SLOT_STEP_MIN, (low + length) * SLOT_STEP_MIN
+        mask &= ~(((1 << length) - 1) << low)
+
+
+def size_mask(team_size_lst: List[str]) -> int:
     """
-    Находит общий временной слот, который начинается не раньше, чем через 5 минут от текущего времени.
+    Маска допустимых размеров группы: бит k установлен, если размер k разрешён.
+    Форматы: "2", "3-5", "N+" (бесконечный хвост единиц, отрицательное int); остальные игнорируются.
     """
-    if any(not u["parameters"]["time_slots"] for u in users):
-        return ("12:00", "13:00")  # fallback
+    mask = 0
+    for size_range in team_size_lst:
+        if size_range == "2":
+            mask |= 1 << 2
+        elif size_range == "3-5":
+            mask |= 0b111 << 3
+        elif size_range.endswith("+"):
+            try:
+                mask |= -1 << int(size_range.replace("+", ""))
+            except ValueError:
+                continue  # игнорируем некорректные форматы
+    return mask
+
+
+class PlaceIndex:
+    """
+    Индекс мест на один прогон матчинга.
+    Множества мест хранятся как битовые маски (int) по индексам в списке places,
+    результаты подбора мест мемоизируются по ключу
+    (офис, размер группы, общие любимые места, объединение нежелательных).
+    """
+
+    def __init__(self, places: List[Dict]):
+        self.places = places
+        self.office_ids: Dict[str, int] = {}
+        self.office_masks: List[int] = []
+        self.name_masks: Dict[str, int] = {}
+        self._next_bit = len(places)
+        self._capacity_masks: Dict[int, int] = {}
+        self._memo: Dict[Tuple[int, int, int, int], int] = {}
+        self._best: Dict[int, Optional[Dict]] = {}
+        self.hits = 0
+        self.misses = 0
+        for i, place in enumerate(places):
+            self.office_masks[self.office_id(place["office_name"])] |= 1 << i
+            self.name_masks[place["name"]] = self.name_masks.get(place["name"], 0) | (1 << i)
+
+    def office_id(self, office: str) -> int:
+        """Плотный идентификатор офиса; офисы без мест получают пустую маску."""
+        key = office.strip().lower()
+        if key not in self.office_ids:
+            self.office_ids[key] = len(self.office_masks)
+            self.office_masks.append(0)
+        return self.office_ids[key]
+
+    def names_mask(self, names) -> int:
+        """Маска мест по названиям; неизвестным названиям выдаются виртуальные биты вне каталога."""
+        mask = 0
+        for name in names:
+            if name not in self.name_masks:
+                self.name_masks[name] = 1 << self._next_bit
+                self._next_bit += 1
+            mask |= self.name_masks[name]
+        return mask
+
+    def capacity_mask(self, team_size: int) -> int:
+        mask = self._capacity_masks.get(team_size)
+        if mask is None:
+            mask = 0
+            for i, place in enumerate(self.places):
+                if place["max_table_size"] >= team_size:
+                    mask |= 1 << i
+            self._capacity_masks[team_size] = mask
+        return mask
+
+    def compatible_mask(self, office_id: int, team_size: int, common_fav: int, non_desirable: int) -> int:
+        """Маска подходящих мест: общие любимые, а если их нет — любые, кроме нежелательных."""
+        if common_fav:
+            non_desirable = 0  # при общих любимых нежелательные не влияют на выбор
+        key = (office_id, team_size, common_fav, non_desirable)
+        mask = self._memo.get(key)
+        if mask is not None:
+            self.hits += 1
+            return mask
+        self.misses += 1
+        mask = self.office_masks[office_id] & self.capacity_mask(team_size)
+        if common_fav:
+            mask &= common_fav
+        else:
+            mask &= ~non_desirable
+        self._memo[key] = mask
+        if TRACE is not None:
+            TRACE.emit("places", lambda: {"office_id": office_id, "size": team_size,
+                                          "places": [p["name"] for p in self.to_places(mask)]})
+        return mask
+
+    def to_places(self, mask: int) -> List[Dict]:
+        """Список мест из маски в исходном порядке places."""
+        result = []
+        while mask:
+            low = mask & -mask
+            result.append(self.places[low.bit_length() - 1])
+            mask ^= low
+        return result
+
+    def best_place(self, mask: int) -> Optional[Dict]:
+        """Ближайшее место из маски (первое при равном времени в пути)."""
+        if mask not in self._best:
+            places = self.to_places(mask)
+            self._best[mask] = min(places, key=lambda p: p["time_to_go_min"]) if places else None
+        return self._best[mask]
 
-    user_time_slots = []
-    for user in users:
-        slots = []
-        for s in user["parameters"]["time_slots"]:
-            start_t = parse_time(s[0])
-            end_t = parse_time(s[1])
-            if start_t < end_t:
-                slots.append((start_t, end_t))
-        user_time_slots.append(slots)
-
-    common = user_time_slots[0]
-    for user_slots in user_time_slots[1:]:
-        new_common = []
-        for s1 in common:
-            for s2 in user_slots:
-                if s1[0] < s2[1] and s2[0] < s1[1]:
-                    start = max(s1[0], s2[0])
-                    end = min(s1[1], s2[1])
-                    if start < end:
-                        new_common.append((start, end))
-        common = new_common
-        if not common:
-            return None
 
-    max_allowed_duration = min(u["parameters"]["max_lunch_duration"] for u in users)
-    max_duration_td = timedelta(minutes=max_allowed_duration)
+class MatchUser:
+    """Компактная запись пользователя для горячих циклов матчинга."""
 
-    now = datetime.now().time()
-    min_start = (datetime.combine(datetime.today(), now) + timedelta(minutes=5)).time()
+    __slots__ = ("id", "bit", "login", "office_id", "slots", "slot_mask", "slot_events", "duration",
+                 "size_mask", "fav_mask", "non_des_mask", "fav_count", "urgency")
 
-    for start, end in sorted(common):
+    def __init__(self, uid: int, user: Dict, index: PlaceIndex, slots: List[Tuple[int, int]]):
+        params = user["parameters"]
+        self.id = uid
+        self.bit = 1 << uid  # переназначается по порядку перебора в find_lunch_groups
+        self.login = user["login"]
+        self.office_id = index.office_id(params["office"])
+        self.slots = tuple(slots)
+        self.slot_mask = slots_to_mask(self.slots)
+        # Концы слотов для заметающей прямой: (минута, +1) — начало, (минута, -1) — конец
+        self.slot_events = tuple(event for start, end in self.slots for event in ((start, 1), (end, -1)))
+        self.duration = params["max_lunch_duration"]
+        self.size_mask = size_mask(params["team_size_lst"])
+        self.fav_mask = index.names_mask(params["favourite_places"])
+        self.non_des_mask = index.names_mask(params.get("non_desirable_places", []))
+        self.fav_count = len(params["favourite_places"])
+        # "Жёсткость": чем меньше слотов и любимых мест, тем раньше пользователя стоит пристроить
+        self.urgency = (3 - len(self.slots)) * 2 + (3 - self.fav_count)
+
+    def flexibility_key(self) -> Tuple[int, int, int]:
+        """Ключ сортировки: сначала "гибкие", потом "жёсткие"."""
+        return (len(self.slots), -self.duration, self.fav_count)
+
+    def class_key(self) -> Tuple:
+        """Ключ класса эквивалентности: все нормализованные параметры, влияющие на матчинг."""
+        return (self.office_id, self.slots, self.duration, self.fav_mask, self.non_des_mask, self.size_mask)
+
+
+class CandidateGroup:
+    """
+    Кандидат в группу: участники, их битовая маска, окно (минуты), место
+    и предвычисленный числовой ключ сортировки.
+    """
+
+    __slots__ = ("members", "mask", "window", "place", "sort_key", "template")
+
+    def __init__(self, members: Tuple[MatchUser, ...], window: Tuple[int, int], place: Dict):
+        self.members = members
+        self.window = window
+        self.place = place
+        self.template = None
+        mask = 0
+        for user in members:
+            mask |= user.bit
+        self.mask = mask
+        # Порядок: больше "жёсткость", затем больше размер, затем раньше начало —
+        # упаковано в одно int (начало < 2**11, размер < 2**21)
+        self.sort_key = (-sum(u.urgency for u in members) << 32) + (-len(members) << 11) + window[0]
+
+    def to_dict(self) -> Dict:
+        """Группа в формате выходного JSON."""
+        return {
+            "participants": sorted(u.login for u in self.members),
+            "lunch_time": (format_minutes(self.window[0]), format_minutes(self.window[1])),
+            "place": self.place["name"],
+            "maps_link": self.place["maps_link"]
+        }
+
+
+def _first_window(intervals, duration: int, min_start: int) -> Optional[Tuple[int, int]]:
+    for start, end in intervals:
         if start < min_start:
             continue  # пропускаем слоты, которые уже прошли или слишком близко
-        slot_duration = datetime.combine(datetime.today(), end) - datetime.combine(datetime.today(), start)
-        if slot_duration >= max_duration_td:
-            optimal_end = (datetime.combine(datetime.today(), start) + max_duration_td).time()
-            if optimal_end <= end:
-                return (start.strftime("%H:%M"), optimal_end.strftime("%H:%M"))
+        if end - start >= duration:
+            return (start, start + duration)
+    return None
+
 
+def sweep_common_window(users: List[MatchUser], duration: int, min_start: int) -> Optional[Tuple[int, int]]:
+    """
+    Пересечение слотов k пользователей заметающей прямой по отсортированным концам
+    (слияние k уже упорядоченных списков, O(N log k)). Общий интервал открыт, пока
+    глубина покрытия равна k; первое подходящее окно возвращается сразу, без сборки
+    всего пересечения. Для слотов с минутной точностью, которые не ложатся на сетку масок.
+    """
+    k = len(users)
+    depth = 0
+    opened = 0
+    # при равных минутах конец (-1) идёт раньше начала (+1): касающиеся слоты не пересекаются
+    for minute, delta in heapq.merge(*[u.slot_events for u in users]):
+        if delta > 0:
+            depth += 1
+            if depth == k:
+                opened = minute
+        else:
+            if depth == k and opened < minute:
+                window = _first_window(((opened, minute),), duration, min_start)
+                if window:
+                    return window
+            depth -= 1
     return None
 
 
-def is_team_size_compatible(users: List[Dict], team_size: int) -> bool:
+def find_common_time_slot(users: List[MatchUser], min_start: int) -> Optional[Tuple[int, int]]:
+    """
+    Находит общее окно длительностью min(max_lunch_duration), которое начинается
+    не раньше min_start. Время — в минутах от полуночи.
+    """
+    if any(not u.slots for u in users):
+        return FALLBACK_SLOT
+    duration = min(u.duration for u in users)
+
+    if all(u.slot_mask is not None for u in users):
+        common = users[0].slot_mask
+        for user in users[1:]:
+            common &= user.slot_mask
+            if not common:
+                return None
+        return _first_window(mask_runs(common), duration, min_start)
+
+    return sweep_common_window(users, duration, min_start)
+
+
+def is_team_size_compatible(users: List[MatchUser], team_size: int) -> bool:
     """
     Проверяет, что размер группы (team_size) разрешён КАЖДЫМ пользователем.
     Каждый пользователь может указать несколько форматов: ["2", "6+", "18+"] и т.д.
-    Достаточно, чтобы ХОТЯ БЫ ОДИН из форматов разрешал данный размер.
     """
+    mask = -1
     for user in users:
-        allowed = False
-        for size_range in user["parameters"]["team_size_lst"]:
-            if size_range == "2":
-                if team_size == 2:
-                    allowed = True
-                    break
-            elif size_range == "3-5":
-                if 3 <= team_size <= 5:
-                    allowed = True
-                    break
-            elif size_range.endswith("+"):
-                try:
-                    min_size = int(size_range.replace("+", ""))
-                    if team_size >= min_size:
-                        allowed = True
-                        break
-                except ValueError:
-                    continue  # игнорируем некорректные форматы
-            # Если формат не распознан — пропускаем
-        if not allowed:
-            return False  # если хоть один пользователь не разрешает размер — всё
-    return True
+        mask &= user.size_mask
+    return bool((mask >> team_size) & 1)
 
 
-def find_compatible_places(users: List[Dict], places: List[Dict]) -> List[Dict]:
-    debug_msg = f"DEBUG: find_compatible_places: users={users}, places_office={[p['name'] for p in places if p['office_name'].strip().lower()==users[0]['parameters']['office'].strip().lower()]}"
-    print(debug_msg, flush=True)
-    with open('logs/matcher_debug.log', 'a', encoding='utf-8') as dbg:
-        dbg.write(debug_msg + '\n')
-    office = users[0]["parameters"]["office"].strip().lower()
-    team_size = len(users)
+def compatible_place_mask(users: List[MatchUser], index: PlaceIndex, team_size: Optional[int] = None) -> int:
+    """
+    Маска мест, подходящих группе по офису, вместимости и предпочтениям (без проверки размера).
+    team_size — под сколько человек нужен стол, по умолчанию размер группы.
+    """
+    office_id = users[0].office_id
+    if any(user.office_id != office_id for user in users):
+        return 0
+
+    # Одиночка: любое место офиса, кроме non_desirable_places (как группа без общих любимых)
+    common_fav = 0
+    if len(users) > 1:
+        common_fav = users[0].fav_mask
+        for user in users[1:]:
+            common_fav &= user.fav_mask
+    non_desirable = 0
+    if not common_fav:
+        for user in users:
+            non_desirable |= user.non_des_mask
+    return index.compatible_mask(office_id, team_size or len(users), common_fav, non_desirable)
 
+
+def find_compatible_places(users: List[MatchUser], index: PlaceIndex) -> List[Dict]:
     # Проверка офиса
-    if any(user["parameters"]["office"].strip().lower() != office for user in users):
+    if any(user.office_id != users[0].office_id for user in users):
         return []
 
     # Проверка размера группы
-    if not is_team_size_compatible(users, team_size):
+    if not is_team_size_compatible(users, len(users)):
         return []
 
-    # --- Изменено: если одиночка, подбирать любое место офиса, кроме non_desirable_places ---
-    if len(users) == 1:
-        non_des = set(users[0]["parameters"].get("non_desirable_places", []))
-        compatible = []
-        for place in places:
-            if place["office_name"].strip().lower() != office:
-                continue
-            if place["name"] in non_des:
-                continue
-            if place["max_table_size"] < team_size:
-                continue
-            compatible.append(place)
-        print(f"DEBUG: одиночка, подходящие места: {[p['name'] for p in compatible]}", flush=True)
-        with open('logs/matcher_debug.log', 'a', encoding='utf-8') as dbg:
-            dbg.write(f"DEBUG: одиночка, подходящие места: {[p['name'] for p in compatible]}\n")
-        return compatible
-
-    # Находим ОБЩИЕ любимые места
-    common_fav = None
-    for user in users:
-        fav_set = set(user["parameters"]["favourite_places"])
-        common_fav = fav_set if common_fav is None else common_fav & fav_set
-    compatible = []
-    for place in places:
-        if place["office_name"].strip().lower() != office:
-            continue
-        if place["max_table_size"] < team_size:
-            continue
-        # Если есть общие любимые места — только они
-        if common_fav and place["name"] not in common_fav:
-            continue
-        # Если нет общих любимых — брать любые, кроме нелюбимых
-        if not common_fav:
-            skip = False
-            for user in users:
-                if place["name"] in user["parameters"].get("non_desirable_places", []):
-                    skip = True
-                    break
-            if skip:
-                continue
-        compatible.append(place)
-    print(f"DEBUG: совместимые места: {[p['name'] for p in compatible]}", flush=True)
-    with open('logs/matcher_debug.log', 'a', encoding='utf-8') as dbg:
-        dbg.write(f"DEBUG: совместимые места: {[p['name'] for p in compatible]}\n")
-    return compatible
+    return index.to_places(compatible_place_mask(users, index))
 
 
-def process_users(users: List[Dict]) -> List[Dict]:
-    """Очищает и нормализует данные пользователей."""
-    for user in users:
-        user["parameters"]["time_slots"] = clean_time_slots(user["parameters"]["time_slots"])
+def process_users(users: List[Dict], index: PlaceIndex) -> List[MatchUser]:
+    """Очищает и нормализует данные пользователей и строит по ним записи MatchUser."""
+    records = []
+    for uid, user in enumerate(users):
+        params = user["parameters"]
+        if "duration_min" in params:
+            params["max_lunch_duration"] = params.pop("duration_min")
+        slots = merge_slot_minutes(params["time_slots"])
+        params["time_slots"] = [(format_minutes(start), format_minutes(end)) for start, end in slots]
         clean_preferences(user)
-    return users
+        records.append(MatchUser(uid, user, index, slots))
+    return records
+
 
+def match_lunch_group(users: List[MatchUser], index: PlaceIndex, min_start: int) -> Optional[CandidateGroup]:
+    office_id = users[0].office_id
+    if any(user.office_id != office_id for user in users):
+        METRICS.count("reject_office")
+        if TRACE is not None:
+            TRACE.emit("reject", lambda: {"users": [u.login for u in users], "reason": "office"})
+        return None
 
-def match_lunch_group(users: List[Dict], places: List[Dict]) -> Optional[Dict]:
-    debug_msg = f"DEBUG: match_lunch_group: users={users}"
-    print(debug_msg, flush=True)
-    with open('logs/matcher_debug.log', 'a', encoding='utf-8') as dbg:
-        dbg.write(debug_msg + '\n')
-    common_slot = find_common_time_slot(users)
-    print(f"DEBUG: common_slot={common_slot}", flush=True)
-    with open('logs/matcher_debug.log', 'a', encoding='utf-8') as dbg:
-        dbg.write(f"DEBUG: common_slot={common_slot}\n")
+    common_slot = find_common_time_slot(users, min_start)
     if common_slot is None:
-        print("DEBUG: common_slot is None, return None", flush=True)
-        with open('logs/matcher_debug.log', 'a', encoding='utf-8') as dbg:
-            dbg.write("DEBUG: common_slot is None, return None\n")
+        METRICS.count("reject_time")
+        if TRACE is not None:
+            TRACE.emit("reject", lambda: {"users": [u.login for u in users], "reason": "time"})
         return None
 
-    compatible_places = find_compatible_places(users, places)
-    print(f"DEBUG: compatible_places={[p['name'] for p in compatible_places]}", flush=True)
-    with open('logs/matcher_debug.log', 'a', encoding='utf-8') as dbg:
-        dbg.write(f"DEBUG: compatible_places={[p['name'] for p in compatible_places]}\n")
-    if not compatible_places:
-        print("DEBUG: compatible_places is empty, return None", flush=True)
-        with open('logs/matcher_debug.log', 'a', encoding='utf-8') as dbg:
-            dbg.write("DEBUG: compatible_places is empty, return None\n")
+    if not is_team_size_compatible(users, len(users)):
+        METRICS.count("reject_size")
+        if TRACE is not None:
+            TRACE.emit("reject", lambda: {"users": [u.login for u in users], "reason": "size"})
+        return None
+    best_place = index.best_place(compatible_place_mask(users, index))
+    if best_place is None:
+        METRICS.count("reject_place")
+        if TRACE is not None:
+            TRACE.emit("reject", lambda: {"users": [u.login for u in users], "reason": "place"})
         return None
+    if TRACE is not None:
+        TRACE.emit("candidate", lambda: {"users": [u.login for u in users],
+                                         "lunch_time": [format_minutes(m) for m in common_slot],
+                                         "place": best_place["name"]})
+    return CandidateGroup(tuple(users), common_slot, best_place)
 
-    best_place = min(compatible_places, key=lambda p: p["time_to_go_min"])
-    return {
-        "participants": sorted(u["login"] for u in users),
-        "lunch_time": common_slot,
-        "place": best_place["name"],
-        "maps_link": best_place["maps_link"]
-    }
-
-
-def find_all_lunch_groups(users: List[Dict], places: List[Dict]) -> List[Dict]:
-    if len(users) == 1:
-        team_size_lst = users[0]["parameters"].get("team_size_lst", [])
-        if "1" in team_size_lst:
-            match = match_lunch_group(users, places)
-            return [match] if match else []
-        else:
-            return []
 
+def group_user_classes(users: List[MatchUser]) -> List[Dict]:
+    """
+    Группирует пользователей с одинаковыми параметрами в классы.
+    Порядок классов и участников внутри класса сохраняет порядок users.
+    """
+    classes = []
+    by_key = {}
     for user in users:
-        if "duration_min" in user["parameters"]:
-            user["parameters"]["max_lunch_duration"] = user["parameters"].pop("duration_min")
+        key = user.class_key()
+        if key not in by_key:
+            by_key[key] = len(classes)
+            classes.append({"key": key, "members": []})
+        classes[by_key[key]]["members"].append(user)
+    return classes
 
-    result = []
-    used = set()
-
-    # Сортируем: сначала "гибкие", потом "жёсткие"
-    users_sorted = sorted(
-        users,
-        key=lambda u: (
-            len(u["parameters"]["time_slots"]) if u["parameters"]["time_slots"] else 0,
-            -u["parameters"]["max_lunch_duration"],
-            len(u["parameters"]["favourite_places"])
-        )
-    )
 
-    all_candidates = []
+def enumerate_class_templates(classes: List[Dict], size: int):
+    """
+    Перебирает мультимножества классов размера size с учётом кратностей.
+    Шаблон — кортеж пар (индекс класса, сколько участников из него).
+    Классы разных офисов и классы, не допускающие такой размер группы, не смешиваются.
+    Класс, отсеянный по размеру, считается в reject_size (один раз на размер). Шаблоны
+    из разных офисов не строятся вовсе, поэтому reject_office перебор не увеличивает —
+    он считает отказы жадного роста больших групп и прямых вызовов match_lunch_group.
+    """
+    by_office = {}
+    for i, cls in enumerate(classes):
+        if is_team_size_compatible([cls["members"][0]], size):
+            by_office.setdefault(cls["members"][0].office_id, []).append(i)
+        else:
+            METRICS.count("reject_size")
 
-    # Сначала пары
-    for combo in combinations(users_sorted, 2):
-        match = match_lunch_group(list(combo), places)
-        if match:
-            all_candidates.append(match)
-
-    # Потом тройки
-    for combo in combinations(users_sorted, 3):
-        match = match_lunch_group(list(combo), places)
-        if match:
-            all_candidates.append(match)
-
-    # Потом 4, 5, 6
-    for size in [4, 5, 6]:
-        for combo in combinations(users_sorted, size):
-            match = match_lunch_group(list(combo), places)
-            if match:
-                all_candidates.append(match)
-
-    # Новый ключ: приоритет по "жёсткости" участников
-    def sort_key(group):
-        urgency = 0
-        for login in group["participants"]:
-            user = next(u for u in users if u["login"] == login)
-            num_slots = len(user["parameters"]["time_slots"]) if user["parameters"]["time_slots"] else 0
-            urgency += (3 - num_slots) * 2
-            urgency += (3 - len(user["parameters"]["favourite_places"]))
-        size = len(group["participants"])
-        time_start = parse_time(group["lunch_time"][0]) if group["lunch_time"] else time(23, 59)
-        return (-urgency, -size, time_start)
-
-    all_candidates.sort(key=sort_key)
-
-    # Жадный выбор
-    for group in all_candidates:
-        if used.intersection(group["participants"]):
+    def extend(candidates, start, remaining, prefix):
+        if remaining == 0:
+            yield tuple(prefix)
+            return
+        for pos in range(start, len(candidates)):
+            c = candidates[pos]
+            for count in range(min(remaining, len(classes[c]["members"])), 0, -1):
+                prefix.append((c, count))
+                yield from extend(candidates, pos + 1, remaining - count, prefix)
+                prefix.pop()
+
+    for candidates in by_office.values():
+        yield from extend(candidates, 0, size, [])
+
+
+# Группы от этого размера строятся конструктивно, а не перебором сочетаний
+LARGE_GROUP_MIN = 6
+
+
+def allows_large_group(user: MatchUser) -> bool:
+    """Допускает ли пользователь хоть какой-то размер группы от LARGE_GROUP_MIN."""
+    return (user.size_mask >> LARGE_GROUP_MIN) != 0
+
+
+def small_size_mask(user: MatchUser) -> int:
+    """Биты допустимых размеров малой группы: от 2 до LARGE_GROUP_MIN - 1."""
+    return user.size_mask & ((1 << LARGE_GROUP_MIN) - 1) & ~0b11
+
+
+def allows_small_group(user: MatchUser) -> bool:
+    """Допускает ли пользователь группу от 2 до LARGE_GROUP_MIN - 1 человек."""
+    return small_size_mask(user) != 0
+
+
+def smallest_small_size(user: MatchUser) -> int:
+    """Наименьший допустимый размер малой группы (от 2); 0 — малые группы не подходят."""
+    small = small_size_mask(user)
+    return (small & -small).bit_length() - 1 if small else 0
+
+
+def _grow_large_group(seed: MatchUser, pool: List[MatchUser], excluded: Set[int],
+                      index: PlaceIndex, min_start: int, partners: Dict[int, int]) -> List[MatchUser]:
+    """
+    Жадно добавляет к seed пользователей пула, пока у группы остаются общее окно и место
+    хотя бы на LARGE_GROUP_MIN человек. Вместимость не ограничивает рост: слишком большая
+    группа потом делится в split_large_group. Сначала берутся те, кому остаются только
+    большие группы (needs_large_group); остальных — лишь чтобы закрыть нехватку
+    (_large_group_shortfall), иначе большая группа забирает участников, нужных малым.
+    Если нехватку закрыть не удалось, добавленные зря (не прибавившие мест) откатываются.
+    """
+    members = [seed]
+    candidates = [u for u in pool if u is not seed and u.id not in excluded]
+    waiting = [u for u in candidates if needs_large_group(u, partners)]
+    # Из согласных и на малую группу первыми — те, кому для малой нужно больше партнёров,
+    # затем у кого меньше возможных пар (partners), затем более "жёсткие"
+    flexible = sorted((u for u in candidates if not needs_large_group(u, partners)),
+                      key=lambda u: (-smallest_small_size(u), partners[u.id], -u.urgency))
+    best, best_seated = [], 0
+    while True:
+        waiting = _add_fitting(members, waiting, index, min_start)
+        seated = _large_group_seated(members, index)
+        if seated > best_seated:
+            best, best_seated = list(members), seated
+        if not _large_group_shortfall(members, index):
+            return members
+        # Новый участник может открыть группу для отказавших раньше — проходим по ним снова
+        count = len(members)
+        flexible = _add_fitting(members, flexible, index, min_start, limit=1)
+        if len(members) == count:
+            return best if best_seated else members
+
+
+def _add_fitting(members: List[MatchUser], users: List[MatchUser], index: PlaceIndex, min_start: int,
+                 limit: Optional[int] = None) -> List[MatchUser]:
+    """
+    Добавляет к members подходящих из users (не больше limit), повторяя проход, пока группа растёт:
+    отказ зависит от уже набранных (с более коротким обедом общее окно длиннее). Возвращает
+    непроверенных и отказавших.
+    """
+    added = 0
+    while users:
+        rest = []
+        for pos, user in enumerate(users):
+            if limit is not None and added >= limit:
+                return rest + users[pos:]
+            if _fits_large_group(members, user, index, min_start):
+                members.append(user)
+                added += 1
+            else:
+                rest.append(user)
+        if len(rest) == len(users):
+            return rest
+        users = rest
+    return users
+
+
+def _fits_large_group(members: List[MatchUser], user: MatchUser, index: PlaceIndex, min_start: int) -> bool:
+    """Можно ли добавить user к группе: тот же офис, общее окно и место хотя бы на LARGE_GROUP_MIN."""
+    if user.office_id != members[0].office_id:
+        METRICS.count("reject_office")
+        return False
+    trial = members + [user]
+    if not compatible_place_mask(trial, index, LARGE_GROUP_MIN):
+        METRICS.count("reject_place")
+        return False
+    if find_common_time_slot(trial, min_start) is None:
+        METRICS.count("reject_time")
+        return False
+    return True
+
+
+def _large_group_shortfall(members: List[MatchUser], index: PlaceIndex) -> int:
+    """
+    Сколько участников не хватает, чтобы рассадить всю группу: до LARGE_GROUP_MIN или до
+    деления на столы без остатка (11 при столе на 8 — 8 и трое лишних, а 12 — 6 + 6).
+    """
+    count = len(members)
+    capacity = large_group_capacity(members, index)
+    if count >= LARGE_GROUP_MIN and sum(split_sizes(count, capacity)) == count:
+        return 0
+    parts = -(-count // capacity) if capacity >= LARGE_GROUP_MIN else 1
+    return max(0, parts * LARGE_GROUP_MIN - count)
+
+
+def small_group_partners(flexible: List[MatchUser], users: List[MatchUser], index: PlaceIndex,
+                         min_start: int) -> Dict[int, int]:
+    """
+    Для каждого из flexible — сколько пользователей users могут составить с ним малую группу
+    вдвоём (общий размер, окно и место): чем их меньше, тем меньше он нужен малым группам.
+    """
+    partners = {}
+    for user in flexible:
+        partners[user.id] = sum(
+            1 for other in users
+            if other is not user and other.office_id == user.office_id
+            and small_size_mask(user) & other.size_mask
+            and compatible_place_mask([user, other], index, 2)
+            and find_common_time_slot([user, other], min_start) is not None)
+    return partners
+
+
+def needs_large_group(user: MatchUser, partners: Dict[int, int]) -> bool:
+    """Остаются ли user только большие группы: малые не подходят или на самую маленькую не набрать пар."""
+    return not allows_small_group(user) or partners[user.id] < smallest_small_size(user) - 1
+
+
+def _large_group_seated(members: List[MatchUser], index: PlaceIndex) -> int:
+    """Сколько участников группы рассаживается по частям не меньше LARGE_GROUP_MIN."""
+    sizes = split_sizes(len(members), large_group_capacity(members, index))
+    return sum(size for size in sizes if size >= LARGE_GROUP_MIN)
+
+
+def large_group_capacity(members: List[MatchUser], index: PlaceIndex) -> int:
+    """Самый большой стол среди мест, подходящих всей группе (0 — таких мест нет)."""
+    places = index.to_places(compatible_place_mask(members, index, LARGE_GROUP_MIN))
+    return max((place["max_table_size"] for place in places), default=0)
+
+
+def split_sizes(count: int, capacity: int) -> List[int]:
+    """
+    Размеры частей, на которые делится группа из count человек при столе на capacity:
+    поровну на минимально возможное число частей (14 при столе на 12 — 7 + 7).
+    Если ровные части выходят меньше LARGE_GROUP_MIN, берутся полные столы, а остаток не садится.
+    """
+    if count <= capacity or capacity < LARGE_GROUP_MIN:
+        return [count]
+    parts = -(-count // capacity)
+    if count // parts < LARGE_GROUP_MIN:
+        return [capacity] * (count // capacity)
+    base, extra = divmod(count, parts)
+    return [base + 1] * extra + [base] * (parts - extra)
+
+
+def split_large_group(members: List[MatchUser], index: PlaceIndex) -> List[List[MatchUser]]:
+    """
+    Делит выросшую группу на части, которые помещаются за стол подходящего места.
+    Части режутся по времени слотов (без слотов — в конце), чтобы у каждой осталось своё общее окно.
+    """
+    if len(members) > large_group_capacity(members, index):
+        members = sorted(members, key=lambda u: (not u.slots, u.slots))
+    parts = []
+    offset = 0
+    for size in split_sizes(len(members), large_group_capacity(members, index)):
+        parts.append(members[offset:offset + size])
+        offset += size
+    return parts
+
+
+def build_large_groups(users: List[MatchUser], index: PlaceIndex, min_start: int) -> List[CandidateGroup]:
+    """
+    Конструктивно собирает большие группы (LARGE_GROUP_MIN и больше, форматы "6+", "18+").
+    Для каждого свободного пользователя-затравки группа жадно растёт по совместимым
+    по офису, окну и месту пользователям, затем делится на части под вместимость стола
+    (max_table_size); из частей исключаются те, кому их размер не подходит, и группа
+    пересобирается без них. Стоимость полиномиальна по размеру пула, перебора сочетаний нет.
+    """
+    pool = [u for u in users if allows_large_group(u)]
+    partners = small_group_partners([u for u in pool if allows_small_group(u)], users, index, min_start)
+    groups = []
+    used_mask = 0
+    # Затравки — сначала те, кому остаются только большие группы
+    for seed in sorted(pool, key=lambda u: not needs_large_group(u, partners)):
+        if seed.bit & used_mask:
+            continue
+        free = [u for u in pool if not u.bit & used_mask]
+        excluded: Set[int] = set()
+        while True:
+            parts = split_large_group(_grow_large_group(seed, free, excluded, index, min_start, partners), index)
+            rejected = {u.id for part in parts for u in part if not is_team_size_compatible([u], len(part))}
+            if not rejected or seed.id in rejected:
+                break
+            excluded |= rejected
+        if seed.id in rejected:
             continue
+        for part in parts:
+            if len(part) < LARGE_GROUP_MIN:
+                continue
+            match = match_lunch_group(part, index, min_start)
+            if match:
+                groups.append(match)
+                used_mask |= match.mask
+    return groups
+
+
+def find_lunch_groups(users: List[MatchUser], index: PlaceIndex, min_start: int,
+                      on_group: Optional[Callable[[CandidateGroup], None]] = None) -> List[CandidateGroup]:
+    """
+    Подбирает группы по записям MatchUser: большие группы, перебор малых по классам, одиночки.
+    on_group вызывается для каждой группы сразу после её выбора (потоковый вывод).
+    """
+    result = []
+    used_mask = 0
+
+    def select(group: CandidateGroup) -> None:
         result.append(group)
-        used.update(group["participants"])
+        if on_group is not None:
+            on_group(group)
+
+    # Сортируем: сначала "гибкие", потом "жёсткие"; биты участников — позиции в этом порядке
+    users_sorted = sorted(users, key=MatchUser.flexibility_key)
+    for rank, user in enumerate(users_sorted):
+        user.bit = 1 << rank
+
+    # Большие группы собираются конструктивно, перебор остаётся для малых размеров
+    with METRICS.phase("large_groups"):
+        for group in build_large_groups(users_sorted, index, min_start):
+            select(group)
+            used_mask |= group.mask
+    METRICS.count("large_groups", len(result))
+
+    # Пользователи с одинаковыми параметрами неразличимы для перебора:
+    # ищем группы по классам эквивалентности с кратностями, а логины подставляем при выборе
+    classes = group_user_classes([u for u in users_sorted if not u.bit & used_mask])
+    all_candidates = []
+    METRICS.count("classes", len(classes))
+    for size in range(2, LARGE_GROUP_MIN):
+        enumerated = 0
+        feasible_before = len(all_candidates)
+        with METRICS.phase(f"enumerate_size_{size}"):
+            for template in enumerate_class_templates(classes, size):
+                enumerated += 1
+                representatives = [classes[c]["members"][0] for c, count in template for _ in range(count)]
+                match = match_lunch_group(representatives, index, min_start)
+                if match:
+                    match.template = template
+                    all_candidates.append(match)
+        METRICS.count(f"templates_size_{size}", enumerated)
+        METRICS.count(f"feasible_size_{size}", len(all_candidates) - feasible_before)
+
+    # Приоритет по "жёсткости" участников (числовой ключ предвычислен в CandidateGroup)
+    with METRICS.phase("sort"):
+        all_candidates.sort(key=attrgetter("sort_key"))
+    if tracemalloc.is_tracing():
+        # --profile mem: снимок в момент, когда живы все кандидаты перед жадным выбором
+        METRICS.snapshot = tracemalloc.take_snapshot()
+
+    # Жадный выбор: шаблон заполняется свободными участниками своих классов, пока их хватает.
+    # Свободные участники класса — маска класса без used_mask, берутся младшие биты
+    greedy_before = len(result)
+    with METRICS.phase("greedy"):
+        class_masks = []
+        for cls in classes:
+            mask = 0
+            for user in cls["members"]:
+                mask |= user.bit
+            class_masks.append(mask)
+        by_bit = {user.bit: user for user in users_sorted}
+        for candidate in all_candidates:
+            template = candidate.template
+            while True:
+                picked = 0
+                for c, count in template:
+                    free = class_masks[c] & ~used_mask
+                    if free.bit_count() < count:
+                        picked = 0
+                        break
+                    for _ in range(count):
+                        low = free & -free
+                        picked |= low
+                        free ^= low
+                if not picked:
+                    break
+                members = []
+                rest = picked
+                while rest:
+                    low = rest & -rest
+                    members.append(by_bit[low])
+                    rest ^= low
+                select(CandidateGroup(tuple(members), candidate.window, candidate.place))
+                used_mask |= picked
+    METRICS.count("greedy_groups", len(result) - greedy_before)
 
     # Одиночки
+    with METRICS.phase("singles"):
+        for user in users:
+            if not user.bit & used_mask:
+                METRICS.count("singles_tried")
+                single = match_lunch_group([user], index, min_start)
+                if single:
+                    select(single)
+                    METRICS.count("singles_matched")
+
+    METRICS.count("place_memo_hits", index.hits)
+    METRICS.count("place_memo_misses", index.misses)
+    logging.info(f"find_lunch_groups: кеш мест hits={index.hits}, misses={index.misses}")
+    return result
+
+
+def find_all_lunch_groups(users: List[Dict], places: List[Dict], now: Optional[datetime] = None) -> List[Dict]:
+    """
+    Подбирает группы для пользователей в формате входного JSON и возвращает их в формате выходного.
+    now — момент прогона (по умолчанию текущий), от него отсчитывается самое раннее начало обеда.
+    """
+    start_metrics()
+    index = PlaceIndex(places)
+    records = process_users(users, index)
+    min_start = min_start_minutes(now or datetime.now())
+    return [group.to_dict() for group in find_lunch_groups(records, index, min_start)]
+
+
+# Мемоизация результата последнего прогона: ключ — канонический отпечаток входа
+_LAST_RUN: Dict = {"fingerprint": None, "result": None}
+CACHE_STATS: Dict[str, int] = {"hits": 0, "misses": 0}
+
+
+def get_cache_stats() -> Dict[str, int]:
+    """Возвращает счётчики попаданий и промахов кеша результатов."""
+    return dict(CACHE_STATS)
+
+
+def clear_result_cache() -> None:
+    """Сбрасывает запомненный результат прогона (для замеров и тестов)."""
+    _LAST_RUN["fingerprint"] = None
+    _LAST_RUN["result"] = None
+
+
+def time_bucket(users: List[MatchUser], min_start: int) -> int:
+    """
+    Номер временной корзины для текущего момента.
+    Окно обеда всегда начинается с начала чьего-то слота, поэтому результат
+    меняется только когда min_start (now + 5 минут) перешагивает начало слота:
+    корзина — число различных начал слотов, которые уже недоступны.
+    """
+    starts = {start for u in users for start, _ in u.slots}
+    return sum(1 for start in starts if start < min_start)
+
+
+def input_fingerprint(users: List[Dict], places: List[Dict], bucket: int) -> str:
+    """Канонический отпечаток нормализованных пользователей, каталога мест и временной корзины."""
+    canonical_users = []
     for user in users:
-        if user["login"] not in used:
-            single = match_lunch_group([user], places)
-            if single:
-                result.append(single)
+        params = user["parameters"]
+        canonical_users.append([
+            user["login"],
+            params["office"].strip().lower(),
+            [list(s) for s in params["time_slots"]],
+            params.get("max_lunch_duration", params.get("duration_min")),
+            sorted(params["favourite_places"]),
+            sorted(params["non_desirable_places"]),
+            sorted(params["team_size_lst"]),
+        ])
+    payload = json.dumps(
+        {"users": canonical_users, "places": places, "bucket": bucket},
+        ensure_ascii=False, sort_keys=True, separators=(",", ":")
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _load_cache_file(cache_file: str) -> Dict:
+    try:
+        with open(cache_file, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+        return cached if isinstance(cached, dict) else {}
+    except (OSError, ValueError):
+        return {}
 
+
+def _save_cache_file(cache_file: str, fingerprint: str, result: List[Dict]) -> None:
+    write_json_atomic(cache_file, {"fingerprint": fingerprint, "result": result, "stats": get_cache_stats()})
+
+
+def match_lunch(data: List[Dict], places_file: str, cache_file: Optional[str] = None,
+                now: Optional[datetime] = None, on_group: Optional[Callable[[Dict], None]] = None) -> List[Dict]:
+    """
+    Полный прогон: проверка входа, загрузка мест, нормализация, кеш результата и подбор групп.
+    on_group получает каждую группу (в формате выходного JSON) сразу после выбора, при попадании
+    в кеш — все группы подряд. Время и счётчики фаз прогона доступны через get_last_metrics().
+    """
+    logging.info('match_lunch вызван')
+    metrics = start_metrics()
+    metrics.count("users", len(data))
+    with metrics.phase("validation"):
+        validate_input(data)
+    with metrics.phase("places_load"):
+        places = load_places(places_file)
+    metrics.count("places", len(places))
+    logging.info(f"match_lunch: загружено {len(places)} мест")
+    with metrics.phase("process_users"):
+        index = PlaceIndex(places)
+        records = process_users(data, index)
+    # Один момент "сейчас" на весь прогон: результат детерминирован при заданном now
+    min_start = min_start_minutes(now or datetime.now())
+
+    with metrics.phase("fingerprint"):
+        fingerprint = input_fingerprint(data, places, time_bucket(records, min_start))
+    if cache_file:
+        # Кеш на диске переживает перезапуск процесса (бот вызывает matcher.py как subprocess)
+        cached = _load_cache_file(cache_file)
+        for key, value in cached.get("stats", {}).items():
+            CACHE_STATS[key] = max(CACHE_STATS.get(key, 0), value)
+        if (_LAST_RUN["fingerprint"] != fingerprint and cached.get("fingerprint") == fingerprint
+                and isinstance(cached.get("result"), list)):
+            _LAST_RUN["fingerprint"] = fingerprint
+            _LAST_RUN["result"] = cached["result"]
+    if _LAST_RUN["fingerprint"] == fingerprint:
+        CACHE_STATS["hits"] += 1
+        metrics.count("cache_hit")
+        logging.info(f"match_lunch: кеш результата, отпечаток {fingerprint[:12]} (stats={get_cache_stats()})")
+        if cache_file:
+            _save_cache_file(cache_file, fingerprint, _LAST_RUN["result"])
+        result = copy.deepcopy(_LAST_RUN["result"])
+        metrics.count("groups", len(result))
+        if on_group is not None:
+            for group in result:
+                on_group(group)
+        return result
+    CACHE_STATS["misses"] += 1
+
+    result = []
+
+    def emit(group: CandidateGroup) -> None:
+        group_dict = group.to_dict()
+        result.append(group_dict)
+        if on_group is not None:
+            on_group(group_dict)
+
+    find_lunch_groups(records, index, min_start, on_group=emit)
+    metrics.count("groups", len(result))
+    _LAST_RUN["fingerprint"] = fingerprint
+    _LAST_RUN["result"] = copy.deepcopy(result)
+    if cache_file:
+        _save_cache_file(cache_file, fingerprint, result)
     return result
 
 
-def match_lunch(data: List[Dict], places_file: str) -> List[Dict]:
-    print('=== DEBUG: match_lunch вызван ===', flush=True)
-    import logging
-    logging.info('=== DEBUG: match_lunch вызван ===')
-    validate_input(data)
-    places = load_places(places_file)
-    print(f"DEBUG: loaded places: {[(p['office_name'], p['name']) for p in places]}", flush=True)
-    processed_users = process_users(data)
-    result = find_all_lunch_groups(processed_users, places)
-    return result if result else []
+def parse_users(text: str) -> List[Dict]:
+    """Пользователи из JSON-массива или JSONL (по пользователю на строку)."""
+    stripped = text.lstrip()
+    if not stripped or stripped.startswith("["):
+        return json.loads(stripped or "[]")
+    return [json.loads(line) for line in stripped.splitlines() if line.strip()]
+
+
+def group_line_writer(stream) -> Callable[[Dict], None]:
+    """Пишет каждую группу компактной строкой JSONL и сразу сбрасывает буфер."""
+    def write(group: Dict) -> None:
+        stream.write(json.dumps(group, ensure_ascii=False, separators=(",", ":")) + "\n")
+        stream.flush()
+    return write
 
 
 def main():
     parser = argparse.ArgumentParser(description="Сопоставление пользователей для обеда.")
-    parser.add_argument("-i", "--input", required=True, help="Путь к JSON-файлу с пользователями")
+    parser.add_argument("-i", "--input", required=True,
+                        help="Путь к JSON-файлу с пользователями; \"-\" — JSON-массив или JSONL из stdin")
     parser.add_argument("-p", "--places", required=True, help="Путь к CSV-файлу с местами")
-    parser.add_argument("-o", "--output", required=True, help="Путь к выходному JSON-файлу")
+    parser.add_argument("-o", "--output", required=True,
+                        help="Путь к выходному JSON-файлу; \"-\" — JSONL в stdout, группа за группой по мере выбора")
+    parser.add_argument("--cache", default=None, help="Путь к файлу кеша результата (пропуск перебора при неизменном входе)")
+    parser.add_argument("--trace", action="store_true", help="Трассировать перебор кандидатов (JSONL в --trace-file)")
+    parser.add_argument("--trace-file", default="logs/matcher_debug.log", help="Файл трассировки")
+    parser.add_argument("--trace-sample", type=float, default=1.0, help="Доля сохраняемых записей трассировки, например 0.01")
+    parser.add_argument("--metrics", default=None, help="Путь к JSON-файлу с временем и счётчиками фаз прогона")
+    parser.add_argument("--profile", choices=["cpu", "mem"], default=None,
+                        help="Профилировать прогон: cpu — cProfile (.pstats), mem — tracemalloc (пики по фазам, топ выделений)")
+    parser.add_argument("--profile-out", default=None,
+                        help="Файл профиля; по умолчанию logs/matcher.pstats или logs/matcher_mem.txt")
+    parser.add_argument("--now", default=None, help="Момент прогона: HH:MM (сегодня) или ISO-дата и время; по умолчанию текущий")
+    parser.add_argument("--trace-id", default=os.environ.get("LUNCH_TRACE_ID"),
+                        help="ID апдейта бота, вызвавшего прогон (по умолчанию из LUNCH_TRACE_ID): попадает в лог и --metrics")
+    parser.add_argument("--log-file", default="logs/matcher.log",
+                        help="Файл лога; \"-\" — только stderr (параллельные прогоны из бота)")
     args = parser.parse_args()
+    setup_logging(None if args.log_file == "-" else args.log_file)
+    streaming = args.output == "-"
+    # В потоковом режиме stdout занят группами, сообщения для человека — в stderr
+    console = sys.stderr if streaming else sys.stdout
+    if args.trace:
+        enable_trace(args.trace_file, args.trace_sample)
 
-    logging.info(f"matcher.py ЗАПУЩЕН: input={args.input}, places={args.places}, output={args.output}")
+    logging.info(f"matcher.py ЗАПУЩЕН: input={args.input}, places={args.places}, output={args.output}"
+                 + (f", trace={args.trace_id}" if args.trace_id else ""))
     try:
-        print(f"📥 Загружаем пользователей из {args.input}")
-        with open(args.input, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        print(f"📥 Загружаем пользователей из {args.input}", file=console)
+        if args.input == "-":
+            data = parse_users(sys.stdin.buffer.read().decode("utf-8"))
+        else:
+            with open(args.input, 'r', encoding='utf-8') as f:
+                data = json.load(f)
         logging.info(f"matcher.py: Загружено {len(data)} пользователей из {args.input}")
 
         # Замена: duration_min → max_lunch_duration
         for user in data:
             if "duration_min" in user["parameters"]:
                 user["parameters"]["max_lunch_duration"] = user["parameters"].pop("duration_min")
-            print(f"   - {user['login']} (max_lunch_duration={user['parameters']['max_lunch_duration']} мин)")
 
-        result = match_lunch(data, args.places)
+        now = parse_now(args.now) if args.now else None
+        on_group = None
+        if streaming:
+            sys.stdout.reconfigure(encoding="utf-8")
+            on_group = group_line_writer(sys.stdout)
+        if args.profile:
+            profile_out = args.profile_out or ("logs/matcher.pstats" if args.profile == "cpu" else "logs/matcher_mem.txt")
+            # Профилируется полный перебор, кеш результата не используется
+            result = run_profiled(args.profile, profile_out, match_lunch, data, args.places, now=now,
+                                  on_group=on_group)
+        else:
+            result = match_lunch(data, args.places, cache_file=args.cache, now=now, on_group=on_group)
+        logging.info(f"matcher.py: кеш результатов {get_cache_stats()}")
+        if args.metrics:
+            save_metrics(args.metrics, args.trace_id)
 
-        print(f"DEBUG: FINAL RESULT = {result}", flush=True)
-        logging.info(f"DEBUG: FINAL RESULT = {result}")
+        logging.debug(f"matcher.py: результат {result}")
 
-        with open(args.output, 'w', encoding='utf-8') as f:
-            json.dump(result, f, ensure_ascii=False, indent=2)
+        if not streaming:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
         logging.info(f"matcher.py: Найдено {len(result)} групп. Результат сохранён в {args.output}")
 
-        print(f"✅ Найдено {len(result)} групп на обед. Результат сохранён в {args.output}")
+        print(f"✅ Найдено {len(result)} групп на обед. Результат сохранён в {args.output}", file=console)
 
     except Exception as e:
         logging.error(f"matcher.py: Ошибка выполнения: {e}")
-        print(f"❌ Ошибка выполнения: {e}")
+        print(f"❌ Ошибка выполнения: {e}", file=console)
         sys.exit(1)
+    finally:
+        disable_trace()
 
 
 if __name__ == "__main__":
@@ -1,15 +1,25 @@
 # test_matcher.py
 
+import copy
 import json
 import csv
 import os
+import subprocess
+import sys
+import tempfile
 from datetime import time, datetime, timedelta
-from matcher import match_lunch, load_places, parse_time
+from matcher import (
+    match_lunch, load_places, parse_time, clear_result_cache, get_cache_stats, get_last_metrics, MatchUser,
+    PlaceIndex, process_users, find_common_time_slot, sweep_common_window
+)
+from timeutils import min_start_minutes
 
 # Пути к тестовым файлам
 USERS_FILE = "test/users_to_match.json"
 PLACES_FILE = "test/places.csv"
 OUTPUT_FILE = "test/output.json"
+# Фиксированный момент прогона: результат не зависит от времени запуска тестов
+NOW = datetime(2026, 1, 5, 10, 0)
 
 def load_users():
     with open(USERS_FILE, "r", encoding="utf-8") as f:
@@ -29,6 +39,227 @@ def time_diff(end: str, start: str) -> int:
     delta = timedelta(hours=t_end.hour, minutes=t_end.minute) - timedelta(hours=t_start.hour, minutes=t_start.minute)
     return int(delta.total_seconds() // 60)
 
+def make_user(login, slots, favs=("Snedi",), sizes=("2", "3-5"), duration=30, office="Avrora"):
+    return {"login": login, "parameters": {
+        "office": office, "time_slots": [list(slot) for slot in slots], "max_lunch_duration": duration,
+        "favourite_places": list(favs), "non_desirable_places": [], "team_size_lst": list(sizes)}}
+
+def cache_delta(users, now):
+    """Прогон match_lunch на копии входа: (результат, +попадания, +промахи кеша)."""
+    before = get_cache_stats()
+    result = match_lunch(copy.deepcopy(users), PLACES_FILE, now=now)
+    after = get_cache_stats()
+    return result, after["hits"] - before["hits"], after["misses"] - before["misses"]
+
+def test_result_cache():
+    clear_result_cache()
+    users = [make_user("a", [("12:00", "13:00")]), make_user("b", [("12:00", "14:00")]),
+             make_user("c", [("13:00", "14:00")])]
+    first, hits, misses = cache_delta(users, NOW)
+    assert (hits, misses) == (0, 1), "❌ Первый прогон должен быть промахом кеша"
+    assert get_last_metrics()["counters"]["groups"] == len(first)
+
+    # Тот же вход в той же временной корзине — попадание с тем же результатом
+    again, hits, misses = cache_delta(users, NOW + timedelta(minutes=30))
+    assert (hits, misses) == (1, 0), "❌ Повторный прогон с тем же входом не попал в кеш"
+    assert again == first, "❌ Результат из кеша отличается от посчитанного"
+    # Счётчики попадания: группы те же, что и при переборе
+    counters = get_last_metrics()["counters"]
+    assert counters["cache_hit"] == 1 and counters["groups"] == len(first), f"❌ Счётчики попадания: {counters}"
+
+    # Изменился вход — промах
+    changed = users + [make_user("d", [("12:00", "13:00")])]
+    _, hits, misses = cache_delta(changed, NOW)
+    assert (hits, misses) == (0, 1), "❌ Изменённый вход не пересчитан"
+
+    # Начало слота 12:00 стало недоступно (now + 5 минут > 12:00) — корзина сменилась, промах
+    _, hits, misses = cache_delta(changed, NOW.replace(hour=11, minute=56))
+    assert (hits, misses) == (0, 1), "❌ Смена временной корзины не сбросила кеш"
+    clear_result_cache()
+    print("✅ Кеш результата: попадание, промах по входу и по временной корзине")
+
+def profile_groups(result):
+    """Группы с точностью до одинаковых профилей: логин "p<профиль>_<номер>" → "p<профиль>"."""
+    return sorted((sorted(login.split("_")[0] for login in g["participants"]),
+                   tuple(g["lunch_time"]) if g["lunch_time"] else None, g["place"]) for g in result)
+
+def test_equivalence_classes():
+    profiles = [
+        ([("12:00", "13:00")], ["Snedi"], ["2", "3-5"]),
+        ([("12:30", "14:00")], ["Snedi", "Mama"], ["3-5"]),
+        ([("13:00", "14:00")], ["Mama"], ["2"]),
+        ([("12:00", "12:45")], ["Burger King"], ["2", "3-5"]),
+    ]
+    users = [make_user(f"p{i}_{k}", slots, favs, sizes)
+             for i, (slots, favs, sizes) in enumerate(profiles) for k in range(4)]
+    clear_result_cache()
+    by_class = match_lunch(copy.deepcopy(users), PLACES_FILE, now=NOW)
+    counters = get_last_metrics()["counters"]
+    assert counters["classes"] == len(profiles), "❌ Одинаковые профили не схлопнулись в классы"
+    # Отсеянные по размеру до перебора: класс "3-5" для пар, класс "2" для 3, 4 и 5 человек;
+    # ещё один отказ — одиночка, которому обед в одиночку не подходит
+    assert counters["reject_size"] == 1 + 3 + 1, f"❌ reject_size: {counters}"
+
+    # Путь "по пользователю": у каждого свой класс, шаблоны вырождаются в обычные сочетания
+    class_key = MatchUser.class_key
+    MatchUser.class_key = lambda self: (self.id,) + class_key(self)
+    try:
+        clear_result_cache()
+        per_user = match_lunch(copy.deepcopy(users), PLACES_FILE, now=NOW)
+    finally:
+        MatchUser.class_key = class_key
+        clear_result_cache()
+    assert get_last_metrics()["counters"]["classes"] == len(users)
+    assert profile_groups(by_class) == profile_groups(per_user), \
+        f"❌ Классы дали другие группы: {profile_groups(by_class)} != {profile_groups(per_user)}"
+    print("✅ Классы эквивалентности: те же группы, что и по каждому пользователю")
+
+def test_sweep_line():
+    index = PlaceIndex(load_places(PLACES_FILE))
+    min_start = min_start_minutes(NOW)
+    # Слоты на сетке: пересечение масок и заметающая прямая дают одно и то же окно
+    grid_cases = [
+        [[("12:00", "13:00")], [("12:30", "14:00")], [("11:00", "12:45")]],
+        [[("12:00", "12:30"), ("13:00", "14:00")], [("13:15", "15:00")], [("12:00", "16:00")]],
+        [[("12:00", "12:20")], [("12:10", "13:00")]],
+        [[("12:00", "13:00")], [("13:00", "14:00")]],
+        [[("09:00", "10:00"), ("12:00", "13:00")], [("09:00", "13:00")]],
+    ]
+    for case in grid_cases:
+        records = process_users([make_user(f"g{i}", slots) for i, slots in enumerate(case)], index)
+        assert all(u.slot_mask is not None for u in records)
+        duration = min(u.duration for u in records)
+        assert find_common_time_slot(records, min_start) == sweep_common_window(records, duration, min_start), \
+            f"❌ Маски и заметающая прямая разошлись на {case}"
+
+    # Слот вне сетки: окно считается с минутной точностью
+    users = [make_user("offgrid", [("12:07", "12:52")]), make_user("grid", [("12:00", "13:00")])]
+    records = process_users(copy.deepcopy(users), index)
+    assert records[0].slot_mask is None
+    assert find_common_time_slot(records, min_start) == (12 * 60 + 7, 12 * 60 + 37)
+    clear_result_cache()
+    result = match_lunch(copy.deepcopy(users), PLACES_FILE, now=NOW)
+    clear_result_cache()
+    assert [(sorted(g["participants"]), tuple(g["lunch_time"])) for g in result] == \
+        [(["grid", "offgrid"], ("12:07", "12:37"))], f"❌ Слот 12:07–12:52 подобран неверно: {result}"
+    print("✅ Заметающая прямая: совпадает с масками на сетке и точна вне её")
+
+PLACES_HEADER = ["name", "office_name", "office_address", "maps_link", "time_to_go_min",
+                 "max_table_size", "avg_bill", "min_time_to_eat"]
+
+def write_places(rows):
+    """Временный places.csv из строк (название, вместимость) офиса Avrora."""
+    handle = tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False, encoding="utf-8", newline="")
+    with handle:
+        writer = csv.writer(handle)
+        writer.writerow(PLACES_HEADER)
+        for i, (name, capacity) in enumerate(rows):
+            writer.writerow([name, "Avrora", "", f"https://example.org/{i}", 5 + i, capacity, 500, 30])
+    return handle.name
+
+def large_group_run(users, places):
+    places_file = write_places(places)
+    try:
+        clear_result_cache()
+        return match_lunch(copy.deepcopy(users), places_file, now=NOW)
+    finally:
+        clear_result_cache()
+        os.remove(places_file)
+
+def test_large_groups():
+    slots = [("12:00", "14:00")]
+    # 6+: восемь человек за одним столом
+    users = [make_user(f"six{i}", slots, ["Canteen"], ["6+"]) for i in range(8)]
+    result = large_group_run(users, [("Canteen", 12)])
+    assert [len(g["participants"]) for g in result] == [8], f"❌ Нет группы 6+: {result}"
+
+    # 18+: двадцать человек в зале на 24
+    users = [make_user(f"big{i}", slots, ["Hall"], ["18+"]) for i in range(20)]
+    result = large_group_run(users, [("Hall", 24)])
+    assert [len(g["participants"]) for g in result] == [20], f"❌ Нет группы 18+: {result}"
+
+    # 14 совместимых при столе на 12: делим 7 + 7, а не 12 + двое без группы
+    users = [make_user(f"split{i}", slots, ["Canteen"], ["6+"]) for i in range(14)]
+    result = large_group_run(users, [("Canteen", 12)])
+    assert sorted(len(g["participants"]) for g in result) == [7, 7], f"❌ Группа не поделена: {result}"
+    assert {p for g in result for p in g["participants"]} == {u["login"] for u in users}
+
+    # Согласный и на "3-5" не уходит седьмым в группу 6+, если без него не соберётся малая
+    users = ([make_user(f"only{i}", slots, ["Canteen", "Cafe"], ["6+"]) for i in range(6)]
+             + [make_user("flex", slots, ["Canteen", "Cafe"], ["6+", "3-5"])]
+             + [make_user(f"small{i}", slots, ["Canteen", "Cafe"], ["3-5"]) for i in range(2)])
+    result = large_group_run(users, [("Canteen", 12), ("Cafe", 4)])
+    assert sorted(len(g["participants"]) for g in result) == [3, 6], f"❌ Большая группа забрала гибкого: {result}"
+
+    # ...но берётся, если без него остаток не рассадить: 11 при столе на 8 — 8 и трое, а 12 — 6 + 6
+    users = ([make_user(f"only{i}", slots, ["Canteen"], ["6+"]) for i in range(11)]
+             + [make_user("flex", slots, ["Canteen"], ["2", "6+"])])
+    result = large_group_run(users, [("Canteen", 8)])
+    assert sorted(len(g["participants"]) for g in result) == [6, 6], f"❌ Гибкий не добрал деление: {result}"
+
+    # Из равно гибких добирается более "жёсткий": второй остаётся на пару тому, кто согласен только на 2
+    users = ([make_user(f"only{i}", slots, [], ["6+"]) for i in range(5)]
+             + [make_user("fav_flex", slots, ["Canteen"], ["2", "6+"], duration=60),
+               make_user("flex", slots, [], ["2", "3-5", "6+"])]
+             + [make_user("pair", slots, [], ["2"])] + [make_user(f"small{i}", slots, [], ["2", "3-5"]) for i in range(2)])
+    result = large_group_run(users, [("Canteen", 12), ("Cafe", 4)])
+    assert sorted(len(g["participants"]) for g in result) == [2, 2, 6], f"❌ Большая группа забрала не того: {result}"
+
+    # ...и тот, у кого меньше возможных пар: с "pair" по времени совпадает только "early"
+    users = ([make_user(f"only{i}", slots, [], ["6+"]) for i in range(5)]
+             + [make_user("early", slots, [], ["2", "6+"], duration=60),
+                make_user("late", [("13:00", "14:00")], [], ["2", "6+"])]
+             + [make_user("pair", [("12:00", "12:30")], [], ["2"])])
+    result = large_group_run(users, [("Canteen", 12)])
+    assert sorted(g["participants"] for g in result if len(g["participants"]) == 2) == [["early", "pair"]], \
+        f"❌ Большая группа забрала единственную пару: {result}"
+
+    # Согласным на "3-5" вдвоём малую не собрать — они идут в большую: 12 при столе на 10 — 6 + 6
+    users = ([make_user(f"only{i}", slots, [], ["6+"]) for i in range(10)]
+             + [make_user(f"flex{i}", slots, [], ["3-5", "6+"]) for i in range(2)])
+    result = large_group_run(users, [("Canteen", 10)])
+    assert sorted(len(g["participants"]) for g in result) == [6, 6], f"❌ Гибкие без пары не добраны: {result}"
+
+    # Седьмой "6+" за стол на 6 не садится — гибкий не добирается зря и остаётся на пару
+    # (без слотов они при делении идут последними, гибкий со слотом — первым)
+    picky = make_user("picky", [], [], ["6+"])
+    picky["parameters"]["non_desirable_places"] = ["Hall"]
+    users = ([picky] + [make_user(f"only{i}", [], [], ["6+"]) for i in range(6)]
+             + [make_user("flex", slots, [], ["2", "6+"]), make_user("pair", slots, [], ["2"])])
+    result = large_group_run(users, [("Canteen", 6), ("Hall", 8)])
+    assert sorted(len(g["participants"]) for g in result) == [2, 6], f"❌ Гибкий добран зря: {result}"
+    print("✅ Большие группы: 6+, 18+ и деление под вместимость стола")
+
+def run_matcher_cli(input_path, output_path, stdin_text=None):
+    return subprocess.run(
+        [sys.executable, "matcher.py", "-i", input_path, "-p", PLACES_FILE, "-o", output_path,
+         "--now", NOW.isoformat(timespec="minutes"), "--log-file", "-"],
+        input=stdin_text, capture_output=True, text=True, encoding="utf-8", check=True)
+
+def test_streaming_mode():
+    users = load_users()
+    handle = tempfile.NamedTemporaryFile(suffix=".json", delete=False)
+    handle.close()
+    try:
+        run_matcher_cli(USERS_FILE, handle.name)
+        with open(handle.name, encoding="utf-8") as f:
+            file_groups = json.load(f)
+    finally:
+        os.remove(handle.name)
+    assert file_groups, "❌ Файловый режим не нашёл групп"
+
+    as_array = json.dumps(users, ensure_ascii=False)
+    as_jsonl = "\n".join(json.dumps(user, ensure_ascii=False) for user in users) + "\n"
+    for name, text in (("JSON-массив", as_array), ("JSONL", as_jsonl)):
+        run = run_matcher_cli("-", "-", text)
+        # stdout — только группы, по одной JSON-строке; сообщения для человека — в stderr
+        lines = run.stdout.splitlines()
+        assert all(line.startswith("{") for line in lines), f"❌ {name}: в stdout не только JSONL: {run.stdout[:200]}"
+        assert [json.loads(line) for line in lines] == file_groups, f"❌ {name}: группы отличаются от файлового режима"
+        assert "📥" in run.stderr and f"Найдено {len(file_groups)} групп" in run.stderr, \
+            f"❌ {name}: нет сообщений в stderr: {run.stderr[-300:]}"
+    print(f"✅ Потоковый режим: JSON-массив и JSONL из stdin, {len(file_groups)} групп в stdout, как из файла")
+
 def run_tests():
     print("📥 Загружаем тестовые данные...")
     users = load_users()
@@ -36,7 +267,7 @@ def run_tests():
 
     # Прямой вызов match_lunch
     print("🔍 Запускаем мэтчинг...")
-    result = match_lunch(users, PLACES_FILE)
+    result = match_lunch(users, PLACES_FILE, now=NOW)
     save_result(result)
     print(f"✅ Результат сохранён в {OUTPUT_FILE}")
 
@@ -94,23 +325,23 @@ def run_tests():
     print("✅ Тест 4: Предпочтения по местам соблюдены")
 
     # === Тест 5: Размер группы совместим с team_size_lst
-    size_map = {
-        2: ["2", "3-5", "6+"],
-        3: ["3-5", "6+"],
-        4: ["3-5", "6+"],
-        5: ["3-5", "6+"],
-        6: ["6+"],
-        7: ["6+"],
-        8: ["6+"],
-        9: ["6+"],
-        10: ["6+"],
-    }
+    def allowed_sizes_for(size):
+        allowed = []
+        if size == 2:
+            allowed.append("2")
+        if 3 <= size <= 5:
+            allowed.append("3-5")
+        if size >= 6:
+            allowed.append("6+")
+        if size >= 18:
+            allowed.append("18+")
+        return allowed
 
     for group in result:
         if len(group["participants"]) == 1:
             continue
         team_size = len(group["participants"])
-        allowed_sizes = size_map.get(team_size, [])
+        allowed_sizes = allowed_sizes_for(team_size)
         for login in group["participants"]:
             user = next(u for u in users if u["login"] == login)
             user_allowed = user["parameters"]["team_size_lst"]
@@ -206,7 +437,7 @@ def run_tests():
 
     # === Тест 11: Проверка, что мэтчинг стабилен (повторный запуск даёт тот же результат)
     # Запускаем второй раз и сравниваем
-    result2 = match_lunch(users, PLACES_FILE)
+    result2 = match_lunch(users, PLACES_FILE, now=NOW)
     # Сравниваем по ключевым полям: участники, время, место
     def normalize_group(g):
         return {
@@ -223,7 +454,7 @@ def run_tests():
     import time as tm
     start_time = tm.time()
     for _ in range(3):  # Среднее по 3 запускам
-        match_lunch(users, PLACES_FILE)
+        match_lunch(users, PLACES_FILE, now=NOW)
     avg_time = (tm.time() - start_time) / 3
     assert avg_time < 5, f"❌ Мэтчинг слишком медленный: {avg_time:.2f} сек"
     print(f"✅ Тест 12: Производительность хорошая: {avg_time:.2f} сек в среднем")
@@ -247,12 +478,14 @@ def run_tests():
 
     print("✅ Тест 14: Учёт строгих ограничений по размеру команды")
 
-    # === Тест 15: Проверка, что группы не слишком большие (например, не больше 10)
-    max_group_size = 10
+    # === Тест 15: Группа помещается за стол своего места (6+ и 18+ ограничены только max_table_size)
     for group in result:
+        if group["place"] is None:
+            continue
         size = len(group["participants"])
-        assert size <= max_group_size, f"❌ Группа слишком большая: {size} > {max_group_size}"
-    print(f"✅ Тест 15: Максимальный размер группы — {max_group_size}")
+        capacity = int(places_dict[group["place"]]["max_table_size"])
+        assert size <= capacity, f"❌ Группа из {size} не помещается в {group['place']} (стол на {capacity})"
+    print("✅ Тест 15: Все группы помещаются за стол своего места")
 
     print(f"🎉 Все тесты пройдены! Найдено {len(result)} групп, одиночек: {solo_count}")
     print("💡 Рекомендация: Добавь тесты с edge-кейсами (пустые предпочтения, один пользователь и т.п.)")
@@ -284,4 +517,9 @@ def run_tests():
     print("✅ Тест 15: Проверка отсутствия искусственных ограничений на размер группы")
 
 if __name__ == "__main__":
+    test_result_cache()
+    test_equivalence_classes()
+    test_large_groups()
+    test_sweep_line()
+    test_streaming_mode()
     run_tests()
\ No newline at end of file
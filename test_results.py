@@ -0,0 +1,128 @@
+# test_results.py
+
+import asyncio
+import json
+import os
+import tempfile
+from datetime import date, timedelta
+
+from bot import handlers, results
+
+
+def group(participants, lunch_time=("12:00", "12:30"), place="Snedi"):
+    return {"participants": list(participants), "lunch_time": list(lunch_time) if lunch_time else None, "place": place}
+
+
+def test_group_diff():
+    old = results.publish([
+        group(["a", "b"]),
+        group(["c", "d"]),
+        group(["e", "f"], place="Mama"),
+        group(["g", "h"]),
+    ])
+    new = results.publish([
+        group(["a", "b"]),                                # тот же состав, время и место
+        group(["c", "d"], lunch_time=("13:00", "13:30")),  # тот же состав, другое время
+        group(["e", "f"], place="Green Garden"),           # тот же состав, другое место
+        group(["g", "x"]),                                 # новый состав
+    ])
+    changes = results.diff(old, new)
+
+    assert (changes.old_version, changes.new_version) == (old.version, new.version)
+    assert changes.summary() == {"added": 1, "dissolved": 1, "changed": 2, "unchanged": 1}
+    assert [g["participants"] for g in changes.unchanged] == [["a", "b"]]
+    assert [g["participants"] for g in changes.added] == [["g", "x"]]
+    assert [g["participants"] for g in changes.dissolved] == [["g", "h"]]
+    assert sorted((old_g["place"], new_g["place"]) for old_g, new_g in changes.changed) == \
+        [("Mama", "Green Garden"), ("Snedi", "Snedi")]
+    # Участники неизменённой группы уведомление не получают, распавшейся — получают
+    assert changes.affected_logins() == {"c", "d", "e", "f", "g", "h", "x"}
+    print("✅ diff: новые, распавшиеся, изменённые и неизменные группы")
+
+
+def test_group_diff_same_snapshot():
+    snapshot = results.publish([group(["a", "b"]), group(["c"], lunch_time=None, place=None)])
+    changes = results.diff(snapshot, snapshot)
+    assert changes.summary() == {"added": 0, "dissolved": 0, "changed": 0, "unchanged": 2}
+    assert changes.affected_logins() == set()
+
+    # Первый diff после перезапуска: база пустая, все группы новые
+    changes = results.diff(results.notified_baseline(), snapshot)
+    assert changes.summary()["added"] == 2
+    assert changes.affected_logins() == {"a", "b", "c"}
+    print("✅ diff: без изменений и от пустой базы")
+
+
+def test_group_key_scoped_to_day():
+    day = date(2026, 1, 5)
+    key = results.group_key(group(["a", "b"]), day)
+    assert key != results.group_key(group(["a", "b"]), day + timedelta(days=1))
+    assert results.group_key(None, day) == "2026-01-05_"
+    # Вчерашние ключи (и ключи старого формата без даты) не считаются оповещением
+    notified = {"a": key, "b": results.group_key(group(["a", "b"]), day - timedelta(days=1)),
+                "c": "['a', 'b']_['12:00', '12:30']_Snedi"}
+    assert results.keys_of_day(notified, day) == {"a": key}
+
+    snapshot = results.publish([group(["a", "b"])])
+    results.mark_notified(snapshot, day)
+    assert results.notified_baseline(day) is snapshot
+    assert results.notified_baseline(day + timedelta(days=1)).groups == ()
+    print("✅ ключ оповещения и база diff действуют в пределах дня")
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, user_id, text):
+        self.sent.append(user_id)
+
+
+class FakeDate(date):
+    current = date(2026, 1, 5)
+
+    @classmethod
+    def today(cls):
+        return cls.current
+
+
+def test_repeated_group_next_day():
+    workdir = tempfile.mkdtemp()
+    output_file = os.path.join(workdir, "output.json")
+    with open(output_file, "w", encoding="utf-8") as f:
+        json.dump([group(["a", "b"])], f)
+    notified = {}
+    patched = {
+        "date": FakeDate,
+        "get_match_logins": lambda: {"a", "b"},
+        "get_user_ids": lambda: {"a": 1, "b": 2},
+        "read_notified_groups": lambda: dict(notified),
+        "write_notified_groups": lambda data: (notified.clear(), notified.update(data)),
+    }
+    originals = {name: getattr(handlers, name) for name in patched}
+    for name, value in patched.items():
+        setattr(handlers, name, value)
+    try:
+        bot = FakeBot()
+        asyncio.run(handlers._notify_all_new_groups(bot, output_file))
+        assert sorted(bot.sent) == [1, 2]
+        # Тот же результат в тот же день — повторно не оповещаем
+        asyncio.run(handlers._notify_all_new_groups(bot, output_file))
+        assert sorted(bot.sent) == [1, 2]
+        # На следующий день та же группа (состав, время, место) — новое назначение
+        FakeDate.current += timedelta(days=1)
+        asyncio.run(handlers._notify_all_new_groups(bot, output_file))
+        assert sorted(bot.sent) == [1, 1, 2, 2]
+        assert set(notified.values()) == {results.group_key(group(["a", "b"]), FakeDate.current)}
+    finally:
+        for name, value in originals.items():
+            setattr(handlers, name, value)
+        FakeDate.current = date(2026, 1, 5)
+    print("✅ та же группа на следующий день оповещается снова")
+
+
+if __name__ == "__main__":
+    test_group_diff()
+    test_group_diff_same_snapshot()
+    test_group_key_scoped_to_day()
+    test_repeated_group_next_day()
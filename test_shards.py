@@ -0,0 +1,154 @@
+# test_shards.py
+
+import asyncio
+import json
+import os
+import tempfile
+from datetime import datetime
+
+from bot import utils
+
+NOW = datetime(2026, 1, 5, 10, 0)
+PLACES_FILE = os.path.join("test", "places.csv")
+
+
+def user(login, office="Avrora", start="12:00", end="13:00"):
+    return {"login": login, "parameters": {
+        "office": office, "time_slots": [[start, end]], "max_lunch_duration": 30,
+        "favourite_places": ["Snedi"], "non_desirable_places": [], "team_size_lst": ["2"],
+    }}
+
+
+def write_pool(path, users):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(users, f, ensure_ascii=False)
+
+
+def shard_workspace():
+    workdir = tempfile.mkdtemp()
+    utils.SHARDS_DIR = os.path.join(workdir, "shards")
+    os.makedirs(utils.SHARDS_DIR)
+    utils._planned_shards.clear()
+    utils._shard_runs.clear()
+    return os.path.join(workdir, "users_to_match.json")
+
+
+def test_concurrent_runs_coalesce():
+    shards_dir, run_shard = utils.SHARDS_DIR, utils._run_shard_async
+    users_file = shard_workspace()
+    runs = []
+
+    # Прогон, который заканчивается после того, как в офис записался ещё один пользователь
+    async def slow_run(shard_id, shard, places_file, now=None, mode='async'):
+        runs.append(sorted(u["login"] for u in shard["users"]))
+        await asyncio.sleep(0.05)
+        utils._store_shard(shard_id, shard, [{"participants": runs[-1]}])
+        return []
+
+    async def scenario():
+        write_pool(users_file, [user("a"), user("b")])
+        shards, stale = utils.plan_office_shards(users_file, PLACES_FILE, NOW)
+        older = asyncio.create_task(utils._ensure_shard_async(stale[0], PLACES_FILE))
+        await asyncio.sleep(0.01)
+        write_pool(users_file, [user("a"), user("b"), user("c")])
+        _, stale = utils.plan_office_shards(users_file, PLACES_FILE, NOW)
+        newer = asyncio.create_task(utils._ensure_shard_async(stale[0], PLACES_FILE))
+        await asyncio.gather(older, newer)
+        return shards
+
+    utils._run_shard_async = slow_run
+    try:
+        shards = asyncio.run(scenario())
+        # Второй прогон не шёл параллельно первому, а досчитал последний план;
+        # оба ожидающих получили управление, только когда сохранён результат с "c"
+        assert runs == [["a", "b"], ["a", "b", "c"]]
+        (shard_id,) = shards
+        assert utils._read_shard(shard_id)["groups"] == [{"participants": ["a", "b", "c"]}]
+        assert utils._read_shard(shard_id)["hash"] == utils._planned_shards[shard_id]["hash"]
+        # Без изменений пересчитывать нечего
+        assert utils.plan_office_shards(users_file, PLACES_FILE, NOW)[1] == []
+    finally:
+        utils.SHARDS_DIR, utils._run_shard_async = shards_dir, run_shard
+    print("✅ shards: параллельные записи в офис не перезаписывают результат старым прогоном")
+
+
+def store_planned(shards):
+    for shard_id, shard in shards.items():
+        utils._store_shard(shard_id, shard, [{"participants": sorted(u["login"] for u in shard["users"])}])
+
+
+def test_plan_office_shards():
+    shards_dir = utils.SHARDS_DIR
+    users_file = shard_workspace()
+    try:
+        write_pool(users_file, [user("a"), user("b"), user("p", office="Park")])
+        shards, stale = utils.plan_office_shards(users_file, PLACES_FILE, NOW)
+        by_office = {shard["office"]: shard_id for shard_id, shard in shards.items()}
+        assert sorted(by_office) == ["avrora", "park"] and sorted(stale) == sorted(shards)
+        store_planned(shards)
+
+        # Ничего не изменилось (порядок записей не важен) — пересчитывать нечего
+        write_pool(users_file, [user("b"), user("p", office="Park"), user("a")])
+        assert utils.plan_office_shards(users_file, PLACES_FILE, NOW)[1] == []
+
+        # Изменился только один офис — пересчитывается только он
+        write_pool(users_file, [user("a"), user("b"), user("p", office="Park"), user("q", office="Park")])
+        shards, stale = utils.plan_office_shards(users_file, PLACES_FILE, NOW)
+        assert stale == [by_office["park"]]
+        store_planned(shards)
+        print("✅ shards: пересчитываются только изменившиеся офисы")
+    finally:
+        utils.SHARDS_DIR = shards_dir
+
+
+def test_plan_time_bucket():
+    shards_dir = utils.SHARDS_DIR
+    users_file = shard_workspace()
+    try:
+        write_pool(users_file, [user("a", start="11:00", end="12:00"), user("b", start="13:00", end="14:00")])
+        shards, _ = utils.plan_office_shards(users_file, PLACES_FILE, NOW)
+        store_planned(shards)
+        users = shards[next(iter(shards))]["users"]
+        assert utils._shard_time_bucket(users, NOW) == "2026-01-05:0"
+        # Пока ни одно начало слота не ушло за now + MIN_LEAD_MINUTES, корзина та же
+        assert utils.plan_office_shards(users_file, PLACES_FILE, NOW.replace(minute=50))[1] == []
+        # Начало 11:00 стало недоступно — корзина сдвинулась, шард устарел
+        later = NOW.replace(hour=10, minute=56)
+        assert utils._shard_time_bucket(users, later) == "2026-01-05:1"
+        assert utils.plan_office_shards(users_file, PLACES_FILE, later)[1] == list(shards)
+        # Новый день — тоже новая корзина
+        assert utils.plan_office_shards(users_file, PLACES_FILE, NOW.replace(day=6))[1] == list(shards)
+        print("✅ shards: сдвиг временной корзины делает шард устаревшим")
+    finally:
+        utils.SHARDS_DIR = shards_dir
+
+
+def test_merge_drops_departed_offices():
+    shards_dir = utils.SHARDS_DIR
+    users_file = shard_workspace()
+    output_file = os.path.join(os.path.dirname(users_file), "output.json")
+    try:
+        write_pool(users_file, [user("a"), user("b"), user("p", office="Park")])
+        shards, _ = utils.plan_office_shards(users_file, PLACES_FILE, NOW)
+        store_planned(shards)
+        snapshot = utils.merge_shard_results(shards, output_file)
+        assert sorted(g["participants"] for g in snapshot.groups) == [["a", "b"], ["p"]]
+
+        # В офисе Park записей не осталось: его сохранённый шард в результат не попадает
+        write_pool(users_file, [user("a"), user("b")])
+        shards, stale = utils.plan_office_shards(users_file, PLACES_FILE, NOW)
+        assert stale == []
+        snapshot = utils.merge_shard_results(shards, output_file)
+        assert [g["participants"] for g in snapshot.groups] == [["a", "b"]]
+        with open(output_file, encoding="utf-8") as f:
+            assert [g["participants"] for g in json.load(f)] == [["a", "b"]]
+        print("✅ shards: шарды офисов без записей отбрасываются при слиянии")
+    finally:
+        utils.SHARDS_DIR = shards_dir
+
+
+if __name__ == "__main__":
+    test_concurrent_runs_coalesce()
+    test_plan_office_shards()
+    test_plan_time_bucket()
+    test_merge_drops_departed_offices()
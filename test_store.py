@@ -0,0 +1,166 @@
+# test_store.py
+
+import asyncio
+import json
+import os
+import tempfile
+
+from bot import results, store, utils
+
+PROFILE = {
+    "office": "Avrora", "time_slots": [["12:00", "13:00"]], "lunch_duration": "30",
+    "favorite_places": ["Snedi"], "disliked_places": [], "company_size": ["2"],
+}
+
+
+def paths():
+    workdir = tempfile.mkdtemp()
+    users_csv = os.path.join(workdir, "users_data.csv")
+    users_to_match = os.path.join(workdir, "users_to_match.json")
+    utils.ensure_csv_exists(users_csv)
+    utils.ensure_json_exists(users_to_match)
+    return users_csv, users_to_match
+
+
+def pool_logins(path):
+    return sorted(user["login"] for user in utils.read_match_pool(path))
+
+
+def params(office="Avrora"):
+    return {"office": office, "time_slots": [["12:00", "13:00"]]}
+
+
+def run_actor(scenario):
+    async def main():
+        actor = store.StorageActor(*paths())
+        actor.start()
+        writes = []
+        write = actor._write
+
+        def counted(snapshots):
+            writes.append(snapshots)
+            return write(snapshots)
+
+        actor._write = counted
+        try:
+            return await scenario(actor, writes)
+        finally:
+            await actor.stop()
+    return asyncio.run(main())
+
+
+def test_group_commit():
+    async def scenario(actor, writes):
+        await asyncio.gather(*(actor.update_user_to_match(f"u{i}", params()) for i in range(5)),
+                             actor.save_user_data(1, "u0", PROFILE))
+        # Все изменения одного пакета — одна запись на диск
+        assert len(writes) == 1
+        assert pool_logins(actor.paths[store.POOL]) == ["u0", "u1", "u2", "u3", "u4"]
+        assert [row[1] for row in utils.read_profile_rows(actor.paths[store.PROFILES])] == ["u0"]
+    run_actor(scenario)
+    print("✅ store: параллельные upsert'ы — одна групповая запись")
+
+
+def test_read_sees_queued_upsert():
+    async def scenario(actor, writes):
+        _, profile, _, size = await asyncio.gather(
+            actor.save_user_data(7, "alice", PROFILE), actor.get_user_data(7),
+            actor.update_user_to_match("alice", params()), actor.match_pool_size())
+        assert profile["office"] == "Avrora" and profile["favorite_places"] == ["Snedi"]
+        assert size == 1
+        assert await actor.get_user_data(8) is None
+    run_actor(scenario)
+    print("✅ store: чтение видит upsert из того же пакета")
+
+
+def test_failing_op_rejects_only_its_future():
+    async def scenario(actor, writes):
+        # Профиль без полей — ошибка только у своего сообщения
+        outcomes = await asyncio.gather(actor.update_user_to_match("a", params()),
+                                        actor.save_user_data(1, "b", {}),
+                                        actor.update_user_to_match("c", params()),
+                                        return_exceptions=True)
+        assert outcomes[0] is None and outcomes[2] is None
+        assert isinstance(outcomes[1], KeyError)
+        # Ошибка перечитывания файла отклоняет весь пакет, но актор продолжает работать
+        refresh = actor._refresh
+        actor._refresh = lambda: (_ for _ in ()).throw(OSError("disk gone"))
+        try:
+            await actor.match_pool_size()
+            raise AssertionError("пакет с ошибкой _refresh должен быть отклонён")
+        except OSError:
+            pass
+        actor._refresh = refresh
+        assert await actor.match_pool_size() == 2
+        assert not actor._task.done()
+        assert pool_logins(actor.paths[store.POOL]) == ["a", "c"]
+    run_actor(scenario)
+    print("✅ store: ошибка сообщения отклоняет только его future")
+
+
+def test_failed_write_retried():
+    async def scenario(actor, writes):
+        write = actor._write
+        failures = [OSError("no space left")]
+
+        def flaky(snapshots):
+            if failures:
+                raise failures.pop()
+            return write(snapshots)
+
+        actor._write = flaky
+        try:
+            await actor.update_user_to_match("a", params())
+            raise AssertionError("неудачная запись должна вернуть ошибку")
+        except OSError:
+            pass
+        # Изменение осталось в памяти и уходит на диск со следующей фиксацией
+        assert await actor.match_pool_size() == 1
+        assert pool_logins(actor.paths[store.POOL]) == []
+        await actor.update_user_to_match("b", params())
+        assert pool_logins(actor.paths[store.POOL]) == ["a", "b"]
+    run_actor(scenario)
+    print("✅ store: неудачная запись повторяется со следующей фиксацией")
+
+
+def test_refresh_reloads_replaced_file():
+    async def scenario(actor, writes):
+        await actor.update_user_to_match("a", params())
+        # Другой процесс (скрипт с FileLock) заменил пул целиком
+        results.write_json_atomic(actor.paths[store.POOL],
+                                  [{"login": "x", "parameters": params()}, {"login": "y", "parameters": params()},
+                                   {"parameters": params()}])
+        assert await actor.match_pool_size() == 2
+        await actor.update_user_to_match("z", params())
+        assert pool_logins(actor.paths[store.POOL]) == ["x", "y", "z"]
+    run_actor(scenario)
+    print("✅ store: файл, заменённый другим процессом, перечитывается")
+
+
+def test_stop_flushes_pending_writes():
+    users_csv, users_to_match = paths()
+
+    async def main():
+        store.start(users_csv, users_to_match)
+        try:
+            pending = [asyncio.ensure_future(store.update_user_to_match(f"u{i}", params())) for i in range(3)]
+            await asyncio.sleep(0)
+        finally:
+            await store.stop()
+        assert all(task.done() and task.exception() is None for task in pending)
+        assert not store.enabled()
+
+    asyncio.run(main())
+    assert pool_logins(users_to_match) == ["u0", "u1", "u2"]
+    with open(users_to_match, encoding="utf-8") as f:
+        assert all("parameters" in user for user in json.load(f))
+    print("✅ store: stop() дописывает принятые изменения на диск")
+
+
+if __name__ == "__main__":
+    test_group_commit()
+    test_read_sees_queued_upsert()
+    test_failing_op_rejects_only_its_future()
+    test_failed_write_retried()
+    test_refresh_reloads_replaced_file()
+    test_stop_flushes_pending_writes()
@@ -0,0 +1,112 @@
+# test_waves.py
+
+from datetime import datetime
+
+from bot import waves
+from timeutils import to_minutes
+
+NOW = datetime(2026, 1, 5, 11, 0)
+TIME_OPTIONS = ["12:00", "12:30", "13:00", "13:30"]
+
+
+def at(clock):
+    hours, minutes = map(int, clock.split(":"))
+    return NOW.replace(hour=hours, minute=minutes)
+
+
+def wave(cutoff, start, end):
+    return waves.Wave(to_minutes(cutoff), to_minutes(start), to_minutes(end))
+
+
+def scheduler(spec, time_options=TIME_OPTIONS):
+    return waves.WaveScheduler(None, waves.parse_schedule(spec, time_options),
+                               "data/users_to_match.json", "data/places.csv", "data/output.json",
+                               clock=lambda: NOW)
+
+
+def test_parse_schedule():
+    # Волны включаются только явно
+    assert waves.parse_schedule("", TIME_OPTIONS) == {}
+    assert waves.parse_schedule(None, TIME_OPTIONS) == {}
+    assert waves.parse_schedule("off", TIME_OPTIONS) == {}
+    assert waves.parse_schedule("on", TIME_OPTIONS) == {
+        None: (wave("11:40", "12:00", "13:00"), wave("12:40", "13:00", "14:00")),
+    }
+    assert waves.parse_schedule("12:40=13:00-14:00, Avrora|11:30=12:00-13:00, 11:40=12:00-13:00") == {
+        None: (wave("11:40", "12:00", "13:00"), wave("12:40", "13:00", "14:00")),
+        "avrora": (wave("11:30", "12:00", "13:00"),),
+    }
+    for bad in ("11:40", "11:40=12:00", "13:10=12:00-13:00", "11:40=13:00-12:00"):
+        try:
+            waves.parse_schedule(bad)
+        except ValueError:
+            continue
+        raise AssertionError(f"расписание {bad!r} должно быть отклонено")
+    print("✅ waves: разбор расписания")
+
+
+def test_wave_clip():
+    noon = wave("11:40", "12:00", "13:00")
+    # Начало — не раньше окна, конец — не позже конца окна плюс длительность обеда
+    assert noon.clip([["11:00", "14:30"]], 30) == [["12:00", "13:30"]]
+    assert noon.clip([["12:15", "12:45"]], 30) == [["12:15", "12:45"]]
+    assert noon.clip([["11:00", "12:00"], ["12:30", "14:00"]], 60) == [["12:30", "14:00"]]
+    # Слоты вне окна и некорректные слоты отбрасываются
+    assert noon.clip([["13:30", "14:00"], ["11:00", "11:50"]], 30) == []
+    assert noon.clip([["12:30"], ["12:40", "12:10"]], 30) == []
+    # Окно [start, end): слот с началом ровно в конце окна — уже следующей волны
+    assert noon.clip([["13:00", "14:00"]], 30) == []
+    assert noon.clip([["12:59", "14:00"]], 30) == [["12:59", "13:30"]]
+    assert not noon.covers({"time_slots": [["13:00", "14:00"]], "max_lunch_duration": "30"})
+    assert wave("12:40", "13:00", "14:00").covers({"time_slots": [["13:00", "14:00"]]})
+
+    assert noon.covers({"time_slots": [["12:30", "13:00"]]})
+    assert not noon.covers({"time_slots": [["13:30", "14:00"]], "max_lunch_duration": "30"})
+    # Без слотов matcher.py берёт окно по умолчанию — запись попадает в любую волну
+    assert noon.covers({"time_slots": []})
+    print("✅ waves: обрезка слотов по окну волны")
+
+
+def test_due_waves():
+    planner = scheduler("on")
+    noon, one = planner.waves_for("avrora")
+
+    assert planner.due_waves({"avrora", "kometa"}, at("11:39")) == {}
+    assert planner.due_waves({"avrora", "kometa"}, at("11:40")) == {"avrora": noon, "kometa": noon}
+    # По офису — только самая ранняя незакрытая волна, даже если наступило закрытие нескольких
+    assert planner.due_waves({"avrora"}, at("12:50")) == {"avrora": noon}
+
+    planner.closed.add(("avrora", noon))
+    assert planner.due_waves({"avrora", "kometa"}, at("12:50")) == {"avrora": one, "kometa": noon}
+    assert planner.due_waves({"avrora"}, at("12:00")) == {}
+    planner.closed.add(("avrora", one))
+    assert planner.due_waves({"avrora"}, at("13:30")) == {}
+
+    # Ближайшая волна для записи: незакрытая, окно ещё не прошло, слоты попадают в окно
+    params = {"time_slots": [["12:30", "13:30"]], "max_lunch_duration": "30"}
+    assert planner.next_wave("kometa", params, at("11:00")) == noon
+    assert planner.next_wave("kometa", params, at("13:10")) == one
+    assert planner.next_wave("avrora", params, at("11:00")) is None
+    print("✅ waves: выбор волн к закрытию")
+
+
+def test_due_waves_per_office():
+    planner = scheduler("Avrora|11:30=12:00-13:00,11:40=12:00-13:00")
+    early, noon = planner.waves_for("avrora")[0], planner.waves_for("kometa")[0]
+
+    assert planner.due_waves({"avrora", "kometa"}, at("11:35")) == {"avrora": early}
+    assert planner.due_waves({"avrora", "kometa"}, at("11:40")) == {"avrora": early, "kometa": noon}
+    # Офис из расписания закрывает волну, даже если записей в нём нет
+    assert planner.schedule_offices({"kometa": []}) == {"avrora", "kometa"}
+    # Планировщик просыпается к ближайшему закрытию, но не реже POLL_SECONDS
+    assert planner.seconds_until_next(at("11:39")) == 60
+    assert planner.seconds_until_next(at("11:39").replace(second=30)) == 30
+    assert planner.seconds_until_next(at("12:00")) == waves.POLL_SECONDS
+    print("✅ waves: расписание отдельного офиса")
+
+
+if __name__ == "__main__":
+    test_parse_schedule()
+    test_wave_clip()
+    test_due_waves()
+    test_due_waves_per_office()
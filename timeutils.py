@@ -0,0 +1,67 @@
+"""
+Время суток для матчинга и бота: строки "HH:MM" разбираются один раз в минуты
+от полуночи (int), в строки время превращается только на границах (JSON, сообщения).
+"""
+import math
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Tuple
+
+MINUTES_PER_DAY = 24 * 60
+
+# Обед не может начаться раньше, чем через столько минут от текущего момента
+MIN_LEAD_MINUTES = 5
+
+
+@lru_cache(maxsize=None)
+def to_minutes(time_str: str) -> int:
+    """
+    Парсит "HH:MM" в минуты от полуночи. Различных строк немного (варианты из
+    TIME_OPTIONS и кастомные слоты), поэтому результат кешируется.
+    Бросает ValueError на некорректной строке, как datetime.strptime(..., "%H:%M").
+    """
+    hours, sep, minutes = time_str.partition(":")
+    for part in (hours, minutes):
+        if not (1 <= len(part) <= 2 and part.isascii() and part.isdigit()):
+            raise ValueError(f"Некорректное время: {time_str!r}")
+    if not sep or int(hours) > 23 or int(minutes) > 59:
+        raise ValueError(f"Некорректное время: {time_str!r}")
+    return int(hours) * 60 + int(minutes)
+
+
+def format_minutes(minutes: int) -> str:
+    """Минуты от полуночи в строку "HH:MM"."""
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def parse_interval(start: str, end: str) -> Tuple[int, int]:
+    """Пара строк "HH:MM" в пару минут."""
+    return to_minutes(start), to_minutes(end)
+
+
+def is_valid_interval(start: str, end: str) -> bool:
+    """Проверяет, что обе строки — корректное время и начало раньше конца."""
+    try:
+        start_min, end_min = parse_interval(start, end)
+    except (ValueError, TypeError, AttributeError):
+        return False
+    return start_min < end_min
+
+
+def clock_minutes(moment: datetime) -> float:
+    """Время суток момента в минутах от полуночи (с долями минуты)."""
+    return moment.hour * 60 + moment.minute + (moment.second + moment.microsecond / 1e6) / 60
+
+
+def min_start_minutes(now: datetime) -> int:
+    """Самое раннее допустимое начало обеда (now + MIN_LEAD_MINUTES) в минутах, с округлением вверх."""
+    return math.ceil(clock_minutes(now + timedelta(minutes=MIN_LEAD_MINUTES)))
+
+
+def parse_now(value: str, today: datetime = None) -> datetime:
+    """Момент "сейчас" из "HH:MM" (сегодняшняя дата) или ISO-строки — для воспроизводимых прогонов."""
+    if "T" in value or "-" in value:
+        return datetime.fromisoformat(value)
+    today = today or datetime.now()
+    minutes = to_minutes(value)
+    return today.replace(hour=minutes // 60, minute=minutes % 60, second=0, microsecond=0)